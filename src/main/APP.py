@@ -1,14 +1,20 @@
 import logging
-from flask import Flask
+import threading
+from flask import Flask, jsonify
 from flask_cors import CORS
 
-from config import API_HOST, API_PORT, DEBUG_MODE
+from config import API_HOST, API_PORT, DEBUG_MODE, FAST_START, MODEL_WARMUP
 from model_loader import model_loader
 from database import db_manager
+from rag_service import rag_service
+from services.reconcile_service import reconcile_service
 from routes.scl90_routes import scl90_bp
 from routes.analysis_routes import analysis_bp
 from routes.knowledge_routes import knowledge_bp
+from routes.emotion_routes import emotion_bp
 from utils.logging_config import setup_logging, RequestLogger
+from utils.metrics import metrics
+from utils.readiness import readiness, LOADING, READY, FAILED
 
 setup_logging()
 
@@ -19,22 +25,47 @@ RequestLogger(app)
 
 logger = logging.getLogger(__name__)
 
-model_loader.load_models()
+readiness.register("database")
 
-try:
-    db_manager._init_pool()
-    if db_manager._available:
-        db_manager.init_db()
-    else:
-        logger.warning("数据库不可用，部分功能将受限")
-except Exception as e:
-    logger.error(f"数据库初始化失败: {e}")
 
-logger.info(f"所有模块初始化完成！后端服务就绪，监听端口 {API_PORT}...")
+def init_database():
+    readiness.set("database", LOADING)
+    try:
+        db_manager._init_pool()
+        if db_manager._available:
+            db_manager.init_db()
+            readiness.set("database", READY)
+        else:
+            logger.warning("数据库不可用，部分功能将受限")
+            readiness.set("database", FAILED, error="数据库不可用")
+    except Exception as e:
+        logger.error(f"数据库初始化失败: {e}")
+        readiness.set("database", FAILED, error=str(e))
+
+
+def init_backend():
+    """初始化数据库与向量库、加载并预热模型"""
+    init_database()
+    rag_service.initialize()
+    rag_service.build_lexical_index()
+    reconcile_service.start()
+    model_loader.load_models()
+    if MODEL_WARMUP:
+        model_loader.warm_up()
+    logger.info(f"所有模块初始化完成！后端服务就绪，监听端口 {API_PORT}...")
+
+
+if FAST_START:
+    # 先开始监听端口，健康检查与非模型接口立即可用；模型接口在就绪前返回 503
+    threading.Thread(target=init_backend, name="backend-init", daemon=True).start()
+    logger.info("快速启动：数据库与模型在后台加载")
+else:
+    init_backend()
 
 app.register_blueprint(scl90_bp, url_prefix='/api/scl90')
 app.register_blueprint(analysis_bp, url_prefix='/api')
 app.register_blueprint(knowledge_bp, url_prefix='/api/knowledge')
+app.register_blueprint(emotion_bp, url_prefix='/api/emotion')
 
 @app.route("/health", methods=["GET"])
 def health_check():
@@ -42,13 +73,35 @@ def health_check():
         "code": 200,
         "msg": "ok",
         "data": {
-            "database": db_manager.health_check(),
+            "database": db_manager.health_check() if readiness.state("database") == READY else False,
             "models": {
                 "emotion": model_loader.emotion_classifier is not None,
                 "llm": model_loader.advice_generator is not None
-            }
+            },
+            "components": readiness.snapshot()
         }
     }
 
+@app.route("/health/live", methods=["GET"])
+def liveness_check():
+    """存活探针：进程能响应即可"""
+    return {"code": 200, "msg": "ok"}
+
+@app.route("/health/ready", methods=["GET"])
+def readiness_check():
+    """就绪探针：所有组件结束加载（就绪或已降级）后返回 200，否则 503"""
+    components = readiness.snapshot()
+    if not readiness.all_settled():
+        return jsonify({"code": 503, "msg": "服务正在启动", "data": components}), 503
+    return {"code": 200, "msg": "ok", "data": components}
+
+@app.route("/metrics", methods=["GET"])
+def metrics_snapshot():
+    return {
+        "code": 200,
+        "msg": "ok",
+        "data": metrics.snapshot()
+    }
+
 if __name__ == '__main__':
     app.run(host=API_HOST, port=API_PORT, debug=DEBUG_MODE)
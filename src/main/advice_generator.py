@@ -1,21 +1,140 @@
 # -------------------------- 建议生成模块 --------------------------
+import copy
+import glob
+import importlib.util
 import logging
+import os
+import threading
+import time
+from collections import namedtuple
 import torch
-from transformers import AutoTokenizer, AutoModel
-from config import CHATGLM_6B_INT4_DIR, DEVICE, LLM_MAX_LEN, MAX_NEW_TOKENS
+from transformers import (
+    AutoConfig, AutoTokenizer, AutoModel, LogitsProcessorList, StoppingCriteria,
+    RepetitionPenaltyLogitsProcessor, TemperatureLogitsWarper, TopPLogitsWarper
+)
+from prompt_assembler import PromptAssembler
+from llm_backend import create_backend, deadline_exceeded_counter, cancelled_counter
+from config import (
+    CHATGLM_6B_INT4_DIR, DEVICE, LLM_MAX_LEN, MAX_NEW_TOKENS, LLM_PREFIX_CACHE, LLM_BACKEND, LLM_CPU_DTYPE,
+    RAG_CONTEXT_MAX_TOKENS
+)
+from utils.metrics import metrics
+from utils.resources import rss_bytes, file_rss_bytes, format_bytes
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+DISCLAIMER = "本建议仅供参考，不能替代专业医疗诊断。若持续感到不适，请寻求专业帮助。"
+MAINTENANCE_MESSAGE = "抱歉，心理咨询助手当前正如火如荼地进行维护中，暂时无法生成详细建议。请稍后再试，或直接联系学校心理咨询中心。"
+ERROR_MESSAGE = "生成建议时遇到了一些技术问题，请稍后重试。如果情况紧急，请立即联系辅导员或心理中心。"
+MOCK_STREAM_CHUNK = 8
+
+rag_tokens_saved_counter = metrics.counter("rag_context_tokens_saved_total", "检索上下文按 token 上限截取后少预填充的 token 数")
+load_seconds_gauge = metrics.gauge("llm_load_seconds", "建议生成模型加载耗时（秒）")
+load_rss_gauge = metrics.gauge("llm_load_rss_bytes", "建议生成模型加载完成后的进程常驻内存")
+
+# CPU 加载模式：
+#   float32 : 原方式，整体 .float() 上转
+#   bfloat16: 按 bf16 直接加载，不做上转
+#   int8    : bf16 加载后做 int8 权重量化（优先使用模型自带的量化实现及 CPU kernel）
+#   native  : 已量化的 checkpoint 保持原有量化权重，使用其自带的 CPU kernel；
+#             kernel 要求 float32 输入，其余浮点参数上转为 float32，词嵌入表保持 checkpoint 的 dtype
+#   auto    : 已量化的 checkpoint 用 native，否则用 bfloat16
+# 已量化的 checkpoint 不能再按 bfloat16 / int8 加载（量化 kernel 只接受 float32 输入）
+CPU_DTYPE_MODES = ("auto", "float32", "bfloat16", "int8", "native")
+
+# 静态前缀的 token ids 与其 past_key_values（未启用前缀缓存时为 None）
+PrefixState = namedtuple("PrefixState", ["ids", "past"])
+
+SYSTEM_INSTRUCTION = """你是一位资深心理咨询师，拥有丰富的临床经验和专业知识。你的角色是：
+- 以专业、温暖、共情的态度与来访者沟通
+- 运用心理学理论和技术帮助来访者理解自己的情绪和行为
+- 提供科学、实用的心理调适建议
+- 在必要时引导来访者寻求专业帮助
+
+重要原则：
+1. 你不是在提供医疗诊断，而是在进行心理支持和辅导
+2. 始终保持专业边界，不替代医生或精神科专家的角色
+3. 对于严重心理问题，必须建议来访者寻求专业医疗帮助"""
+
+GENERATION_GUIDELINES = """
+【咨询回应指南】
+
+一、开场共情（必须）
+- 用温暖、理解的语气回应来访者的感受
+- 表达对其困扰的认可和接纳
+- 示例："我理解你现在感到...，这种感觉确实让人很难受。"
+
+二、问题分析
+- 运用心理学视角分析问题的可能成因
+- 帮助来访者看到问题背后的心理机制
+- 可引用【专业知识参考】中的内容增强专业性
+
+三、具体建议（3-5条）
+针对来访者的情况，给出具体、可操作的建议：
+- 情绪调节技巧（如正念呼吸、情绪日记等）
+- 认知调整方法（如识别负面思维模式）
+- 行为改变策略（如渐进式暴露、行为激活）
+- 社会支持建议（如与信任的人沟通）
+
+四、风险干预（根据风险等级）
+- 【高风险/中风险】：必须明确建议"建议您尽快前往学校心理咨询中心或寻求专业心理医生的帮助，这是对自己负责的表现。"
+- 【低风险/无风险】：鼓励其继续关注自身心理健康，必要时寻求支持
+
+五、结束语
+- 表达对来访者的信心和鼓励
+- 提醒可以随时继续沟通
+- 附上免责声明：以上建议基于心理咨询视角，仅供参考。如持续感到不适，请寻求专业心理帮助。"""
+
+DEEP_THINKING_GUIDELINES = """
+
+【深度思考模式补充】
+在回应前，请先进行以下深度分析：
+1. 心理动力学分析：探索问题可能的潜意识根源
+2. 认知行为分析：识别可能存在的认知扭曲
+3. 发展心理学视角：考虑成长经历对当前问题的影响
+4. 制定阶段性咨询计划建议
+
+请展示你的专业分析过程，让来访者更深入地理解自己。"""
+
+class GenerationDeadline(StoppingCriteria):
+    """截止时间（time.time() 时间戳）已过或取消信号被触发时停止生成，reason 记录停止原因"""
+
+    def __init__(self, deadline=None, cancel_event=None):
+        self.deadline = deadline
+        self.cancel_event = cancel_event
+        self.reason = None
+
+    def __call__(self, input_ids=None, scores=None, **kwargs):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            self.reason = "cancelled"
+        elif self.deadline is not None and time.time() >= self.deadline:
+            self.reason = "deadline"
+        return self.reason is not None
+
+
+def _as_segments(value):
+    """历史对话 / 知识参考既可以是已拼好的字符串，也可以是分段列表"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return [v for v in value if v]
+
+
 class AdviceGenerator:
     def __init__(self, model_dir=None, device=None, max_seq_length=None, max_new_tokens=None,
-                 temperature=0.7, top_p=0.95, repetition_penalty=1.1):
+                 temperature=0.7, top_p=0.95, repetition_penalty=1.1, prefix_cache=None, backend=None,
+                 cpu_dtype=None):
         """
         初始化建议生成器
         :param model_dir: 模型路径，默认从config读取。如果为 'mock'，则不加载模型。
         :param device: 运行设备，默认从config读取
         :param max_seq_length: 最大序列长度，默认从config读取
         :param max_new_tokens: 最大生成长度，默认从config读取
+        :param prefix_cache: 是否缓存静态提示词前缀的 KV，默认从config读取
+        :param backend: 生成后端 local / openai，默认从config读取；非 local 时不在本进程加载模型
+        :param cpu_dtype: CPU 加载模式（见 CPU_DTYPE_MODES），默认从config读取
         """
         self.model_dir = model_dir or CHATGLM_6B_INT4_DIR
         self.device = device or DEVICE
@@ -24,35 +143,152 @@ class AdviceGenerator:
         self.temperature = 0.7
         self.top_p = 0.9
         self.repetition_penalty = 1.1
-        self.max_rag_context_length = 4096
+        self.max_rag_context_tokens = RAG_CONTEXT_MAX_TOKENS
         self.max_prompt_length = 4096
         
+        self.enable_prefix_cache = LLM_PREFIX_CACHE if prefix_cache is None else prefix_cache
+        self._prefix_cache = {}
+        self._prefix_lock = threading.Lock()
+        
         self.tokenizer = None
         self.model = None
+        self.prompt_assembler = None
+        self.backend = None
+        self.cpu_dtype = (cpu_dtype or LLM_CPU_DTYPE).lower()
+        self.load_mode = None
+        self.load_seconds = None
+        self.load_rss = None
+        self.quantized = False
+        self.weights_mmapped = None
         
+        backend = (backend or LLM_BACKEND).lower()
         if self.model_dir == 'mock':
              logger.info("⚠️ 建议生成器运行在 MOCK 模式，不加载实际模型")
-        else:
+             backend = "local"
+        elif backend == "local":
             logger.info(f"正在初始化建议生成器，使用模型: {self.model_dir}, 设备: {self.device}")
             self._load_model()
+        self.backend = create_backend(backend, self)
+        if self.backend.name != "local":
+            logger.info(f"建议生成器使用远程生成后端: {self.backend.name} ({self.backend.base_url})")
+        if self.backend.tokenizer is not None:
+            # 本地模型用其分词器，远程后端用近似分词器，两条路径都按同一 token 预算组装 Prompt
+            self.prompt_assembler = PromptAssembler(self.backend.tokenizer)
+
+    def _resolve_cpu_mode(self):
+        """确定 CPU 加载模式；auto 时根据 checkpoint 是否已量化选择"""
+        mode = self.cpu_dtype if self.cpu_dtype in CPU_DTYPE_MODES else "auto"
+        if mode != self.cpu_dtype:
+            logger.warning(f"未知的 LLM_CPU_DTYPE={self.cpu_dtype}，改用 auto")
+        try:
+            model_config = AutoConfig.from_pretrained(self.model_dir, trust_remote_code=True, local_files_only=True)
+            bits = getattr(model_config, "quantization_bit", 0) or 0
+        except Exception:
+            bits = 0
+        self.quantized = bool(bits)
+        if mode == "auto":
+            return "native" if self.quantized else "bfloat16"
+        if mode == "native" and not self.quantized:
+            logger.warning("checkpoint 未量化，native 模式改为 bfloat16")
+            return "bfloat16"
+        if mode in ("bfloat16", "int8") and self.quantized:
+            raise ValueError(
+                f"checkpoint 已是 int{bits} 量化，其 CPU kernel 只接受 float32 输入，"
+                f"LLM_CPU_DTYPE={mode} 不可用，请使用 auto / native / float32"
+            )
+        return mode
+
+    def _cpu_load_kwargs(self, mode):
+        """
+        CPU 加载参数
+        low_cpu_mem_usage 跳过随机初始化、逐个张量从 checkpoint 读入；safetensors 通过 mmap 按需读取，
+        不做 dtype 转换的张量直接引用页缓存，同一台机器上的多个进程共享同一份物理内存
+        """
+        kwargs = {}
+        if importlib.util.find_spec("accelerate") is not None:
+            kwargs["low_cpu_mem_usage"] = True
+        else:
+            logger.warning("未安装 accelerate，无法启用 low_cpu_mem_usage，加载峰值内存会更高")
+        if glob.glob(os.path.join(self.model_dir, "*.safetensors")):
+            kwargs["use_safetensors"] = True
+        else:
+            logger.info("checkpoint 不是 safetensors 格式，无法通过 mmap 共享权重内存")
+        if mode == "float32":
+            kwargs["torch_dtype"] = torch.float32
+        elif mode in ("bfloat16", "int8"):
+            kwargs["torch_dtype"] = torch.bfloat16
+        else:
+            kwargs["torch_dtype"] = "auto"
+        return kwargs
+
+    def _upcast_except_embeddings(self, model):
+        """
+        浮点参数上转为 float32（量化 kernel 的要求），词嵌入表保持 checkpoint 的半精度：
+        嵌入只做查表，查表结果再转为 float32，不影响数值，约省下一半嵌入表内存
+        与输出层共享权重时无法保留，整体上转
+        """
+        embeddings = model.get_input_embeddings() if hasattr(model, "get_input_embeddings") else None
+        weight = getattr(embeddings, "weight", None)
+        output = model.get_output_embeddings() if hasattr(model, "get_output_embeddings") else None
+        if weight is None or weight.dtype not in (torch.float16, torch.bfloat16) \
+                or getattr(output, "weight", None) is weight:
+            return model.float()
+        keep = {id(weight)}
+        for tensor in list(model.parameters()) + list(model.buffers()):
+            if id(tensor) not in keep and tensor.is_floating_point() and tensor.dtype != torch.float32:
+                tensor.data = tensor.data.float()
+        embeddings.register_forward_hook(lambda module, inputs, out: out.float())
+        logger.info(f"词嵌入表保持 {weight.dtype}，其余浮点参数上转为 float32")
+        return model
+
+    def _prepare_cpu_model(self, model, mode):
+        """按加载模式转换 CPU 模型"""
+        if mode == "bfloat16":
+            # 已按 torch_dtype=bfloat16 加载，无需再转换
+            return model
+        if mode == "int8":
+            if hasattr(model, "quantize"):
+                # ChatGLM 自带的权重量化，量化后的线性层走其 CPU kernel（计算使用 float32）
+                model = model.quantize(8)
+                return model.float()
+            return torch.ao.quantization.quantize_dynamic(model.float(), {torch.nn.Linear}, dtype=torch.qint8)
+        if mode == "native":
+            # 量化权重是整数张量保持不变，其余浮点参数按量化 CPU kernel 的要求上转
+            return self._upcast_except_embeddings(model)
+        return model.float()
+
+    def _weights_mmapped(self, file_rss_before):
+        """
+        权重是否仍由 mmap 的 checkpoint 文件提供（多进程可共享物理内存）：
+        文件映射的常驻内存增量达到参数总字节数的一半即认为是；发生 dtype 转换或复制后会落到匿名内存
+        """
+        file_rss_after = file_rss_bytes()
+        if file_rss_before is None or file_rss_after is None or self.model is None:
+            return None
+        param_bytes = sum(p.numel() * p.element_size() for p in self.model.parameters())
+        return param_bytes > 0 and file_rss_after - file_rss_before >= param_bytes / 2
 
     def _load_model(self):
         """加载ChatGLM模型与分词器"""
         try:
+            started = time.perf_counter()
+            file_rss_before = file_rss_bytes()
             self.tokenizer = AutoTokenizer.from_pretrained(
                 self.model_dir,
                 trust_remote_code=True,
                 local_files_only=True
             )
-            self.model = AutoModel.from_pretrained(
-                self.model_dir,
-                trust_remote_code=True,
-                local_files_only=True,
-                device_map="auto" if self.device.type == "cuda" else None
-            )
+            load_kwargs = {"trust_remote_code": True, "local_files_only": True}
+            if self.device.type == "cuda":
+                self.load_mode = "cuda"
+                load_kwargs["device_map"] = "auto"
+            else:
+                self.load_mode = self._resolve_cpu_mode()
+                load_kwargs.update(self._cpu_load_kwargs(self.load_mode))
+            self.model = AutoModel.from_pretrained(self.model_dir, **load_kwargs)
             
             if self.device.type != "cuda":
-                 self.model = self.model.to(self.device).float() # CPU模式通常需要float32
+                 self.model = self._prepare_cpu_model(self.model, self.load_mode).to(self.device)
             
             self.model = self.model.eval()
 
@@ -64,27 +300,37 @@ class AdviceGenerator:
             if not hasattr(self.model, 'all_tied_weights_keys'):
                 self.model.all_tied_weights_keys = []
                 
-            logger.info("✅ 建议生成模型加载成功")
+            self.load_seconds = time.perf_counter() - started
+            self.load_rss = rss_bytes()
+            self.weights_mmapped = self._weights_mmapped(file_rss_before)
+            load_seconds_gauge.set(self.load_seconds)
+            if self.load_rss is not None:
+                load_rss_gauge.set(self.load_rss)
+            logger.info(
+                f"✅ 建议生成模型加载成功 (模式: {self.load_mode}, 耗时: {self.load_seconds:.1f}s, "
+                f"RSS: {format_bytes(self.load_rss)}, 权重内存映射: "
+                f"{'未知' if self.weights_mmapped is None else ('是' if self.weights_mmapped else '否')})"
+            )
         except Exception as e:
             logger.error(f"❌ 建议生成模型加载失败: {str(e)}")
             # 这里不抛出异常，允许服务在无模型情况下启动（降级处理），或者由上层决定是否退出
             # raise RuntimeError(f"建议生成模型加载失败：{str(e)}")
             self.model = None # 标记为不可用
 
-    def _build_prompt(self, user_text, emotion, risk, scl90_summary=None, rag_context=None, deep_thinking=False, conversation_history=None):
-        """构建结构化提示词模板 - 专业心理医生身份"""
-        
-        system_instruction = """你是一位资深心理咨询师，拥有丰富的临床经验和专业知识。你的角色是：
-- 以专业、温暖、共情的态度与来访者沟通
-- 运用心理学理论和技术帮助来访者理解自己的情绪和行为
-- 提供科学、实用的心理调适建议
-- 在必要时引导来访者寻求专业帮助
-
-重要原则：
-1. 你不是在提供医疗诊断，而是在进行心理支持和辅导
-2. 始终保持专业边界，不替代医生或精神科专家的角色
-3. 对于严重心理问题，必须建议来访者寻求专业医疗帮助"""
+    def _build_prompt_prefix(self, deep_thinking=False):
+        """
+        静态提示词前缀：身份设定 + 回应指南
+        同一生成配置（是否深度思考）下每次请求完全相同，可以预先计算其 KV 缓存
+        """
+        generation_guidelines = GENERATION_GUIDELINES
+        if deep_thinking:
+            generation_guidelines += DEEP_THINKING_GUIDELINES
+        return f"{SYSTEM_INSTRUCTION}\n{generation_guidelines}"
 
+    def _build_prompt_suffix(self, user_text, emotion, risk, scl90_summary=None, rag_context=None, conversation_history=None):
+        """动态提示词部分：历史对话、来访者档案、专业知识参考（不做长度控制，完整文本）"""
+        conversation_history = "\n".join(_as_segments(conversation_history))
+        rag_context = "\n".join(_as_segments(rag_context))
         history_context = ""
         if conversation_history:
             history_context = f"""
@@ -107,57 +353,17 @@ class AdviceGenerator:
             context_info = f"""
 【专业知识参考】
 {rag_context}"""
-            
-        generation_guidelines = """
-【咨询回应指南】
-
-一、开场共情（必须）
-- 用温暖、理解的语气回应来访者的感受
-- 表达对其困扰的认可和接纳
-- 示例："我理解你现在感到...，这种感觉确实让人很难受。"
-
-二、问题分析
-- 运用心理学视角分析问题的可能成因
-- 帮助来访者看到问题背后的心理机制
-- 可引用【专业知识参考】中的内容增强专业性
 
-三、具体建议（3-5条）
-针对来访者的情况，给出具体、可操作的建议：
-- 情绪调节技巧（如正念呼吸、情绪日记等）
-- 认知调整方法（如识别负面思维模式）
-- 行为改变策略（如渐进式暴露、行为激活）
-- 社会支持建议（如与信任的人沟通）
-
-四、风险干预（根据风险等级）
-- 【高风险/中风险】：必须明确建议"建议您尽快前往学校心理咨询中心或寻求专业心理医生的帮助，这是对自己负责的表现。"
-- 【低风险/无风险】：鼓励其继续关注自身心理健康，必要时寻求支持
+        return f"{history_context}{user_profile}{context_info}\n\n请按照【咨询回应指南】回应这位来访者："
 
-五、结束语
-- 表达对来访者的信心和鼓励
-- 提醒可以随时继续沟通
-- 附上免责声明：以上建议基于心理咨询视角，仅供参考。如持续感到不适，请寻求专业心理帮助。"""
-
-        if deep_thinking:
-            generation_guidelines += """
-
-【深度思考模式补充】
-在回应前，请先进行以下深度分析：
-1. 心理动力学分析：探索问题可能的潜意识根源
-2. 认知行为分析：识别可能存在的认知扭曲
-3. 发展心理学视角：考虑成长经历对当前问题的影响
-4. 制定阶段性咨询计划建议
-
-请展示你的专业分析过程，让来访者更深入地理解自己。"""
-
-        prompt = f"{system_instruction}\n{user_profile}{context_info}\n{generation_guidelines}"
-        return prompt.strip()
+    def _build_prompt(self, user_text, emotion, risk, scl90_summary=None, rag_context=None, deep_thinking=False, conversation_history=None):
+        """构建结构化提示词模板 - 专业心理医生身份（静态前缀在前，便于复用前缀 KV 缓存）"""
+        prefix = self._build_prompt_prefix(deep_thinking)
+        suffix = self._build_prompt_suffix(user_text, emotion, risk, scl90_summary, rag_context, conversation_history)
+        return f"{prefix}\n{suffix}".strip()
 
-    def generate(self, user_text, emotion, risk, scl90_summary=None, rag_context=None, deep_thinking=False, conversation_history=None):
-        """
-        生成个性化心理健康建议
-        """
-        if self.model_dir == 'mock':
-             mock_response = """【MOCK 响应】
+    def _mock_response(self, deep_thinking=False):
+        mock_response = """【MOCK 响应】
              感谢您的分享。这只是一个模拟响应，因为后端正在以无模型模式运行。
              
              通常，我会根据您的情感分析结果、风险评估和SCL-90历史记录，为您提供定制化的建议。
@@ -169,70 +375,392 @@ class AdviceGenerator:
              
              本建议仅供参考，不能替代专业医疗诊断。
              """
-             if deep_thinking:
-                 mock_response = "【MOCK 深度思考模式】\n正在深入分析您的心理机制...\n\n" + mock_response.replace("【MOCK 响应】", "")
-             return mock_response
+        if deep_thinking:
+            mock_response = "【MOCK 深度思考模式】\n正在深入分析您的心理机制...\n\n" + mock_response.replace("【MOCK 响应】", "")
+        return mock_response
+
+    def _encode_prefix(self, prefix_text):
+        """前缀编码，包含模型要求的起始特殊符号"""
+        return self.tokenizer(prefix_text)["input_ids"]
+
+    def get_prefix_state(self, system_prompt):
+        """
+        获取静态前缀（system_prompt）的 token ids 以及（启用前缀缓存时）其 past_key_values
+        前缀只随生成配置（是否深度思考）变化，每个只计算一次，之后所有请求直接从前缀末尾继续预填充
+        """
+        key = system_prompt
+        state = self._prefix_cache.get(key)
+        if state is not None:
+            return state
+
+        with self._prefix_lock:
+            state = self._prefix_cache.get(key)
+            if state is None:
+                ids = self._encode_prefix(system_prompt)
+                past = None
+                if self.enable_prefix_cache:
+                    device = self.model.device
+                    with torch.no_grad():
+                        outputs = self.model(
+                            input_ids=torch.tensor([ids], device=device),
+                            position_ids=torch.arange(len(ids), device=device).unsqueeze(0),
+                            attention_mask=torch.ones(1, len(ids), dtype=torch.long, device=device),
+                            use_cache=True,
+                            return_dict=True,
+                        )
+                    past = outputs.past_key_values
+                    logger.info(f"✅ 已缓存提示词前缀 KV ({len(ids)} tokens)")
+                state = PrefixState(ids, past)
+                self._prefix_cache[key] = state
+        return state
+
+    def _clone_past(self, past):
+        """
+        复制前缀缓存供单次请求使用
+        元组形式的缓存每一步都会拼接出新张量，前缀张量本身不会被修改，可以直接共享；
+        Cache 对象会被原地更新，需要深拷贝
+        """
+        if past is None or isinstance(past, (tuple, list)):
+            return past
+        return copy.deepcopy(past)
+
+    def _prepare_chat(self, user_text, emotion, risk, scl90_summary=None, rag_context=None, deep_thinking=False, conversation_history=None):
+        """
+        按 Token 预算组装 Prompt，返回 (system_prompt, user_prompt)
+        user_prompt 是生成后端分词器编码的 token 序列；MOCK 或模型未加载时为 None
+        """
+        system_prompt = self._build_prompt_prefix(deep_thinking)
+        if self.prompt_assembler is None:
+            return system_prompt, None
+
+        # 预留 max_new_tokens 给生成
+        max_input_len = self.max_seq_length - self.max_new_tokens
+        budget = max_input_len - self.backend.system_tokens(system_prompt)
+
+        assembled = self.prompt_assembler.assemble(
+            budget, user_text, emotion, risk, scl90_summary,
+            history=_as_segments(conversation_history), rag_docs=_as_segments(rag_context),
+            rag_max_tokens=self.max_rag_context_tokens
+        )
+        rag_saved = assembled.usage["rag_candidates"] - assembled.usage["rag_context"]
+        if assembled.usage["rag_candidates"]:
+            # 知识部分按 token 上限截取，记录相对整段拼接节省的预填充 token
+            rag_tokens_saved_counter.inc(max(rag_saved, 0))
+            logger.info(
+                f"检索上下文: 使用 {assembled.usage['rag_context']} tokens，"
+                f"候选 {assembled.usage['rag_candidates']} tokens，节省 {max(rag_saved, 0)} tokens"
+                + (f"（按上限 {self.max_rag_context_tokens} 截取）" if "rag_context" in assembled.capped else "")
+            )
+        if assembled.trimmed:
+            logger.warning(
+                f"Prompt 超出 Token 预算 ({max_input_len})，已截断: {', '.join(assembled.trimmed)}，"
+                f"各部分用量: {assembled.usage}"
+            )
+        return system_prompt, assembled.ids
+
+    def _logits_processors(self, temperature=None, top_p=None):
+        return LogitsProcessorList([
+            RepetitionPenaltyLogitsProcessor(self.repetition_penalty),
+            TemperatureLogitsWarper(self.temperature if temperature is None else temperature),
+            TopPLogitsWarper(self.top_p if top_p is None else top_p),
+        ])
+
+    def _kv_dims(self):
+        """past_key_values 中 (batch 维, 序列维)：ChatGLM 为 [seq, batch, ...]，标准布局为 [batch, heads, seq, dim]"""
+        if getattr(self.model.config, "model_type", "") == "chatglm":
+            return 1, 0
+        return 0, 2
+
+    def _forward(self, step_ids, past, past_len):
+        """单条序列前向，返回 (最后位置的 logits [1, vocab], 新的 past_key_values)"""
+        device = self.model.device
+        seq_len = len(step_ids)
+        outputs = self.model(
+            input_ids=torch.tensor([step_ids], device=device),
+            position_ids=torch.arange(past_len, past_len + seq_len, device=device).unsqueeze(0),
+            attention_mask=torch.ones(1, past_len + seq_len, dtype=torch.long, device=device),
+            past_key_values=past,
+            use_cache=True,
+            return_dict=True,
+        )
+        return outputs.logits[:, -1, :].float(), outputs.past_key_values
+
+    def _forward_batch(self, seqs):
+        """
+        多条序列合并为一个 batch 做一步解码
+        各序列的 KV 长度不同，左侧补零对齐并用 attention_mask 屏蔽，前向后再按序列拆回
+        :return: logits [B, vocab]
+        """
+        batch_dim, seq_dim = self._kv_dims()
+        device = self.model.device
+        max_len = max(seq.past_len for seq in seqs)
 
+        merged_past = []
+        for layer_idx in range(len(seqs[0].past)):
+            merged_layer = []
+            for tensor_idx in range(len(seqs[0].past[layer_idx])):
+                parts = []
+                for seq in seqs:
+                    tensor = seq.past[layer_idx][tensor_idx]
+                    pad = max_len - tensor.shape[seq_dim]
+                    if pad:
+                        shape = list(tensor.shape)
+                        shape[seq_dim] = pad
+                        tensor = torch.cat([tensor.new_zeros(shape), tensor], dim=seq_dim)
+                    parts.append(tensor)
+                merged_layer.append(torch.cat(parts, dim=batch_dim))
+            merged_past.append(tuple(merged_layer))
+
+        attention_mask = torch.zeros(len(seqs), max_len + 1, dtype=torch.long, device=device)
+        for row, seq in enumerate(seqs):
+            attention_mask[row, max_len - seq.past_len:] = 1
+
+        outputs = self.model(
+            input_ids=torch.tensor([[seq.generated[-1]] for seq in seqs], device=device),
+            position_ids=torch.tensor([[seq.past_len] for seq in seqs], device=device),
+            attention_mask=attention_mask,
+            past_key_values=tuple(merged_past),
+            use_cache=True,
+            return_dict=True,
+        )
+
+        for row, seq in enumerate(seqs):
+            pad = max_len - seq.past_len
+            seq.past = tuple(
+                tuple(
+                    t.narrow(batch_dim, row, 1).narrow(seq_dim, pad, t.shape[seq_dim] - pad)
+                    for t in layer
+                )
+                for layer in outputs.past_key_values
+            )
+            seq.past_len += 1
+        return outputs.logits[:, -1, :].float()
+
+    def _sample(self, seq, logits):
+        scores = seq.processors(seq.history, logits)
+        return torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1).item()
+
+    def _finish(self, seq, reason):
+        seq.done = True
+        seq.finish_reason = reason
+        seq.past = None
+        # 后处理：确保免责声明存在
+        suffix = self._disclaimer_suffix(seq.text)
+        if suffix:
+            seq.push(suffix)
+
+    def _check_stop(self, seq):
+        """检查截止时间与取消信号，触发时带着已生成的部分文本结束序列"""
+        if seq.done or seq.stopping is None or not seq.stopping(seq.history, None):
+            return False
+        reason = seq.stopping.reason
+        if reason == "deadline":
+            deadline_exceeded_counter.inc()
+            logger.warning(f"生成超过截止时间，提前结束（已生成 {len(seq.generated)} tokens）")
+        else:
+            cancelled_counter.inc()
+            logger.info(f"生成请求已取消（已生成 {len(seq.generated)} tokens）")
+        self._finish(seq, reason)
+        return True
+
+    def _accept_token(self, seq, token_id):
+        """接收一个新采样的 token：更新文本增量，遇到结束符或达到长度上限时结束序列"""
+        if token_id == self.tokenizer.eos_token_id:
+            self._finish(seq, "stop")
+            return
+
+        seq.generated.append(token_id)
+        seq.history = torch.cat([seq.history, torch.tensor([[token_id]], device=seq.history.device)], dim=1)
+
+        # 多字节字符未解码完整时暂缓输出
+        text = self.tokenizer.decode(seq.generated, skip_special_tokens=True)
+        if not text.endswith("\ufffd") and len(text) > seq.decoded_len:
+            seq.push(text[seq.decoded_len:])
+            seq.decoded_len = len(text)
+
+        if len(seq.generated) >= seq.max_new_tokens:
+            self._finish(seq, "length")
+
+    def start_sequence(self, user_text, emotion, risk, scl90_summary=None, rag_context=None, deep_thinking=False,
+                       conversation_history=None, deadline=None, cancel_event=None):
+        """由请求字段组装 Prompt 并创建生成序列（GenerationScheduler 使用）"""
+        system_prompt, user_prompt = self._prepare_chat(
+            user_text, emotion, risk, scl90_summary, rag_context, deep_thinking, conversation_history
+        )
+        return self.start_prompt(system_prompt, user_prompt, deadline=deadline, cancel_event=cancel_event)
+
+    def start_prompt(self, system_prompt, user_prompt, max_new_tokens=None, temperature=None, top_p=None,
+                     deadline=None, cancel_event=None):
+        """
+        创建一条生成序列并完成预填充（采样出第一个 token）
+        :param user_prompt: 分词器编码好的后缀 token ids，也可以是文本
+        MOCK 模式或模型未加载时返回按固定文本分段输出的序列
+        """
+        seq = GenerationSequence(
+            max_new_tokens or self.max_new_tokens, self._logits_processors(temperature, top_p)
+        )
+        if deadline is not None or cancel_event is not None:
+            seq.stopping = GenerationDeadline(deadline, cancel_event)
+        if self._check_stop(seq):
+            # 排队期间已超时或已取消，不再预填充
+            return seq
+        if self.model_dir == 'mock':
+            mock_response = self._mock_response(system_prompt.endswith(DEEP_THINKING_GUIDELINES))
+            seq.chunks = [mock_response[i:i + MOCK_STREAM_CHUNK] for i in range(0, len(mock_response), MOCK_STREAM_CHUNK)]
+            return seq
         if self.model is None or self.tokenizer is None:
             logger.warning("模型未加载，返回默认提示")
-            return "抱歉，心理咨询助手当前正如火如荼地进行维护中，暂时无法生成详细建议。请稍后再试，或直接联系学校心理咨询中心。"
+            seq.chunks = [MAINTENANCE_MESSAGE]
+            return seq
+
+        prefix_state = self.get_prefix_state(system_prompt)
+        suffix_ids = self.prompt_assembler.encode(user_prompt) if isinstance(user_prompt, str) else list(user_prompt)
+        if prefix_state.past is not None:
+            # 前缀 KV 已缓存，只需预填充后缀
+            past, past_len, step_ids = self._clone_past(prefix_state.past), len(prefix_state.ids), suffix_ids
+        else:
+            past, past_len, step_ids = None, 0, prefix_state.ids + suffix_ids
+
+        seq.history = torch.tensor([prefix_state.ids + suffix_ids], device=self.model.device)
+        with torch.no_grad():
+            logits, seq.past = self._forward(step_ids, past, past_len)
+        seq.past_len = past_len + len(step_ids)
+        self._accept_token(seq, self._sample(seq, logits))
+        return seq
+
+    def step_sequences(self, seqs):
+        """
+        所有未结束的序列各前进一步；模型序列合并为一个 batch 解码
+        新产生的文本通过 seq.drain() 取出
+        """
+        active = [seq for seq in seqs if not seq.done and not self._check_stop(seq)]
+        for seq in active:
+            if seq.chunks is not None:
+                if seq.chunks:
+                    seq.push(seq.chunks.pop(0))
+                if not seq.chunks:
+                    seq.done = True
+                    seq.finish_reason = "stop"
+
+        model_seqs = [seq for seq in active if seq.chunks is None]
+        if not model_seqs:
+            return
+
+        with torch.no_grad():
+            if len(model_seqs) == 1 or not isinstance(model_seqs[0].past, (tuple, list)):
+                # 单条序列或无法合并的 Cache 对象：逐条解码
+                rows = []
+                for seq in model_seqs:
+                    logits, seq.past = self._forward([seq.generated[-1]], seq.past, seq.past_len)
+                    seq.past_len += 1
+                    rows.append(logits[0])
+                logits = torch.stack(rows)
+            else:
+                logits = self._forward_batch(model_seqs)
+
+        for seq, row in zip(model_seqs, logits):
+            self._accept_token(seq, self._sample(seq, row.unsqueeze(0)))
+
+    def _generate_pieces(self, user_text, emotion, risk, scl90_summary=None, rag_context=None, deep_thinking=False,
+                         conversation_history=None, deadline=None, cancel_event=None):
+        """单条请求：组装 Prompt 后交给生成后端，逐段产出文本（结束时已包含免责声明）"""
+        if self.model_dir != 'mock' and not self.backend.available:
+            logger.warning("模型未加载，返回默认提示")
+            yield MAINTENANCE_MESSAGE
+            return
+        system_prompt, user_prompt = self._prepare_chat(
+            user_text, emotion, risk, scl90_summary, rag_context, deep_thinking, conversation_history
+        )
+        text = ""
+        for piece in self.backend.stream_chat(
+            system_prompt, user_prompt, self.max_new_tokens, self.temperature, self.top_p,
+            deadline=deadline, cancel_event=cancel_event
+        ):
+            text += piece
+            yield piece
+        suffix = self._disclaimer_suffix(text)
+        if suffix:
+            yield suffix
+
+    def warm_up(self):
+        """预热：计算各配置的前缀（本地后端同时缓存其 KV），再以 1 个 token 的生成走一遍完整路径"""
+        if self.model_dir == 'mock' or not self.backend.available:
+            return
+        started = time.perf_counter()
+        for deep_thinking in (False, True):
+            self.backend.system_tokens(self._build_prompt_prefix(deep_thinking))
+        system_prompt, user_prompt = self._prepare_chat(user_text="你好", emotion="中性", risk="无风险")
+        for _ in self.backend.stream_chat(system_prompt, user_prompt, 1, self.temperature, self.top_p):
+            pass
+        logger.info(f"✅ 建议生成模型预热完成，耗时 {time.perf_counter() - started:.1f}s")
+
+    def _disclaimer_suffix(self, advice):
+        """后处理：确保免责声明存在，返回需要追加的文本"""
+        if "本建议仅供参考" not in advice and "免责声明" not in advice:
+            return f"\n\n{DISCLAIMER}"
+        return ""
+
+    def generate(self, user_text, emotion, risk, scl90_summary=None, rag_context=None, deep_thinking=False,
+                 conversation_history=None, deadline=None, cancel_event=None):
+        """
+        生成个性化心理健康建议
+        :param deadline: 截止时间（time.time() 时间戳），到期后返回已生成的部分文本并附免责声明
+        :param cancel_event: threading.Event，被设置后同样提前结束
+        """
+        if self.model_dir == 'mock':
+             return self._mock_response(deep_thinking)
 
-        # 1. 初步构建 Prompt
-        prompt = self._build_prompt(user_text, emotion, risk, scl90_summary, rag_context, deep_thinking, conversation_history)
-        
-        # 2. Token 长度检查与截断 (简单策略：如果过长，丢弃 RAG 上下文)
         try:
-            inputs = self.tokenizer([prompt], return_tensors="pt")
-            input_len = len(inputs["input_ids"][0])
-            
-            # 预留 max_new_tokens 给生成
-            max_input_len = self.max_seq_length - self.max_new_tokens
-            
-            if input_len > max_input_len:
-                logger.warning(f"Prompt token 长度 ({input_len}) 超过限制 ({max_input_len})，尝试移除 RAG 上下文")
-                # 重新构建不带 RAG 的 prompt
-                prompt = self._build_prompt(user_text, emotion, risk, scl90_summary, rag_context=None, deep_thinking=deep_thinking)
-                
-                # 二次检查
-                inputs = self.tokenizer([prompt], return_tensors="pt")
-                input_len = len(inputs["input_ids"][0])
-                if input_len > max_input_len:
-                     logger.warning(f"移除 RAG 后 Prompt 仍过长 ({input_len})，截断用户输入")
-                     # 极端情况：截断用户输入
-                     allowed_user_len = max_input_len - 500 # 预留给系统指令
-                     if allowed_user_len > 0:
-                         prompt = self._build_prompt(user_text[:allowed_user_len] + "...", emotion, risk, scl90_summary, rag_context=None, deep_thinking=deep_thinking)
+            return "".join(self._generate_pieces(
+                user_text, emotion, risk, scl90_summary, rag_context, deep_thinking, conversation_history,
+                deadline=deadline, cancel_event=cancel_event
+            )).strip()
         except Exception as e:
-            logger.warning(f"Token 长度检查失败: {e}，将尝试直接生成")
+            logger.error(f"建议生成过程中发生错误: {str(e)}")
+            return ERROR_MESSAGE
 
+    def generate_stream(self, user_text, emotion, risk, scl90_summary=None, rag_context=None, deep_thinking=False,
+                        conversation_history=None, deadline=None, cancel_event=None):
+        """
+        流式生成建议，逐段产出新生成的文本；结束时补充免责声明
+        """
+        produced = False
         try:
-            # 使用简单的生成方式
-            inputs = self.tokenizer([prompt], return_tensors="pt")
-            inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
-            
-            # 直接使用generate方法，尝试禁用cache
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
-                    max_new_tokens=self.max_new_tokens,
-                    temperature=self.temperature,
-                    top_p=self.top_p,
-                    do_sample=True,
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    eos_token_id=self.tokenizer.eos_token_id,
-                    use_cache=False,
-                )
-            
-            # 解码输出
-            response = self.tokenizer.decode(outputs[0][inputs["input_ids"].shape[1]:], skip_special_tokens=True)
-            
-            # 后处理：确保免责声明存在
-            final_advice = response.strip()
-            disclaimer = "本建议仅供参考，不能替代专业医疗诊断。若持续感到不适，请寻求专业帮助。"
-            if "本建议仅供参考" not in final_advice and "免责声明" not in final_advice:
-                final_advice += f"\n\n{disclaimer}"
-                
-            return final_advice
+            for piece in self._generate_pieces(
+                user_text, emotion, risk, scl90_summary, rag_context, deep_thinking, conversation_history,
+                deadline=deadline, cancel_event=cancel_event
+            ):
+                produced = True
+                yield piece
         except Exception as e:
             logger.error(f"建议生成过程中发生错误: {str(e)}")
-            return "生成建议时遇到了一些技术问题，请稍后重试。如果情况紧急，请立即联系辅导员或心理中心。"
+            if not produced:
+                yield ERROR_MESSAGE
+
+
+class GenerationSequence:
+    """单条生成序列的解码状态，由 AdviceGenerator.start_sequence 创建、step_sequences 推进"""
+
+    def __init__(self, max_new_tokens, processors):
+        self.max_new_tokens = max_new_tokens
+        self.processors = processors
+        self.past = None
+        self.past_len = 0
+        self.history = None
+        self.generated = []
+        self.decoded_len = 0
+        self.text = ""
+        self.pending = []
+        self.chunks = None
+        self.done = False
+        self.finish_reason = None
+        self.stopping = None
+
+    def push(self, piece):
+        self.text += piece
+        self.pending.append(piece)
+
+    def drain(self):
+        """取出自上次调用以来新产生的文本"""
+        pieces, self.pending = self.pending, []
+        return "".join(pieces)
@@ -0,0 +1,109 @@
+# -------------------------- 建议生成基准测试 --------------------------
+# 对比三种解码方式的首 token 延迟 (TTFT) 与生成速度:
+#   no-kv-cache : 原实现，model.generate(use_cache=False)，每步重新计算整个序列
+#   kv-cache    : 启用 KV 缓存，每个请求完整预填充 前缀+后缀
+#   prefix-cache: 启用 KV 缓存，并复用静态前缀的 KV，只预填充后缀
+# 用法: python bench_advice.py [--max-new-tokens 64] [--runs 3]
+import argparse
+import threading
+import time
+
+import torch
+from transformers import TextIteratorStreamer
+
+from advice_generator import AdviceGenerator
+
+SAMPLE_REQUEST = {
+    "user_text": "最近快期末考试了，我每天晚上都睡不着，一想到考试就心慌，感觉自己什么都没复习好。",
+    "emotion": "焦虑",
+    "risk": "低风险",
+    "scl90_summary": "SCL-90总分: 168, 异常症状: 头痛、心慌",
+    "rag_context": "考前焦虑是大学生常见的心理问题。缓解方法包括制定合理的复习计划、保持规律作息、深呼吸放松等。",
+}
+
+
+def bench_no_kv_cache(generator, max_new_tokens):
+    """原实现：整段 Prompt 交给 model.generate，禁用 KV 缓存"""
+    prompt = generator._build_prompt(**SAMPLE_REQUEST)
+    inputs = generator.tokenizer([prompt], return_tensors="pt")
+    inputs = {k: v.to(generator.model.device) for k, v in inputs.items()}
+    streamer = TextIteratorStreamer(generator.tokenizer, skip_prompt=True, skip_special_tokens=True)
+    kwargs = dict(
+        max_new_tokens=max_new_tokens,
+        temperature=generator.temperature,
+        top_p=generator.top_p,
+        do_sample=True,
+        pad_token_id=generator.tokenizer.eos_token_id,
+        eos_token_id=generator.tokenizer.eos_token_id,
+        use_cache=False,
+    )
+    outputs = []
+
+    def _run():
+        with torch.no_grad():
+            outputs.append(generator.model.generate(**inputs, **kwargs, streamer=streamer))
+
+    start = time.perf_counter()
+    worker = threading.Thread(target=_run)
+    worker.start()
+    ttft = None
+    for piece in streamer:
+        if piece and ttft is None:
+            ttft = time.perf_counter() - start
+    worker.join()
+    elapsed = time.perf_counter() - start
+    new_tokens = outputs[0].shape[1] - inputs["input_ids"].shape[1]
+    return ttft or elapsed, new_tokens, elapsed
+
+
+def bench_incremental(generator, max_new_tokens, use_prefix_cache):
+    """新实现：KV 缓存增量解码，可选复用前缀 KV"""
+    generator.max_new_tokens = max_new_tokens
+    generator.enable_prefix_cache = use_prefix_cache
+    generator._prefix_cache.clear()
+    # 前缀 KV 每个配置只在首次请求时计算一次，这里先计算好，测的是稳态请求
+    generator.get_prefix_state(generator._build_prompt_prefix(False))
+
+    start = time.perf_counter()
+    seq = generator.start_sequence(**SAMPLE_REQUEST)
+    # 预填充完成即已采样出第一个 token
+    ttft = time.perf_counter() - start
+    while not seq.done:
+        generator.step_sequences([seq])
+    elapsed = time.perf_counter() - start
+    new_tokens = len(seq.generated)
+    return ttft, new_tokens, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="建议生成解码方式基准测试")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    generator = AdviceGenerator()
+    if generator.model is None:
+        print("❌ 模型未加载，无法进行基准测试")
+        return
+
+    modes = [
+        ("no-kv-cache", lambda: bench_no_kv_cache(generator, args.max_new_tokens)),
+        ("kv-cache", lambda: bench_incremental(generator, args.max_new_tokens, False)),
+        ("prefix-cache", lambda: bench_incremental(generator, args.max_new_tokens, True)),
+    ]
+
+    print(f"\n{'mode':<14}{'TTFT(s)':>10}{'tokens':>8}{'tokens/s':>10}")
+    for name, fn in modes:
+        ttfts, rates, counts = [], [], []
+        for _ in range(args.runs):
+            ttft, new_tokens, elapsed = fn()
+            ttfts.append(ttft)
+            counts.append(new_tokens)
+            # 生成速度不计入首 token 之前的预填充时间
+            decode_time = max(elapsed - ttft, 1e-6)
+            rates.append(max(new_tokens - 1, 0) / decode_time)
+        print(f"{name:<14}{sum(ttfts) / len(ttfts):>10.2f}{sum(counts) // len(counts):>8}{sum(rates) / len(rates):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# -------------------------- 情感分类后端基准测试 --------------------------
+# 用法: python bench_emotion.py [--backends torch onnx onnx-int8] [--texts 256] [--batch-size 16]
+import argparse
+import random
+import time
+
+import torch
+
+from config import CHINESE_MENTALBERT_DIR, EMOTION_LABEL_MAP, RISK_LABEL_MAP, BERT_MAX_LEN
+from emotion_classifier import EmotionClassifier
+from emotion_onnx import PARITY_SAMPLES
+
+BACKENDS = {
+    "torch": {"backend": "torch"},
+    "onnx": {"backend": "onnx", "onnx_quantize": False},
+    "onnx-int8": {"backend": "onnx", "onnx_quantize": True},
+}
+
+
+def build_corpus(n, seed=42):
+    """由留出样本随机拼接出长短不一的测试文本"""
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(n):
+        corpus.append("".join(rng.choice(PARITY_SAMPLES) for _ in range(rng.randint(1, 8))))
+    return corpus
+
+
+def bench_backend(name, corpus, batch_size, single_runs):
+    classifier = EmotionClassifier(
+        model_dir=CHINESE_MENTALBERT_DIR,
+        emotion_label_map=EMOTION_LABEL_MAP,
+        risk_label_map=RISK_LABEL_MAP,
+        device=torch.device("cpu"),
+        max_seq_length=BERT_MAX_LEN,
+        batch_size=batch_size,
+        **BACKENDS[name]
+    )
+    if name != "torch" and classifier.backend != "onnx":
+        print(f"{name}: ONNX 后端加载失败，跳过")
+        return None
+
+    # 预热
+    classifier.discriminate_batch(corpus[:batch_size])
+
+    latencies = []
+    for text in corpus[:single_runs]:
+        start = time.perf_counter()
+        classifier.discriminate(text)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    start = time.perf_counter()
+    labels = classifier.discriminate_batch(corpus)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "backend": name,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "throughput": len(corpus) / elapsed,
+        "labels": [emotion for emotion, _ in labels],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="情感分类推理后端基准测试")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--texts", type=int, default=256, help="吞吐测试文本条数")
+    parser.add_argument("--single-runs", type=int, default=50, help="单条延迟测试次数")
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.texts)
+    results = []
+    for name in args.backends:
+        result = bench_backend(name, corpus, args.batch_size, min(args.single_runs, len(corpus)))
+        if result:
+            results.append(result)
+
+    reference = results[0]["labels"] if results else []
+    print(f"\n{'backend':<12}{'p50(ms)':>10}{'p95(ms)':>10}{'texts/s':>10}{'agree':>8}")
+    for r in results:
+        agree = sum(a == b for a, b in zip(reference, r["labels"])) / len(reference)
+        print(f"{r['backend']:<12}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['throughput']:>10.1f}{agree:>8.2%}")
+
+
+if __name__ == "__main__":
+    main()
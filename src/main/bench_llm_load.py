@@ -0,0 +1,77 @@
+# -------------------------- 建议生成模型加载基准测试 --------------------------
+# 对比各 CPU 加载模式的加载耗时、常驻内存 (RSS) 与首 token 延迟
+# 每个模式在独立子进程中加载，避免相互影响内存统计
+# 用法: python bench_llm_load.py [--modes float32 bfloat16 int8 native] [--max-new-tokens 8]
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import torch
+
+from utils.resources import rss_bytes, format_bytes
+
+SAMPLE_REQUEST = {
+    "user_text": "最近快期末考试了，我每天晚上都睡不着。",
+    "emotion": "焦虑",
+    "risk": "低风险",
+}
+
+
+def run_child(mode, max_new_tokens):
+    """子进程：加载一种模式并输出一行 JSON 结果"""
+    from advice_generator import AdviceGenerator
+
+    baseline = rss_bytes()
+    generator = AdviceGenerator(device=torch.device("cpu"), cpu_dtype=mode, prefix_cache=False, backend="local")
+    result = {
+        "mode": mode, "resolved": generator.load_mode, "baseline_rss": baseline, "mmapped": generator.weights_mmapped
+    }
+    if generator.model is None:
+        result["error"] = "模型加载失败"
+    else:
+        generator.max_new_tokens = max_new_tokens
+        start = time.perf_counter()
+        generator.start_sequence(**SAMPLE_REQUEST)
+        result.update(
+            load_seconds=generator.load_seconds,
+            rss=generator.load_rss,
+            ttft=time.perf_counter() - start,
+        )
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="建议生成模型 CPU 加载模式基准测试")
+    parser.add_argument("--modes", nargs="+", default=["float32", "bfloat16", "int8", "native"])
+    parser.add_argument("--max-new-tokens", type=int, default=8)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.max_new_tokens)
+        return
+
+    print(f"\n{'mode':<10}{'resolved':<10}{'load(s)':>9}{'RSS':>10}{'model RSS':>11}{'TTFT(s)':>9}{'mmap':>6}")
+    for mode in args.modes:
+        proc = subprocess.run(
+            [sys.executable, __file__, "--child", mode, "--max-new-tokens", str(args.max_new_tokens)],
+            capture_output=True, text=True
+        )
+        lines = [line for line in proc.stdout.splitlines() if line.startswith("{")]
+        if not lines:
+            print(f"{mode:<10}❌ 子进程失败: {proc.stderr.strip().splitlines()[-1:] or proc.returncode}")
+            continue
+        r = json.loads(lines[-1])
+        if "error" in r:
+            print(f"{mode:<10}{r['resolved'] or '-':<10}❌ {r['error']}")
+            continue
+        model_rss = r["rss"] - r["baseline_rss"] if r["rss"] and r["baseline_rss"] else None
+        mmapped = "?" if r["mmapped"] is None else ("yes" if r["mmapped"] else "no")
+        print(f"{mode:<10}{r['resolved']:<10}{r['load_seconds']:>9.1f}{format_bytes(r['rss']):>10}"
+              f"{format_bytes(model_rss):>11}{r['ttft']:>9.2f}{mmapped:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# -------------------------- 向量库整理 --------------------------
+# 一次性清理历史遗留的重复 SCL-90 摘要：每个用户只保留最新一份，并改写到固定文档 ID 下，
+# 之后的测评提交会直接覆盖这份摘要：
+#   python compact_knowledge.py --dry-run   # 只统计，不删除
+#   python compact_knowledge.py
+# 加 --reconcile 时改为执行一次 knowledge_base 与向量库的对账，删除孤儿向量并报告漂移
+import argparse
+import logging
+import os
+import sys
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.append(current_dir)
+
+from database import db_manager
+from rag_service import rag_service
+from services.reconcile_service import reconcile_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="清理向量库中重复的 SCL-90 摘要")
+    parser.add_argument("--dry-run", action="store_true", help="只统计将被删除的文档数，不修改向量库")
+    parser.add_argument("--reconcile", action="store_true", help="对账 knowledge_base 与向量库，删除孤儿向量")
+    args = parser.parse_args()
+
+    if not rag_service.initialize():
+        logger.error("RAG服务未初始化，无法整理向量库")
+        sys.exit(1)
+
+    if args.reconcile:
+        db_manager._init_pool()
+        report = reconcile_service.run(dry_run=args.dry_run)
+        if report is None:
+            logger.error("对账未执行")
+            sys.exit(1)
+        action = "将删除" if args.dry_run else "已删除"
+        print(
+            f"对账完成：向量库 {report['vector_documents']} 条知识，MySQL {report['mysql_rows']} 条；"
+            f"孤儿向量 {report['orphan_vectors']} 块（{action} {report['orphan_vectors'] if args.dry_run else report['deleted']}），"
+            f"缺少向量的知识 {report['missing_vectors']} 条，跳过最近写入 {report['skipped_recent']} 块"
+        )
+        return
+
+    stats = rag_service.compact_scl90_reports(dry_run=args.dry_run)
+    action = "将删除" if args.dry_run else "已删除"
+    print(f"SCL-90 摘要：{stats['users']} 个用户共 {stats['documents']} 份，{action} {stats['deleted']} 份重复摘要")
+
+
+if __name__ == "__main__":
+    main()
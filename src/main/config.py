@@ -56,8 +56,44 @@ class ModelSettings(BaseSettings):
         default_factory=lambda: os.path.join(MODEL_BASE_DIR, "Chatglm2-6b-int4")
     )
     bert_max_len: int = Field(default=512, alias="BERT_MAX_LEN")
+    emotion_batch_size: int = Field(default=16, alias="EMOTION_BATCH_SIZE")
+    emotion_batch_window_ms: float = Field(default=5.0, alias="EMOTION_BATCH_WINDOW_MS")
+    emotion_max_batch_size: int = Field(default=32, alias="EMOTION_MAX_BATCH_SIZE")
+    emotion_long_text_strategy: str = Field(default="max_risk", alias="EMOTION_LONG_TEXT_STRATEGY")
+    emotion_window_overlap: int = Field(default=128, alias="EMOTION_WINDOW_OVERLAP")
+    emotion_batch_max_texts: int = Field(default=256, alias="EMOTION_BATCH_MAX_TEXTS")
+    emotion_cache_size: int = Field(default=4096, alias="EMOTION_CACHE_SIZE")
+    emotion_cache_ttl: int = Field(default=3600, alias="EMOTION_CACHE_TTL")
+    emotion_cache_path: Optional[str] = Field(default=None, alias="EMOTION_CACHE_PATH")
+    emotion_backend: str = Field(default="torch", alias="EMOTION_BACKEND")
+    emotion_onnx_dir: Optional[str] = Field(default=None, alias="EMOTION_ONNX_DIR")
+    emotion_onnx_quantize: bool = Field(default=False, alias="EMOTION_ONNX_QUANTIZE")
+    emotion_onnx_min_agreement: float = Field(default=0.95, alias="EMOTION_ONNX_MIN_AGREEMENT")
     llm_max_len: int = Field(default=2048, alias="LLM_MAX_LEN")
     max_new_tokens: int = Field(default=1024, alias="MAX_NEW_TOKENS")
+    llm_prefix_cache: bool = Field(default=True, alias="LLM_PREFIX_CACHE")
+    llm_cpu_dtype: str = Field(default="auto", alias="LLM_CPU_DTYPE")
+    llm_scheduler: bool = Field(default=True, alias="LLM_SCHEDULER")
+    llm_max_batch_size: int = Field(default=4, alias="LLM_MAX_BATCH_SIZE")
+    generation_timeout: float = Field(default=120.0, alias="GENERATION_TIMEOUT")
+    llm_backend: str = Field(default="local", alias="LLM_BACKEND")
+    llm_api_base: str = Field(default="http://127.0.0.1:8000/v1", alias="LLM_API_BASE")
+    llm_api_key: Optional[str] = Field(default=None, alias="LLM_API_KEY")
+    llm_api_model: str = Field(default="chatglm2-6b", alias="LLM_API_MODEL")
+    llm_api_timeout: float = Field(default=60.0, alias="LLM_API_TIMEOUT")
+    llm_api_max_connections: int = Field(default=8, alias="LLM_API_MAX_CONNECTIONS")
+    llm_api_max_retries: int = Field(default=3, alias="LLM_API_MAX_RETRIES")
+    inference_mode: str = Field(default="local", alias="INFERENCE_MODE")
+    inference_socket: str = Field(
+        default_factory=lambda: r"\\.\pipe\yibinu-inference" if os.name == "nt"
+        else os.path.join(BASE_DIR, "data", "inference.sock"),
+        alias="INFERENCE_SOCKET"
+    )
+    # 推理通道的认证密钥，必须自行设置且保密（通道使用 pickle 传输，持有密钥即可在推理进程中执行任意代码）
+    inference_authkey: Optional[str] = Field(default=None, alias="INFERENCE_AUTHKEY")
+    inference_allow_remote: bool = Field(default=False, alias="INFERENCE_ALLOW_REMOTE")
+    inference_timeout: float = Field(default=300.0, alias="INFERENCE_TIMEOUT")
+    inference_worker_threads: int = Field(default=32, alias="INFERENCE_WORKER_THREADS")
 
 
 class RAGSettings(BaseSettings):
@@ -67,6 +103,26 @@ class RAGSettings(BaseSettings):
         default_factory=lambda: os.path.join(BASE_DIR, "data", "chroma_db")
     )
     embedding_model_name: str = "shibing624/text2vec-base-chinese"
+    rag_embedding_cache_size: int = Field(default=2048, alias="RAG_EMBEDDING_CACHE_SIZE")
+    rag_result_cache_size: int = Field(default=1024, alias="RAG_RESULT_CACHE_SIZE")
+    rag_result_cache_ttl: int = Field(default=300, alias="RAG_RESULT_CACHE_TTL")
+    rag_embed_batch_size: int = Field(default=64, alias="RAG_EMBED_BATCH_SIZE")
+    rag_write_chunk_size: int = Field(default=1000, alias="RAG_WRITE_CHUNK_SIZE")
+    knowledge_bulk_max_bytes: int = Field(default=10 * 1024 * 1024, alias="KNOWLEDGE_BULK_MAX_BYTES")
+    knowledge_bulk_max_records: int = Field(default=5000, alias="KNOWLEDGE_BULK_MAX_RECORDS")
+    knowledge_bulk_queue_size: int = Field(default=8, alias="KNOWLEDGE_BULK_QUEUE_SIZE")
+    rag_chunk_tokens: int = Field(default=120, alias="RAG_CHUNK_TOKENS")
+    rag_chunk_overlap: int = Field(default=20, alias="RAG_CHUNK_OVERLAP")
+    rag_hybrid: bool = Field(default=True, alias="RAG_HYBRID")
+    rag_lexical_only_max_chars: int = Field(default=4, alias="RAG_LEXICAL_ONLY_MAX_CHARS")
+    rag_lexical_min_score_ratio: float = Field(default=0.5, alias="RAG_LEXICAL_MIN_SCORE_RATIO")
+    rag_rrf_k: int = Field(default=60, alias="RAG_RRF_K")
+    rag_score_threshold: float = Field(default=0.5, alias="RAG_SCORE_THRESHOLD")
+    rag_mmr_lambda: float = Field(default=0.7, alias="RAG_MMR_LAMBDA")
+    rag_context_max_tokens: int = Field(default=512, alias="RAG_CONTEXT_MAX_TOKENS")
+    rag_compression: bool = Field(default=True, alias="RAG_COMPRESSION")
+    knowledge_reconcile_interval: int = Field(default=3600, alias="KNOWLEDGE_RECONCILE_INTERVAL")
+    knowledge_reconcile_grace: int = Field(default=600, alias="KNOWLEDGE_RECONCILE_GRACE")
     
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -82,6 +138,11 @@ class ServerSettings(BaseSettings):
     api_port: int = Field(default=5000, alias="API_PORT")
     debug_mode: bool = Field(default=False, alias="DEBUG_MODE")
     log_level: LogLevel = Field(default=LogLevel.INFO, alias="LOG_LEVEL")
+    job_queue_size: int = Field(default=32, alias="JOB_QUEUE_SIZE")
+    job_workers: int = Field(default=4, alias="JOB_WORKERS")
+    job_result_ttl: int = Field(default=600, alias="JOB_RESULT_TTL")
+    fast_start: bool = Field(default=False, alias="FAST_START")
+    model_warmup: bool = Field(default=True, alias="MODEL_WARMUP")
 
 
 class FeatureFlags(BaseSettings):
@@ -126,12 +187,68 @@ CHINESE_MENTALBERT_DIR = settings.model.chinese_mentalbert_dir
 CHATGLM_6B_INT4_DIR = settings.model.chatglm_6b_int4_dir
 CHROMA_DB_DIR = settings.rag.chroma_db_dir
 EMBEDDING_MODEL_NAME = settings.rag.embedding_model_name
+RAG_EMBEDDING_CACHE_SIZE = settings.rag.rag_embedding_cache_size
+RAG_RESULT_CACHE_SIZE = settings.rag.rag_result_cache_size
+RAG_RESULT_CACHE_TTL = settings.rag.rag_result_cache_ttl
+RAG_EMBED_BATCH_SIZE = settings.rag.rag_embed_batch_size
+RAG_WRITE_CHUNK_SIZE = settings.rag.rag_write_chunk_size
+KNOWLEDGE_BULK_MAX_BYTES = settings.rag.knowledge_bulk_max_bytes
+KNOWLEDGE_BULK_MAX_RECORDS = settings.rag.knowledge_bulk_max_records
+KNOWLEDGE_BULK_QUEUE_SIZE = settings.rag.knowledge_bulk_queue_size
+RAG_CHUNK_TOKENS = settings.rag.rag_chunk_tokens
+RAG_CHUNK_OVERLAP = settings.rag.rag_chunk_overlap
+RAG_HYBRID = settings.rag.rag_hybrid
+RAG_LEXICAL_ONLY_MAX_CHARS = settings.rag.rag_lexical_only_max_chars
+RAG_LEXICAL_MIN_SCORE_RATIO = settings.rag.rag_lexical_min_score_ratio
+RAG_RRF_K = settings.rag.rag_rrf_k
+RAG_SCORE_THRESHOLD = settings.rag.rag_score_threshold
+RAG_MMR_LAMBDA = settings.rag.rag_mmr_lambda
+RAG_CONTEXT_MAX_TOKENS = settings.rag.rag_context_max_tokens
+RAG_COMPRESSION = settings.rag.rag_compression
+KNOWLEDGE_RECONCILE_INTERVAL = settings.rag.knowledge_reconcile_interval
+KNOWLEDGE_RECONCILE_GRACE = settings.rag.knowledge_reconcile_grace
 BERT_MAX_LEN = settings.model.bert_max_len
+EMOTION_BATCH_SIZE = settings.model.emotion_batch_size
+EMOTION_BATCH_WINDOW_MS = settings.model.emotion_batch_window_ms
+EMOTION_MAX_BATCH_SIZE = settings.model.emotion_max_batch_size
+EMOTION_LONG_TEXT_STRATEGY = settings.model.emotion_long_text_strategy
+EMOTION_WINDOW_OVERLAP = settings.model.emotion_window_overlap
+EMOTION_BATCH_MAX_TEXTS = settings.model.emotion_batch_max_texts
+EMOTION_CACHE_SIZE = settings.model.emotion_cache_size
+EMOTION_CACHE_TTL = settings.model.emotion_cache_ttl
+EMOTION_CACHE_PATH = settings.model.emotion_cache_path
+EMOTION_BACKEND = settings.model.emotion_backend
+EMOTION_ONNX_DIR = settings.model.emotion_onnx_dir
+EMOTION_ONNX_QUANTIZE = settings.model.emotion_onnx_quantize
+EMOTION_ONNX_MIN_AGREEMENT = settings.model.emotion_onnx_min_agreement
 LLM_MAX_LEN = settings.model.llm_max_len
 MAX_NEW_TOKENS = settings.model.max_new_tokens
+LLM_PREFIX_CACHE = settings.model.llm_prefix_cache
+LLM_CPU_DTYPE = settings.model.llm_cpu_dtype
+LLM_SCHEDULER = settings.model.llm_scheduler
+LLM_MAX_BATCH_SIZE = settings.model.llm_max_batch_size
+GENERATION_TIMEOUT = settings.model.generation_timeout
+LLM_BACKEND = settings.model.llm_backend
+LLM_API_BASE = settings.model.llm_api_base
+LLM_API_KEY = settings.model.llm_api_key
+LLM_API_MODEL = settings.model.llm_api_model
+LLM_API_TIMEOUT = settings.model.llm_api_timeout
+LLM_API_MAX_CONNECTIONS = settings.model.llm_api_max_connections
+LLM_API_MAX_RETRIES = settings.model.llm_api_max_retries
+INFERENCE_MODE = settings.model.inference_mode
+INFERENCE_SOCKET = settings.model.inference_socket
+INFERENCE_AUTHKEY = settings.model.inference_authkey
+INFERENCE_ALLOW_REMOTE = settings.model.inference_allow_remote
+INFERENCE_TIMEOUT = settings.model.inference_timeout
+INFERENCE_WORKER_THREADS = settings.model.inference_worker_threads
 API_HOST = settings.server.api_host
 API_PORT = settings.server.api_port
 DEBUG_MODE = settings.server.debug_mode
+JOB_QUEUE_SIZE = settings.server.job_queue_size
+JOB_WORKERS = settings.server.job_workers
+JOB_RESULT_TTL = settings.server.job_result_ttl
+FAST_START = settings.server.fast_start
+MODEL_WARMUP = settings.server.model_warmup
 ENABLE_LLM = settings.features.enable_llm
 ENABLE_EMOTION_ANALYSIS = settings.features.enable_emotion_analysis
 ENABLE_RAG = settings.features.enable_rag
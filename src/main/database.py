@@ -181,9 +181,11 @@ class DBManager:
                 uuid VARCHAR(64),
                 title VARCHAR(255),
                 content TEXT,
+                vector_id VARCHAR(64) COMMENT '向量库文档 ID（分块的 parent_id）',
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 INDEX idx_uuid (uuid),
-                INDEX idx_type (type)
+                INDEX idx_type (type),
+                INDEX idx_vector_id (vector_id)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
             """
         ]
@@ -194,6 +196,14 @@ class DBManager:
             except Exception as e:
                 logger.error(f"创建表失败: {e}")
                 raise
+
+        # 旧库升级：补充后加的列（与 migrate_db.py 相同，启动时自动执行）
+        if not self.execute_query("SHOW COLUMNS FROM knowledge_base LIKE 'vector_id'"):
+            self.execute_update(
+                "ALTER TABLE knowledge_base ADD COLUMN vector_id VARCHAR(64) COMMENT '向量库文档 ID（分块的 parent_id）', "
+                "ADD INDEX idx_vector_id (vector_id)"
+            )
+            logger.info("knowledge_base 已添加 vector_id 列")
         
         logger.info("数据库表结构初始化完成")
 
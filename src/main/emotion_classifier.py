@@ -1,18 +1,54 @@
 # -------------------------- 情感分类模块 --------------------------
+import atexit
+import logging
 import torch
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 
+from utils.cache import LRUCache, normalize_text, content_key, directory_fingerprint
+
+logger = logging.getLogger(__name__)
+
 class EmotionClassifier:
-    def __init__(self, model_dir, emotion_label_map, risk_label_map, device, max_seq_length):
+    def __init__(self, model_dir, emotion_label_map, risk_label_map, device, max_seq_length, batch_size=16,
+                 backend="torch", onnx_dir=None, onnx_quantize=False, onnx_min_agreement=0.95,
+                 long_text_strategy="max_risk", window_overlap=128,
+                 cache_size=4096, cache_ttl=3600, cache_path=None):
+        """
+        :param long_text_strategy: 超长文本处理方式，"truncate"（只看开头）、"max_risk"、"mean"
+        :param window_overlap: 滑动窗口相邻两段重叠的 token 数
+        :param cache_size: 结果缓存容量，0 表示不缓存
+        :param cache_ttl: 结果缓存有效期（秒）
+        :param cache_path: 缓存落盘文件，进程退出时写入、启动时恢复；为空则只在内存中缓存
+        :param backend: 推理后端，"torch"（默认）或 "onnx"（onnxruntime，仅 CPU）
+        :param onnx_dir: ONNX 产物缓存目录，默认位于模型目录旁
+        :param onnx_quantize: 是否使用动态 int8 量化模型
+        :param onnx_min_agreement: 导出后与 PyTorch 的最低标签一致率，不达标则回退到 PyTorch
+        """
         self.model_dir = model_dir
         self.emotion_label_map = emotion_label_map
         self.risk_label_map = risk_label_map
         self.device = device
         self.max_seq_length = max_seq_length
+        self.batch_size = max(1, batch_size)
+        self.backend = backend
+        self.onnx_dir = onnx_dir
+        self.onnx_quantize = onnx_quantize
+        self.onnx_min_agreement = onnx_min_agreement
+        self.long_text_strategy = long_text_strategy
+        self.window_overlap = max(0, window_overlap)
         self.tokenizer = None
         self.model = None
+        self.onnx_runner = None
         self._load_model()
 
+        self.model_version = self._compute_model_version()
+        self.cache_path = cache_path
+        self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl, name="emotion_cache")
+        if cache_path and cache_size > 0:
+            restored = self.cache.load(cache_path, version=self.model_version)
+            logger.info(f"情感分类缓存已从磁盘恢复 {restored} 条")
+            atexit.register(self.save_cache)
+
     def _load_model(self):
         """加载情感分类模型与分词器"""
         try:
@@ -26,20 +62,162 @@ class EmotionClassifier:
         except Exception as e:
             raise RuntimeError(f"情感分类模型加载失败：{str(e)}")
 
-    def _encode_text(self, text):
-        """文本编码处理"""
+        if self.backend == "onnx":
+            self._load_onnx_backend()
+
+    def _load_onnx_backend(self):
+        """导出/加载 ONNX 模型，失败时回退到 PyTorch 后端"""
+        from emotion_onnx import load_or_export
+
+        try:
+            self.onnx_runner = load_or_export(
+                self.model,
+                self.tokenizer,
+                self.model_dir,
+                onnx_dir=self.onnx_dir,
+                quantize=self.onnx_quantize,
+                min_agreement=self.onnx_min_agreement,
+                max_length=self.max_seq_length
+            )
+            # onnxruntime 只在 CPU 上运行，PyTorch 权重不再需要
+            self.device = torch.device("cpu")
+            self.model = None
+            logger.info(f"✅ 情感分类使用 ONNX 后端: {self.onnx_runner.onnx_path}")
+        except Exception as e:
+            logger.error(f"⚠️ ONNX 后端不可用，回退到 PyTorch: {e}")
+            self.backend = "torch"
+            self.onnx_runner = None
+            self.model = self.model.to(self.device).eval()
+
+    def _run_model(self, input_ids, attention_mask):
+        """执行一次前向，返回 logits"""
+        if self.onnx_runner is not None:
+            return self.onnx_runner(input_ids, attention_mask)
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+    def _compute_model_version(self):
+        """
+        模型版本标识：模型目录指纹 + 影响输出的推理参数
+        目录中任何文件变化都会得到新版本，旧缓存（含落盘文件）随之失效
+        """
+        return content_key(
+            directory_fingerprint(self.model_dir),
+            self.backend,
+            str(self.onnx_quantize if self.backend == "onnx" else ""),
+            str(self.max_seq_length),
+            self.long_text_strategy,
+            str(self.window_overlap),
+        )
+
+    def save_cache(self):
+        """将结果缓存写入磁盘"""
+        if not self.cache_path:
+            return
         try:
-            return self.tokenizer(
-                text,
-                add_special_tokens=True,
-                max_length=self.max_seq_length,
-                padding="max_length",
-                truncation=True,
-                return_tensors="pt"
-            ).to(self.device)
+            saved = self.cache.dump(self.cache_path, version=self.model_version)
+            logger.info(f"情感分类缓存已写入磁盘 {saved} 条: {self.cache_path}")
+        except Exception as e:
+            logger.warning(f"情感分类缓存写入失败: {e}")
+
+    def _encode_texts(self, texts):
+        """
+        文本编码处理（不补齐）
+        超过模型长度的文本按滑动窗口切分为多段，每段独立加上特殊符号；
+        补齐推迟到分桶之后进行，每个桶只补齐到桶内最长的样本
+        :return: (input_ids_list, owners)，owners[i] 为第 i 段所属的原文本下标
+        """
+        try:
+            encoded = self.tokenizer(
+                texts,
+                add_special_tokens=False,
+                padding=False,
+                truncation=False,
+                verbose=False
+            )
         except Exception as e:
             raise Exception(f"文本编码失败：{str(e)}")
 
+        body_len = self.max_seq_length - self.tokenizer.num_special_tokens_to_add(pair=False)
+        stride = max(1, body_len - min(self.window_overlap, body_len - 1))
+
+        input_ids_list, owners = [], []
+        for text_idx, ids in enumerate(encoded.get("input_ids") or []):
+            if self.long_text_strategy == "truncate" or len(ids) <= body_len:
+                windows = [ids[:body_len]]
+            else:
+                windows = []
+                for start in range(0, len(ids), stride):
+                    windows.append(ids[start:start + body_len])
+                    if start + body_len >= len(ids):
+                        break
+            for window in windows:
+                input_ids_list.append(self.tokenizer.build_inputs_with_special_tokens(window))
+                owners.append(text_idx)
+
+        if len(set(owners)) != len(texts) or any(len(ids) == 0 for ids in input_ids_list):
+            raise Exception("编码结果无效，input_ids为空")
+        return input_ids_list, owners
+
+    def _aggregate_windows(self, window_logits, owners, num_texts):
+        """
+        将同一文本多个窗口的 logits 聚合为一条
+        - mean: 各窗口 logits 取平均
+        - max_risk: 取风险等级最高的窗口，风险相同时取置信度最高者
+        """
+        groups = [[] for _ in range(num_texts)]
+        for row, owner in enumerate(owners):
+            groups[owner].append(row)
+
+        risk_rank = {label: idx for idx, label in self.risk_label_map.items()}
+        aggregated = []
+        for rows in groups:
+            logits = window_logits[rows]
+            if len(rows) == 1:
+                aggregated.append(logits[0])
+            elif self.long_text_strategy == "mean":
+                aggregated.append(logits.mean(dim=0))
+            else:
+                probs = torch.softmax(logits, dim=1)
+                confidence, label_ids = probs.max(dim=1)
+
+                def severity(i):
+                    emotion = self.emotion_label_map[label_ids[i].item()]
+                    return risk_rank.get(self._heuristic_risk_assessment(emotion), -1), confidence[i].item()
+
+                aggregated.append(logits[max(range(len(rows)), key=severity)])
+        return torch.stack(aggregated)
+
+    def _pad_bucket(self, bucket_ids):
+        """将一个桶内的样本动态补齐到桶内最长长度"""
+        padded = self.tokenizer.pad(
+            {"input_ids": bucket_ids},
+            padding="longest",
+            return_attention_mask=True,
+            return_tensors="pt"
+        )
+        return padded["input_ids"].to(self.device), padded["attention_mask"].to(self.device)
+
+    def _forward_logits(self, input_ids_list):
+        """
+        按长度排序分桶后批量前向，返回与输入顺序一致的 logits [N, num_labels]
+        相近长度的样本放在同一桶里，避免短文本被补齐到长文本的长度
+        """
+        order = sorted(range(len(input_ids_list)), key=lambda i: len(input_ids_list[i]))
+        logits = [None] * len(input_ids_list)
+
+        with torch.no_grad():
+            for start in range(0, len(order), self.batch_size):
+                bucket = order[start:start + self.batch_size]
+                input_ids, attention_mask = self._pad_bucket([input_ids_list[i] for i in bucket])
+                try:
+                    bucket_logits = self._run_model(input_ids, attention_mask).float().cpu()
+                except Exception as e:
+                    raise Exception(f"情感倾向推理失败：{str(e)}")
+                for row, idx in enumerate(bucket):
+                    logits[idx] = bucket_logits[row]
+
+        return torch.stack(logits)
+
     def _heuristic_risk_assessment(self, emotion_label):
         """
         基于情感类别的启发式风险评估
@@ -47,7 +225,7 @@ class EmotionClassifier:
         """
         # 0: "中性", 1: "焦虑", 2: "抑郁", 3: "烦躁", 4: "自我否定"
         # 0: "无风险", 1: "低风险", 2: "中风险", 3: "高风险"
-        
+
         mapping = {
             "中性": "无风险",
             "焦虑": "低风险",   # 焦虑通常是低风险，除非严重
@@ -57,32 +235,89 @@ class EmotionClassifier:
         }
         return mapping.get(emotion_label, "未知")
 
+    def _classify_logits(self, texts):
+        """
+        带缓存的批量推理，返回与输入顺序一致的聚合 logits [N, num_labels]
+        缓存键为 归一化文本 + 模型版本 的哈希；同一批内重复的文本只推理一次
+        """
+        keys = [content_key(self.model_version, normalize_text(text)) for text in texts]
+        rows = [self.cache.get(key) for key in keys]
+
+        pending = {}
+        for idx, (key, row) in enumerate(zip(keys, rows)):
+            if row is None and key not in pending:
+                pending[key] = idx
+
+        if pending:
+            miss_texts = [texts[idx] for idx in pending.values()]
+            input_ids_list, owners = self._encode_texts(miss_texts)
+            # 所有文本的所有窗口在同一次分桶批量前向中完成
+            miss_logits = self._aggregate_windows(self._forward_logits(input_ids_list), owners, len(miss_texts))
+            computed = {}
+            for key, row in zip(pending, miss_logits.tolist()):
+                computed[key] = row
+                self.cache.set(key, row)
+            rows = [row if row is not None else computed[key] for key, row in zip(keys, rows)]
+
+        return torch.tensor(rows, dtype=torch.float32)
+
+    def discriminate_batch(self, texts):
+        """
+        批量判别情感倾向与风险等级
+        :param texts: 用户输入文本列表
+        :return: [(emotion_result, risk_result), ...]，顺序与输入一致
+        """
+        if not texts:
+            return []
+
+        logits = self._classify_logits(list(texts))
+        label_ids = torch.argmax(logits, dim=1).tolist()
+
+        results = []
+        for label_id in label_ids:
+            emotion_result = self.emotion_label_map[label_id]
+            # 风险等级判别 (使用启发式规则替代随机初始化的分类头)
+            risk_result = self._heuristic_risk_assessment(emotion_result)
+            results.append((emotion_result, risk_result))
+
+        # 如果需要更复杂的逻辑，可以结合 SCL-90 分数，但这通常在业务层处理
+
+        return results
+
+    def predict_batch(self, texts, top_k=3):
+        """
+        批量输出完整概率分布
+        :param texts: 用户输入文本列表
+        :param top_k: 返回概率最高的前 k 个情感标签
+        :return: [{"emotion", "risk", "probabilities": {标签: 概率}, "top_k": [{"label", "score"}]}, ...]
+        """
+        if not texts:
+            return []
+
+        probs = torch.softmax(self._classify_logits(list(texts)), dim=1)
+        top_k = max(1, min(top_k, probs.shape[1]))
+        top_scores, top_ids = probs.topk(top_k, dim=1)
+
+        results = []
+        for row, scores, ids in zip(probs.tolist(), top_scores.tolist(), top_ids.tolist()):
+            emotion_result = self.emotion_label_map[ids[0]]
+            results.append({
+                "emotion": emotion_result,
+                "risk": self._heuristic_risk_assessment(emotion_result),
+                "probabilities": {
+                    self.emotion_label_map[label_id]: round(p, 6) for label_id, p in enumerate(row)
+                },
+                "top_k": [
+                    {"label": self.emotion_label_map[label_id], "score": round(score, 6)}
+                    for label_id, score in zip(ids, scores)
+                ]
+            })
+        return results
+
     def discriminate(self, user_text):
         """
         判别情感倾向与风险等级
         :param user_text: 用户输入文本
         :return: (emotion_result, risk_result)
         """
-        # 文本编码
-        encoding = self._encode_text(user_text)
-        if encoding.get("input_ids") is None or encoding["input_ids"].shape[0] == 0:
-            raise Exception("编码结果无效，input_ids为空")
-
-        # 情感倾向判别
-        with torch.no_grad():
-            try:
-                outputs = self.model(
-                    input_ids=encoding["input_ids"],
-                    attention_mask=encoding["attention_mask"]
-                )
-                emotion_label_id = torch.argmax(outputs.logits, dim=1).item()
-                emotion_result = self.emotion_label_map[emotion_label_id]
-            except Exception as e:
-                raise Exception(f"情感倾向推理失败：{str(e)}")
-
-        # 风险等级判别 (使用启发式规则替代随机初始化的分类头)
-        risk_result = self._heuristic_risk_assessment(emotion_result)
-        
-        # 如果需要更复杂的逻辑，可以结合 SCL-90 分数，但这通常在业务层处理
-
-        return emotion_result, risk_result
+        return self.discriminate_batch([user_text])[0]
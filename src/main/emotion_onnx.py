@@ -0,0 +1,179 @@
+# -------------------------- 情感分类 ONNX 后端 --------------------------
+import os
+import json
+import time
+import logging
+
+import torch
+
+from utils.cache import directory_fingerprint
+
+logger = logging.getLogger(__name__)
+
+try:
+    import onnxruntime as ort
+except ImportError as e:
+    logger.warning(f"未检测到 onnxruntime，ONNX 推理后端不可用。错误详情: {e}")
+    ort = None
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model.int8.onnx"
+EXPORT_META_FILE = "export_meta.json"
+ONNX_OPSET = 14
+
+# 一致性校验用的留出样本，不参与任何训练/调参，仅用于比较导出前后的预测标签
+PARITY_SAMPLES = [
+    "今天和室友一起去图书馆自习，感觉挺充实的。",
+    "下周就要期末考试了，我复习不完，整晚都睡不着。",
+    "最近什么都不想做，觉得生活没有意义，每天都很累。",
+    "隔壁宿舍天天半夜吵闹，我真的快忍不了了。",
+    "我觉得自己什么都做不好，是个彻底的失败者。",
+    "周末去爬山了，风景很好，心情也放松了很多。",
+    "面试前一直心慌手抖，担心自己表现不好被刷掉。",
+    "和家里人吵了一架，现在看什么都烦。",
+    "好几个星期了，我对以前喜欢的事情都提不起兴趣。",
+    "别人都比我优秀，我不配得到任何人的关心。",
+    "老师表扬了我的课程报告，挺开心的。",
+    "一想到要在全班面前做展示，我就紧张得喘不过气。",
+]
+
+
+def default_onnx_dir(model_dir):
+    """导出产物缓存在模型目录旁边，如 model/Chinese-MentalBERT-onnx"""
+    return os.path.normpath(model_dir) + "-onnx"
+
+
+class _LogitsOnly(torch.nn.Module):
+    """导出时只保留 logits 输出"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+
+def export_onnx(model, tokenizer, output_path):
+    """以动态 batch/序列长度导出 ONNX 模型"""
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    dummy = tokenizer(["导出示例文本"], return_tensors="pt")
+    wrapped = _LogitsOnly(model.cpu().eval())
+    with torch.no_grad():
+        torch.onnx.export(
+            wrapped,
+            (dummy["input_ids"], dummy["attention_mask"]),
+            output_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch"},
+            },
+            opset_version=ONNX_OPSET,
+            do_constant_folding=True,
+        )
+    logger.info(f"✅ ONNX 模型已导出: {output_path}")
+
+
+def quantize_onnx(source_path, output_path):
+    """动态 int8 量化（仅量化权重，激活在运行时量化）"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantize_dynamic(source_path, output_path, weight_type=QuantType.QInt8)
+    logger.info(f"✅ ONNX int8 量化完成: {output_path}")
+
+
+class OnnxLogitsRunner:
+    """onnxruntime 推理会话封装，输入输出与 PyTorch 前向保持一致"""
+
+    def __init__(self, onnx_path, num_threads=None):
+        if ort is None:
+            raise RuntimeError("onnxruntime 未安装")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads or torch.get_num_threads()
+        self.onnx_path = onnx_path
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, input_ids, attention_mask):
+        logits = self.session.run(
+            ["logits"],
+            {
+                "input_ids": input_ids.cpu().numpy().astype("int64"),
+                "attention_mask": attention_mask.cpu().numpy().astype("int64"),
+            },
+        )[0]
+        return torch.from_numpy(logits)
+
+
+def check_parity(tokenizer, reference_fn, candidate_fn, samples=None, max_length=512):
+    """
+    比较两个前向函数在留出样本上的预测标签
+    :return: {"agreement": 标签一致率, "max_abs_diff": logits 最大绝对误差, "samples": 样本数}
+    """
+    samples = samples or PARITY_SAMPLES
+    encoded = tokenizer(samples, padding="longest", truncation=True, max_length=max_length, return_tensors="pt")
+    with torch.no_grad():
+        ref = reference_fn(encoded["input_ids"], encoded["attention_mask"]).float()
+        cand = candidate_fn(encoded["input_ids"], encoded["attention_mask"]).float()
+    agreement = (ref.argmax(dim=1) == cand.argmax(dim=1)).float().mean().item()
+    return {
+        "agreement": round(agreement, 4),
+        "max_abs_diff": round((ref - cand).abs().max().item(), 6),
+        "samples": len(samples),
+    }
+
+
+def load_or_export(model, tokenizer, model_dir, onnx_dir=None, quantize=False,
+                   min_agreement=0.95, max_length=512):
+    """
+    加载缓存的 ONNX 产物；若不存在或源模型已变化则重新导出并做一致性校验
+    :return: OnnxLogitsRunner
+    :raises RuntimeError: onnxruntime 不可用或一致性校验不通过
+    """
+    if ort is None:
+        raise RuntimeError("onnxruntime 未安装")
+
+    onnx_dir = onnx_dir or default_onnx_dir(model_dir)
+    fp32_path = os.path.join(onnx_dir, ONNX_MODEL_FILE)
+    target_path = os.path.join(onnx_dir, ONNX_INT8_MODEL_FILE) if quantize else fp32_path
+    meta_path = os.path.join(onnx_dir, EXPORT_META_FILE)
+
+    fingerprint = directory_fingerprint(model_dir)
+    meta = {}
+    if os.path.exists(meta_path):
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except Exception as e:
+            logger.warning(f"读取 ONNX 导出元数据失败，将重新导出: {e}")
+            meta = {}
+
+    if meta.get("fingerprint") != fingerprint:
+        meta = {"fingerprint": fingerprint, "parity": {}}
+
+    artifact = os.path.basename(target_path)
+    if not os.path.exists(fp32_path) or meta["parity"] == {}:
+        export_onnx(model, tokenizer, fp32_path)
+    if quantize and (not os.path.exists(target_path) or artifact not in meta["parity"]):
+        quantize_onnx(fp32_path, target_path)
+
+    runner = OnnxLogitsRunner(target_path)
+
+    if artifact not in meta["parity"]:
+        def reference_fn(input_ids, attention_mask):
+            return model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+        parity = check_parity(tokenizer, reference_fn, runner, max_length=max_length)
+        logger.info(f"ONNX 一致性校验 ({artifact}): {parity}")
+        if parity["agreement"] < min_agreement:
+            raise RuntimeError(
+                f"ONNX 一致性校验未通过: 标签一致率 {parity['agreement']} < {min_agreement}"
+            )
+        meta["parity"][artifact] = dict(parity, checked_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    return runner
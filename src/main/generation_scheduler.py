@@ -0,0 +1,191 @@
+# -------------------------- 连续批处理生成调度模块 --------------------------
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16)
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+_STREAM_END = object()
+
+
+class GenerationRequest:
+    """排队中的生成请求"""
+
+    def __init__(self, generation_args, on_token=None):
+        self.generation_args = generation_args
+        self.on_token = on_token
+        self.future = Future()
+        self.submitted_at = time.monotonic()
+        self.sequence = None
+
+
+class GenerationScheduler:
+    """
+    连续批处理生成调度器
+    独占 AdviceGenerator，所有请求进入队列；后台线程每一步：
+    1. 在批大小上限内接纳新请求（逐条预填充）
+    2. 所有进行中的序列合并为一个 batch 解码一步
+    3. 把新文本推给各自的调用方，结束的序列立即移出 batch
+    调用方通过 Future 获取最终结果，或通过 stream() 逐段获取文本
+    """
+
+    def __init__(self, generator, max_batch_size=4, name="generation_scheduler"):
+        self.generator = generator
+        self.max_batch_size = max(1, max_batch_size)
+        self.name = name
+        self._queue = queue.Queue()
+        self._active = []
+        self._stopped = threading.Event()
+
+        self._queue_depth = metrics.gauge(f"{name}_queue_depth", "等待接纳的生成请求数")
+        self._active_gauge = metrics.gauge(f"{name}_active_sequences", "正在解码的序列数")
+        self._batch_hist = metrics.histogram(
+            f"{name}_active_batch_size", "每个解码步的 batch 大小", buckets=BATCH_SIZE_BUCKETS
+        )
+        self._wait_hist = metrics.histogram(
+            f"{name}_queue_wait_seconds", "请求从提交到开始预填充的等待时间", buckets=LATENCY_BUCKETS
+        )
+        self._latency_hist = metrics.histogram(
+            f"{name}_request_latency_seconds", "请求从提交到生成结束的总耗时", buckets=LATENCY_BUCKETS
+        )
+
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def active_batch_size(self):
+        return len(self._active)
+
+    def submit(self, on_token=None, **generation_args):
+        """
+        提交生成请求
+        :param on_token: 可选回调，每产生一段新文本调用一次（在调度线程中执行，应尽快返回）
+        :return: Future，结果为完整的建议文本
+        """
+        request = GenerationRequest(generation_args, on_token)
+        if self._stopped.is_set():
+            request.future.set_exception(RuntimeError(f"{self.name} 已停止"))
+            return request.future
+        self._queue.put(request)
+        self._queue_depth.set(self._queue.qsize())
+        return request.future
+
+    def generate(self, timeout=None, **generation_args):
+        """同步生成：提交并等待完整结果；等待超时时取消该序列"""
+        cancel_event = generation_args.get("cancel_event")
+        if cancel_event is None:
+            cancel_event = generation_args["cancel_event"] = threading.Event()
+        future = self.submit(**generation_args)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            cancel_event.set()
+            raise
+
+    def stream(self, **generation_args):
+        """流式生成：逐段产出文本；调用方提前关闭生成器时取消该序列，释放 batch 位置"""
+        cancel_event = generation_args.get("cancel_event")
+        if cancel_event is None:
+            cancel_event = generation_args["cancel_event"] = threading.Event()
+        pieces = queue.Queue()
+        future = self.submit(on_token=pieces.put, **generation_args)
+        future.add_done_callback(lambda _: pieces.put(_STREAM_END))
+        try:
+            while True:
+                piece = pieces.get()
+                if piece is _STREAM_END:
+                    break
+                yield piece
+        finally:
+            if not future.done():
+                cancel_event.set()
+        # 抛出生成过程中的异常
+        future.result()
+
+    def stop(self):
+        self._stopped.set()
+        self._queue.put(None)
+
+    def _admit(self):
+        """在批大小上限内接纳新请求；没有进行中的序列时阻塞等待"""
+        while len(self._active) < self.max_batch_size:
+            try:
+                block = not self._active
+                request = self._queue.get(block=block)
+            except queue.Empty:
+                break
+            self._queue_depth.set(self._queue.qsize())
+            if request is None:
+                return False
+
+            self._wait_hist.observe(time.monotonic() - request.submitted_at)
+            try:
+                request.sequence = self.generator.start_sequence(**request.generation_args)
+            except Exception as e:
+                logger.error(f"{self.name} 预填充失败: {e}")
+                request.future.set_exception(e)
+                continue
+            self._active.append(request)
+            self._deliver(request)
+        return True
+
+    def _deliver(self, request):
+        """推送新文本；序列结束时完成 Future"""
+        piece = request.sequence.drain()
+        if piece and request.on_token:
+            try:
+                request.on_token(piece)
+            except Exception as e:
+                logger.warning(f"{self.name} 推送生成文本失败: {e}")
+        if request.sequence.done and not request.future.done():
+            self._latency_hist.observe(time.monotonic() - request.submitted_at)
+            request.future.set_result(request.sequence.text.strip())
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if not self._admit():
+                break
+            self._active = [r for r in self._active if not r.sequence.done]
+            self._active_gauge.set(len(self._active))
+            if not self._active:
+                continue
+
+            self._batch_hist.observe(len(self._active))
+            try:
+                self.generator.step_sequences([r.sequence for r in self._active])
+            except Exception as e:
+                logger.error(f"{self.name} 解码失败: {e}")
+                for request in self._active:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                self._active = []
+                continue
+
+            for request in self._active:
+                self._deliver(request)
+
+        # 停止后让所有未完成的请求失败，避免调用方永久阻塞
+        pending = list(self._active)
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                pending.append(request)
+        for request in pending:
+            if not request.future.done():
+                request.future.set_exception(RuntimeError(f"{self.name} 已停止"))
+        self._active = []
+        self._active_gauge.set(0)
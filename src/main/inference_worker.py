@@ -0,0 +1,383 @@
+# -------------------------- 独立推理进程模块 --------------------------
+# 推理进程独占 AdviceGenerator 与 EmotionClassifier，各 Web worker 通过本地 IPC 通道访问，
+# 一台机器上只需加载一份模型即可服务多个 Flask/gunicorn worker
+# 用法: python inference_worker.py [--address /path/to/inference.sock]
+#       Web 端设置 INFERENCE_MODE=remote
+import argparse
+import ipaddress
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Listener, Client
+
+from config import (
+    INFERENCE_SOCKET, INFERENCE_AUTHKEY, INFERENCE_ALLOW_REMOTE, INFERENCE_TIMEOUT, INFERENCE_WORKER_THREADS
+)
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+
+# 应答类型
+RESULT, CHUNK, END, ERROR = "result", "chunk", "end", "error"
+# 取消请求的控制消息；支持取消的方法在推理进程中会收到一个 cancel_event
+CANCEL = "cancel"
+CANCELLABLE_METHODS = ("generate_advice", "stream_advice")
+CANCEL_POLL_INTERVAL = 0.1
+
+
+def _is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def parse_address(address, allow_remote=None):
+    """
+    'host:port' 使用 TCP，Windows 命名管道与其他路径原样返回（AF_PIPE / AF_UNIX）
+    通道用 pickle 传输消息，TCP 默认只允许回环地址；非本机地址需设置 INFERENCE_ALLOW_REMOTE=true
+    """
+    if address.startswith("\\\\.\\pipe\\"):
+        return address
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        host = host.strip("[]") or "127.0.0.1"
+        if not _is_loopback(host):
+            if not (INFERENCE_ALLOW_REMOTE if allow_remote is None else allow_remote):
+                raise ValueError(
+                    f"推理通道地址 {host} 不是本机回环地址；确需跨机器访问时设置 INFERENCE_ALLOW_REMOTE=true"
+                )
+            logger.warning(
+                f"⚠️ 推理通道使用非本机地址 {host}:{port}：通道以 pickle 传输消息，"
+                f"请确保网络隔离且 INFERENCE_AUTHKEY 没有泄露"
+            )
+        return (host, int(port))
+    return address
+
+
+def resolve_authkey(authkey=None):
+    """认证密钥没有默认值，未设置时拒绝启动服务端或客户端"""
+    authkey = authkey or INFERENCE_AUTHKEY
+    if not authkey:
+        raise ValueError("未设置 INFERENCE_AUTHKEY，拒绝建立推理通道")
+    return authkey.encode("utf-8")
+
+
+class InferenceServer:
+    """
+    推理服务端
+    每个连接一个读线程，请求带 req_id，交给线程池并发执行，
+    因此来自不同 Web worker 的请求仍会在本进程内被微批 / 连续批处理合并
+    """
+
+    def __init__(self, loader, address=None, authkey=None, max_workers=None):
+        self.loader = loader
+        self.address = parse_address(address or INFERENCE_SOCKET)
+        self.authkey = resolve_authkey(authkey)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or INFERENCE_WORKER_THREADS, thread_name_prefix="inference"
+        )
+        self._inflight = metrics.gauge("inference_worker_inflight", "推理进程中正在处理的请求数")
+        self._latency_hist = metrics.histogram(
+            "inference_worker_latency_seconds", "推理进程处理单个请求的耗时", buckets=LATENCY_BUCKETS
+        )
+        self._handlers = {
+            "ping": self._ping,
+            "discriminate": loader.discriminate,
+            "discriminate_batch": lambda texts: self._classifier().discriminate_batch(texts),
+            "predict_batch": lambda texts, top_k=3: self._classifier().predict_batch(texts, top_k=top_k),
+            "generate_advice": loader.generate_advice,
+            "metrics": metrics.snapshot,
+        }
+        self._stream_handlers = {
+            "stream_advice": loader.stream_advice,
+        }
+
+    def _classifier(self):
+        if self.loader.emotion_classifier is None:
+            raise RuntimeError("情感分类器未加载")
+        return self.loader.emotion_classifier
+
+    def _ping(self):
+        return {
+            "pid": os.getpid(),
+            "emotion": self.loader.emotion_classifier is not None,
+            "llm": self.loader.advice_generator is not None,
+        }
+
+    def serve_forever(self):
+        if isinstance(self.address, str) and not self.address.startswith("\\\\.\\pipe\\"):
+            # 清理上次异常退出残留的 socket 文件
+            os.makedirs(os.path.dirname(os.path.abspath(self.address)), exist_ok=True)
+            if os.path.exists(self.address):
+                os.remove(self.address)
+
+        with Listener(self.address, authkey=self.authkey) as listener:
+            if isinstance(self.address, str) and os.name != "nt":
+                # socket 文件只允许当前用户访问
+                os.chmod(self.address, 0o600)
+            logger.info(f"✅ 推理进程已就绪，监听 {self.address} (pid={os.getpid()})")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    logger.warning(f"接受连接失败: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def _serve_connection(self, conn):
+        send_lock = threading.Lock()
+
+        def reply(req_id, kind, payload=None):
+            try:
+                with send_lock:
+                    conn.send((req_id, kind, payload))
+            except Exception as e:
+                logger.warning(f"发送应答失败 (req_id={req_id}): {e}")
+
+        cancel_events = {}
+        logger.info("Web worker 已连接")
+        while True:
+            try:
+                req_id, method, kwargs = conn.recv()
+            except (EOFError, OSError):
+                break
+            except Exception as e:
+                logger.warning(f"无法解析的请求: {e}")
+                continue
+            if method == CANCEL:
+                event = cancel_events.get(req_id)
+                if event is not None:
+                    event.set()
+                continue
+            if method in CANCELLABLE_METHODS:
+                kwargs["cancel_event"] = cancel_events[req_id] = threading.Event()
+            self._executor.submit(self._dispatch, reply, req_id, method, kwargs, cancel_events)
+        conn.close()
+        # Web worker 已断开，其请求的结果无人接收，全部取消
+        for event in list(cancel_events.values()):
+            event.set()
+        logger.info("Web worker 已断开")
+
+    def _dispatch(self, reply, req_id, method, kwargs, cancel_events):
+        started = time.monotonic()
+        self._inflight.inc()
+        try:
+            if method in self._stream_handlers:
+                for piece in self._stream_handlers[method](**kwargs):
+                    reply(req_id, CHUNK, piece)
+                reply(req_id, END)
+            elif method in self._handlers:
+                reply(req_id, RESULT, self._handlers[method](**kwargs))
+            else:
+                reply(req_id, ERROR, f"未知的推理方法: {method}")
+        except Exception as e:
+            logger.error(f"推理请求失败 ({method}): {e}")
+            reply(req_id, ERROR, str(e))
+        finally:
+            cancel_events.pop(req_id, None)
+            self._inflight.dec()
+            self._latency_hist.observe(time.monotonic() - started)
+
+
+class InferenceClient:
+    """
+    推理客户端（每个 Web worker 进程一个连接）
+    多个请求线程共享同一连接，按 req_id 多路复用：读线程把应答分发到各请求自己的队列
+    连接在首次使用时建立，fork 后或断开后自动重连
+    """
+
+    def __init__(self, address=None, authkey=None, timeout=None):
+        self.address = parse_address(address or INFERENCE_SOCKET)
+        self.authkey = resolve_authkey(authkey)
+        self.timeout = INFERENCE_TIMEOUT if timeout is None else timeout
+        self._conn = None
+        self._pid = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+
+        self._latency_hist = metrics.histogram(
+            "inference_client_latency_seconds", "Web worker 调用推理进程的往返耗时", buckets=LATENCY_BUCKETS
+        )
+        self._timeouts = metrics.counter("inference_client_timeouts_total", "调用推理进程超时次数")
+        self._errors = metrics.counter("inference_client_errors_total", "调用推理进程失败次数")
+
+    def _connection(self):
+        with self._lock:
+            if self._conn is None or self._pid != os.getpid():
+                # fork 继承来的连接属于父进程，不能共用
+                self._pending = {}
+                self._conn = Client(self.address, authkey=self.authkey)
+                self._pid = os.getpid()
+                threading.Thread(
+                    target=self._read_loop, args=(self._conn,), name="inference-client", daemon=True
+                ).start()
+            return self._conn
+
+    def _read_loop(self, conn):
+        while True:
+            try:
+                req_id, kind, payload = conn.recv()
+            except (EOFError, OSError) as e:
+                self._disconnect(conn, e)
+                return
+            pending = self._pending.get(req_id)
+            if pending is not None:
+                pending.put((kind, payload))
+
+    def _disconnect(self, conn, reason):
+        """连接断开：所有等待中的请求立即失败"""
+        with self._lock:
+            if self._conn is not conn:
+                return
+            self._conn = None
+            pending, self._pending = self._pending, {}
+        for replies in pending.values():
+            replies.put((ERROR, f"与推理进程的连接已断开: {reason}"))
+        logger.warning(f"与推理进程的连接已断开: {reason}")
+
+    def _send(self, method, kwargs):
+        conn = self._connection()
+        req_id = next(self._ids)
+        replies = queue.Queue()
+        self._pending[req_id] = replies
+        try:
+            with self._send_lock:
+                conn.send((req_id, method, kwargs))
+        except Exception as e:
+            self._pending.pop(req_id, None)
+            self._disconnect(conn, e)
+            self._errors.inc()
+            raise ConnectionError(f"无法发送请求到推理进程: {e}")
+        return req_id, replies
+
+    def cancel(self, req_id):
+        """通知推理进程取消请求（尽力而为）"""
+        try:
+            with self._send_lock:
+                self._conn.send((req_id, CANCEL, None))
+        except Exception:
+            pass
+
+    def _wait(self, req_id, replies, method, deadline, cancel_event=None):
+        """
+        等待下一条应答；cancel_event 被设置后通知推理进程取消，
+        并继续等待它返回已生成的部分结果
+        """
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.cancel(req_id)
+                self._timeouts.inc()
+                raise TimeoutError(f"推理进程响应超时 ({method})")
+            watching = cancel_event is not None and not cancel_event.is_set()
+            try:
+                return replies.get(timeout=min(remaining, CANCEL_POLL_INTERVAL) if watching else remaining)
+            except queue.Empty:
+                if watching and cancel_event.is_set():
+                    self.cancel(req_id)
+
+    def call(self, method, timeout=None, cancel_event=None, **kwargs):
+        """同步调用推理进程中的方法"""
+        started = time.monotonic()
+        deadline = started + (self.timeout if timeout is None else timeout)
+        req_id, replies = self._send(method, kwargs)
+        try:
+            kind, payload = self._wait(req_id, replies, method, deadline, cancel_event)
+        finally:
+            self._pending.pop(req_id, None)
+        self._latency_hist.observe(time.monotonic() - started)
+        if kind == ERROR:
+            self._errors.inc()
+            raise RuntimeError(payload)
+        return payload
+
+    def stream(self, method, timeout=None, cancel_event=None, **kwargs):
+        """
+        流式调用：逐段产出推理进程推送的文本，timeout 为整个流的最长时间
+        调用方提前关闭生成器时通知推理进程取消
+        """
+        started = time.monotonic()
+        deadline = started + (self.timeout if timeout is None else timeout)
+        req_id, replies = self._send(method, kwargs)
+        finished = False
+        try:
+            while True:
+                kind, payload = self._wait(req_id, replies, method, deadline, cancel_event)
+                if kind == CHUNK:
+                    yield payload
+                elif kind == END:
+                    finished = True
+                    break
+                elif kind == ERROR:
+                    finished = True
+                    self._errors.inc()
+                    raise RuntimeError(payload)
+        finally:
+            if not finished:
+                self.cancel(req_id)
+            self._pending.pop(req_id, None)
+            self._latency_hist.observe(time.monotonic() - started)
+
+
+class RemoteEmotionClassifier:
+    """推理进程中情感分类器的代理，接口与 EmotionClassifier 一致"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def discriminate(self, text):
+        return tuple(self.client.call("discriminate", user_text=text))
+
+    def discriminate_batch(self, texts):
+        return [tuple(r) for r in self.client.call("discriminate_batch", texts=list(texts))]
+
+    def predict_batch(self, texts, top_k=3):
+        return self.client.call("predict_batch", texts=list(texts), top_k=top_k)
+
+
+class RemoteAdviceGenerator:
+    """推理进程中建议生成器的代理"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def generate(self, **generation_args):
+        return self.client.call("generate_advice", **generation_args)
+
+    def generate_stream(self, **generation_args):
+        return self.client.stream("stream_advice", **generation_args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YibinU 独立推理进程")
+    parser.add_argument("--address", default=INFERENCE_SOCKET, help="监听地址：socket 路径、命名管道或 host:port")
+    args = parser.parse_args()
+
+    from utils.logging_config import setup_logging
+    from model_loader import model_loader
+
+    setup_logging()
+    # 先校验通道配置，避免加载完模型才发现无法监听
+    try:
+        server = InferenceServer(model_loader, address=args.address)
+    except ValueError as e:
+        logger.error(f"❌ {e}")
+        raise SystemExit(1)
+    # 推理进程自身总是在本地加载模型
+    model_loader.load_models(mode="local")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
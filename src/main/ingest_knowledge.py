@@ -0,0 +1,73 @@
+# -------------------------- 知识库批量导入 --------------------------
+# 流式读取 JSONL / CSV，批量向量化后分块写入 Chroma 与 MySQL，支持断点续传：
+#   python ingest_knowledge.py articles.jsonl
+#   python ingest_knowledge.py articles.csv --type private --uuid <用户UUID>
+# 中断后重新执行同一命令即从断点继续；--restart 忽略断点从头导入
+import argparse
+import logging
+import os
+import sys
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.append(current_dir)
+
+from config import RAG_EMBED_BATCH_SIZE, RAG_WRITE_CHUNK_SIZE
+from database import db_manager
+from rag_service import rag_service
+from services.ingest_service import ingest_service, iter_records, detect_format, IngestCheckpoint, SUPPORTED_FORMATS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识库批量导入 (JSONL / CSV)")
+    parser.add_argument("path", help="导入文件，每条记录包含 title、content")
+    parser.add_argument("--format", choices=SUPPORTED_FORMATS, help="文件格式，默认按扩展名判断")
+    parser.add_argument("--type", dest="k_type", choices=("public", "private"), default="public")
+    parser.add_argument("--uuid", default="public", help="--type private 时的用户 UUID")
+    parser.add_argument("--chunk-size", type=int, default=RAG_WRITE_CHUNK_SIZE, help="每块写入与记录断点的条数")
+    parser.add_argument("--embed-batch-size", type=int, default=RAG_EMBED_BATCH_SIZE, help="每次向量化的条数")
+    parser.add_argument("--checkpoint", help="断点文件，默认 <导入文件>.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="忽略已有断点，从头导入")
+    args = parser.parse_args()
+
+    if args.k_type == "private" and args.uuid == "public":
+        parser.error("--type private 需要指定 --uuid")
+
+    db_manager._init_pool()
+    db_manager.init_db()
+    if not rag_service.initialize():
+        logger.warning("⚠️ RAG服务未初始化，知识库将仅写入 MySQL，无法进行向量检索")
+
+    checkpoint_path = args.checkpoint or f"{args.path}.checkpoint.json"
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    stat = os.stat(args.path)
+    checkpoint = IngestCheckpoint(checkpoint_path, source=f"{os.path.abspath(args.path)}:{stat.st_size}")
+
+    def progress(stats):
+        print(f"已读取 {stats['read']} 条，写入 {stats['inserted']} 条，跳过 {stats['skipped']} 条，"
+              f"{stats['docs_per_second']} 条/秒", flush=True)
+
+    fmt = args.format or detect_format(args.path)
+    try:
+        with open(args.path, "r", encoding="utf-8-sig", newline="") as f:
+            stats = ingest_service.ingest(
+                iter_records(f, fmt),
+                uuid=args.uuid,
+                k_type=args.k_type,
+                chunk_size=args.chunk_size,
+                embed_batch_size=args.embed_batch_size,
+                checkpoint=checkpoint,
+                progress=progress
+            )
+    except ConnectionError as e:
+        logger.error(f"❌ 导入中止: {e}（已完成的块记录在断点中，恢复后重新执行即可继续）")
+        sys.exit(1)
+    print(f"✅ 导入完成: {stats}")
+
+
+if __name__ == "__main__":
+    main()
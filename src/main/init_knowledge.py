@@ -9,6 +9,7 @@ if current_dir not in sys.path:
 
 from rag_service import rag_service
 from database import db_manager
+from services.ingest_service import ingest_service
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -35,49 +36,19 @@ knowledge_data = [
 
 def init_knowledge():
     # 初始化数据库连接
+    db_manager._init_pool()
     db_manager.init_db()
     
-    rag_available = True
-    if rag_service.vector_store is None:
+    if not rag_service.initialize():
         logger.warning("⚠️ RAG服务未初始化，知识库将仅写入 MySQL，无法进行向量检索")
-        rag_available = False
 
     logger.info("开始初始化公共知识库...")
-    for item in knowledge_data:
-        # 1. 尝试添加到向量数据库 (RAG)
-        rag_success = False
-        if rag_available:
-            rag_success = rag_service.add_knowledge(
-                uuid="public", # 公共知识
-                title=item["title"],
-                content=item["content"],
-                k_type="public"
-            )
-            if not rag_success:
-                 logger.warning(f"❌ RAG添加失败: {item['title']}")
-        
-        # 2. 无论 RAG 是否成功，都添加到 MySQL (用于列表展示)
-        try:
-            # 检查是否存在
-            sql_check = "SELECT id FROM knowledge_base WHERE title = %s AND type = 'public'"
-            res = db_manager.execute_query(sql_check, (item["title"],))
-            
-            if not res:
-                sql_insert = "INSERT INTO knowledge_base (type, uuid, title, content, created_at) VALUES ('public', 'public', %s, %s, NOW())"
-                db_manager.execute_update(sql_insert, (item["title"], item["content"]))
-                status_msg = "MySQL ✅"
-                if rag_available and rag_success:
-                    status_msg += ", RAG ✅"
-                elif rag_available and not rag_success:
-                    status_msg += ", RAG ❌"
-                else:
-                    status_msg += ", RAG ⚠️ (不可用)"
-                
-                logger.info(f"已添加: {item['title']} [{status_msg}]")
-            else:
-                logger.info(f"⚠️ 已存在于数据库: {item['title']}")
-        except Exception as e:
-            logger.error(f"数据库操作失败: {e}")
+    # 已存在的标题自动跳过；大批量文章请使用 ingest_knowledge.py
+    try:
+        stats = ingest_service.ingest(knowledge_data, uuid="public", k_type="public")
+        logger.info(f"新增 {stats['inserted']} 条，已存在 {stats['skipped']} 条，写入向量库 {stats['vectors']} 条")
+    except Exception as e:
+        logger.error(f"知识库初始化失败: {e}")
             
     logger.info("知识库初始化完成！")
 
@@ -0,0 +1,194 @@
+import math
+import re
+import logging
+import threading
+from array import array
+from collections import Counter, defaultdict
+
+logger = logging.getLogger(__name__)
+
+CJK_RUN = re.compile(r"[㐀-鿿豈-﫿]+")
+ASCII_WORD = re.compile(r"[A-Za-z0-9]+")
+
+# 墓碑数超过 max(COMPACT_MIN_DEAD, 存活数 × COMPACT_RATIO) 时压缩，回收已删除文档占用的空间
+COMPACT_RATIO = 0.25
+COMPACT_MIN_DEAD = 64
+
+
+def _cjk_terms(run, unigrams):
+    terms = [run[i:i + 2] for i in range(len(run) - 1)]
+    if unigrams or len(run) == 1:
+        terms.extend(run)
+    return terms
+
+
+def tokenize(text, unigrams=True):
+    """
+    中文按字二元组 (bigram) 切分，不依赖分词词典；英文与数字按词小写
+    文档同时索引单字，使单字查询也能命中；查询只用单字补足长度为 1 的片段
+    """
+    terms = []
+    for run in CJK_RUN.findall(text):
+        terms.extend(_cjk_terms(run, unigrams))
+    terms.extend(word.lower() for word in ASCII_WORD.findall(text))
+    return terms
+
+
+class LexicalIndex:
+    """
+    进程内 BM25 倒排索引
+    文档按加入顺序编号，每个词的倒排表是两个紧凑数组（文档序号、词频），序号单调递增；
+    删除只打墓碑标记，检索时跳过；idf 用的文档频率只计未删除的文档，删除时同步扣减；
+    墓碑累积到一定比例后整体压缩（重新编号、过滤倒排表），反复覆盖同一知识（如 SCL-90 摘要）时索引不会无限增长
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}
+        self._df = Counter()
+        self._ids = []
+        self._namespaces = []
+        self._lengths = array("I")
+        self._texts = []
+        self._metadatas = []
+        self._alive = []
+        self._ordinal = {}
+        self._by_parent = defaultdict(list)
+        self._total_length = 0
+        self._live_count = 0
+        self._dead_count = 0
+        self._lock = threading.RLock()
+        self.built = False
+
+    def __len__(self):
+        return self._live_count
+
+    def add(self, ids, texts, metadatas):
+        """增量加入文档（通常是知识块），已存在的 ID 跳过；已删除的 ID 按新内容重新加入"""
+        with self._lock:
+            for doc_id, text, metadata in zip(ids, texts, metadatas):
+                if doc_id in self._ordinal and self._alive[self._ordinal[doc_id]]:
+                    continue
+                ordinal = len(self._ids)
+                counts = Counter(tokenize(text))
+                for term, tf in counts.items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = self._postings[term] = (array("I"), array("H"))
+                    postings[0].append(ordinal)
+                    postings[1].append(min(tf, 65535))
+                    self._df[term] += 1
+                length = sum(counts.values())
+                self._ids.append(doc_id)
+                self._namespaces.append(metadata.get("uuid"))
+                self._lengths.append(length)
+                self._texts.append(text)
+                self._metadatas.append(metadata)
+                self._alive.append(True)
+                self._ordinal[doc_id] = ordinal
+                self._by_parent[metadata.get("parent_id")].append(ordinal)
+                self._total_length += length
+                self._live_count += 1
+
+    def _tombstone(self, ordinal):
+        self._alive[ordinal] = False
+        for term in set(tokenize(self._texts[ordinal])):
+            self._df[term] -= 1
+        self._total_length -= self._lengths[ordinal]
+        self._live_count -= 1
+        self._dead_count += 1
+
+    def remove_parent(self, parent_id):
+        """删除一条知识的所有块"""
+        with self._lock:
+            for ordinal in self._by_parent.pop(parent_id, []):
+                if self._alive[ordinal]:
+                    self._tombstone(ordinal)
+            self._maybe_compact()
+
+    def remove(self, ids):
+        """按块 ID 删除"""
+        with self._lock:
+            for doc_id in ids:
+                ordinal = self._ordinal.get(doc_id)
+                if ordinal is not None and self._alive[ordinal]:
+                    self._tombstone(ordinal)
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self._dead_count > max(COMPACT_MIN_DEAD, self._live_count * COMPACT_RATIO):
+            self._compact()
+
+    def _compact(self):
+        """丢弃墓碑：存活文档按原顺序重新编号，倒排表只保留存活文档（序号仍单调递增）"""
+        remap = {}
+        for ordinal, alive in enumerate(self._alive):
+            if alive:
+                remap[ordinal] = len(remap)
+        for term in list(self._postings):
+            ordinals, tfs = self._postings[term]
+            kept = [(remap[o], tf) for o, tf in zip(ordinals, tfs) if o in remap]
+            if kept:
+                self._postings[term] = (array("I", (o for o, _ in kept)), array("H", (tf for _, tf in kept)))
+            else:
+                del self._postings[term]
+                self._df.pop(term, None)
+        survivors = sorted(remap)
+        self._ids = [self._ids[o] for o in survivors]
+        self._namespaces = [self._namespaces[o] for o in survivors]
+        self._lengths = array("I", (self._lengths[o] for o in survivors))
+        self._texts = [self._texts[o] for o in survivors]
+        self._metadatas = [self._metadatas[o] for o in survivors]
+        self._alive = [True] * len(survivors)
+        self._ordinal = {doc_id: ordinal for ordinal, doc_id in enumerate(self._ids)}
+        self._by_parent = defaultdict(list)
+        for ordinal, metadata in enumerate(self._metadatas):
+            self._by_parent[metadata.get("parent_id")].append(ordinal)
+        logger.debug(f"词法索引压缩：回收 {self._dead_count} 个已删除文档，剩余 {len(survivors)} 个")
+        self._dead_count = 0
+
+    def search(self, query, namespaces, k=10):
+        """
+        BM25 检索，只返回属于 namespaces 的文档
+        :return: [(doc_id, text, metadata, score)]，按得分降序
+        """
+        terms = set(tokenize(query, unigrams=False))
+        if not terms:
+            return []
+        namespaces = set(namespaces)
+        with self._lock:
+            if not self._live_count:
+                return []
+            avg_length = self._total_length / self._live_count
+            scores = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                df = self._df.get(term, 0)
+                if postings is None or not df:
+                    continue
+                ordinals, tfs = postings
+                idf = math.log(1 + (self._live_count - df + 0.5) / (df + 0.5))
+                for ordinal, tf in zip(ordinals, tfs):
+                    if not self._alive[ordinal] or self._namespaces[ordinal] not in namespaces:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[ordinal] / avg_length)
+                    scores[ordinal] = scores.get(ordinal, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [
+                (self._ids[ordinal], self._texts[ordinal], self._metadatas[ordinal], score)
+                for ordinal, score in top
+            ]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    倒数排名融合：score(d) = Σ 1 / (k + rank)，rank 从 1 开始
+    :param rankings: 多个按相关度排好序的 ID 列表
+    :return: 融合后的 ID 列表
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
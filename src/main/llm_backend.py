@@ -0,0 +1,369 @@
+# -------------------------- 生成后端模块 --------------------------
+# local : 本进程加载 ChatGLM（AdviceGenerator 自身的解码循环，支持前缀 KV 缓存与连续批处理）
+# openai: OpenAI 兼容的 HTTP 推理服务（vLLM、llama.cpp server 等），GPU 推理可部署在独立机器上
+import http.client
+from abc import ABC, abstractmethod
+import json
+import logging
+import random
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+from config import (
+    LLM_API_BASE, LLM_API_KEY, LLM_API_MODEL, LLM_API_TIMEOUT,
+    LLM_API_MAX_CONNECTIONS, LLM_API_MAX_RETRIES
+)
+from utils.chunking import ApproxTokenizer
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+TTFT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# 重试退避：base * 2^attempt 封顶后取 [0, 上限) 内的随机值（full jitter）
+BACKOFF_BASE = 0.2
+BACKOFF_CAP = 5.0
+
+deadline_exceeded_counter = metrics.counter("generation_deadline_exceeded_total", "因超过截止时间提前结束的生成数")
+cancelled_counter = metrics.counter("generation_cancelled_total", "因请求取消（如客户端断开）提前结束的生成数")
+
+
+class BackendError(Exception):
+    """后端请求失败"""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return self.status is None or self.status in RETRY_STATUS
+
+
+class LLMBackend(ABC):
+    """
+    生成后端接口
+    给定 system / user 两段提示词，逐段产出生成的文本；
+    截止时间（time.time() 时间戳）已过或 cancel_event 被设置时尽快停止，已产出的部分保留
+    user_prompt 可以是文本，也可以是由 tokenizer 编码、已按 token 预算截断好的 token 序列
+    """
+
+    name = "base"
+    # 是否支持由 GenerationScheduler 连续批处理（start_sequence / step_sequences）
+    batching = False
+    # 用于按 token 预算组装 user_prompt 的分词器
+    tokenizer = None
+
+    @property
+    def available(self):
+        """后端能否生成（本地模型加载失败时为 False）"""
+        return True
+
+    def system_tokens(self, system_prompt):
+        """system_prompt 占用的 token 数，从总预算中扣除"""
+        if self.tokenizer is None:
+            return 0
+        return len(self.tokenizer([system_prompt], add_special_tokens=False)["input_ids"][0])
+
+    @abstractmethod
+    def stream_chat(self, system_prompt, user_prompt, max_new_tokens, temperature, top_p,
+                    deadline=None, cancel_event=None):
+        """逐段产出生成的文本"""
+
+    def generate_chat(self, system_prompt, user_prompt, max_new_tokens, temperature, top_p,
+                      deadline=None, cancel_event=None):
+        return "".join(self.stream_chat(
+            system_prompt, user_prompt, max_new_tokens, temperature, top_p, deadline, cancel_event
+        ))
+
+    def close(self):
+        pass
+
+
+class HTTPConnectionPool:
+    """
+    单个主机的 keep-alive 连接池
+    信号量限制对该主机的并发请求数，空闲连接后进先出复用（最近用过的连接最不容易被服务端关闭）
+    """
+
+    def __init__(self, scheme, host, port, maxsize, timeout):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(maxsize)
+        self._idle = []
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def _new_connection(self):
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        self.created += 1
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self, timeout=None):
+        """
+        获取连接，超过并发上限时等待
+        :return: (连接, 是否为复用的空闲连接)
+        """
+        if not self._slots.acquire(timeout=max(0.0, timeout) if timeout is not None else None):
+            raise BackendError(f"等待 {self.host}:{self.port} 的连接超时", status=429)
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._new_connection(), False
+
+    def release(self, conn, reusable=True):
+        if reusable:
+            with self._lock:
+                self._idle.append(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """
+    OpenAI 兼容的 /chat/completions 接口
+    - 每个主机一个 keep-alive 连接池，并发数受 max_connections 限制
+    - 流式读取 SSE，每收到一段文本立即产出
+    - 连接失败、429 与 5xx 在尚未产出任何文本前按指数退避加随机抖动重试，遵守 Retry-After
+    """
+
+    name = "openai"
+
+    def __init__(self, base_url=None, model=None, api_key=None, timeout=None,
+                 max_connections=None, max_retries=None):
+        self.base_url = (base_url or LLM_API_BASE).rstrip("/")
+        self.model = model or LLM_API_MODEL
+        self.api_key = api_key if api_key is not None else LLM_API_KEY
+        self.timeout = timeout or LLM_API_TIMEOUT
+        self.max_connections = max_connections or LLM_API_MAX_CONNECTIONS
+        self.max_retries = LLM_API_MAX_RETRIES if max_retries is None else max_retries
+
+        parts = urlsplit(self.base_url)
+        self.scheme = parts.scheme or "http"
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.scheme == "https" else 80)
+        self.path = f"{parts.path}/chat/completions"
+        self.tokenizer = ApproxTokenizer()
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+
+        self._requests = metrics.counter("llm_http_requests_total", "发往 HTTP 生成后端的请求数")
+        self._retries = metrics.counter("llm_http_retries_total", "HTTP 生成后端请求重试次数")
+        self._errors = metrics.counter("llm_http_errors_total", "HTTP 生成后端最终失败的请求数")
+        self._inflight = metrics.gauge("llm_http_inflight", "进行中的 HTTP 生成请求数")
+        self._ttft_hist = metrics.histogram(
+            "llm_http_ttft_seconds", "HTTP 生成后端首段文本延迟", buckets=TTFT_BUCKETS
+        )
+
+    def pool(self):
+        key = (self.scheme, self.host, self.port)
+        with self._pools_lock:
+            if key not in self._pools:
+                self._pools[key] = HTTPConnectionPool(
+                    self.scheme, self.host, self.port, self.max_connections, self.timeout
+                )
+            return self._pools[key]
+
+    def _headers(self):
+        headers = {"Content-Type": "application/json", "Accept": "text/event-stream", "Connection": "keep-alive"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def _open_stream(self, pool, body, deadline):
+        """发送请求并返回 (连接, 响应)；失败抛出 BackendError"""
+        wait = self.timeout if deadline is None else max(0.0, min(self.timeout, deadline - time.time()))
+        conn, reused = pool.acquire(timeout=wait)
+        try:
+            conn.request("POST", self.path, body=body, headers=self._headers())
+            response = conn.getresponse()
+        except (http.client.HTTPException, OSError) as e:
+            pool.release(conn, reusable=False)
+            # 复用的空闲连接可能已被服务端关闭，换新连接立即重试一次
+            if reused:
+                return self._open_stream(pool, body, deadline)
+            raise BackendError(f"连接生成后端失败: {e}")
+
+        if response.status != 200:
+            detail = response.read()[:200].decode("utf-8", "replace")
+            pool.release(conn, reusable=not response.will_close)
+            retry_after = response.getheader("Retry-After")
+            raise BackendError(
+                f"生成后端返回 {response.status}: {detail}",
+                status=response.status,
+                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+            )
+        return conn, response
+
+    def _backoff(self, attempt, error, deadline):
+        delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+        if error.retry_after is not None:
+            delay = max(delay, error.retry_after)
+        if deadline is not None and time.time() + delay >= deadline:
+            return False
+        time.sleep(delay)
+        return True
+
+    def _stopped(self, deadline, cancel_event):
+        """截止时间已过或已取消时记录原因并返回 True"""
+        if cancel_event is not None and cancel_event.is_set():
+            cancelled_counter.inc()
+            return True
+        if deadline is not None and time.time() >= deadline:
+            deadline_exceeded_counter.inc()
+            return True
+        return False
+
+    def stream_chat(self, system_prompt, user_prompt, max_new_tokens, temperature, top_p,
+                    deadline=None, cancel_event=None):
+        if not isinstance(user_prompt, str):
+            # ApproxTokenizer 的 "token" 是原文片段，拼接即得截断后的文本
+            user_prompt = "".join(user_prompt)
+        body = json.dumps({
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt.strip()},
+            ],
+            "max_tokens": max_new_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "stream": True,
+        }, ensure_ascii=False).encode("utf-8")
+
+        pool = self.pool()
+        started = time.monotonic()
+        self._requests.inc()
+        attempt = 0
+        while True:
+            if self._stopped(deadline, cancel_event):
+                return
+            try:
+                conn, response = self._open_stream(pool, body, deadline)
+                break
+            except BackendError as e:
+                # 等待连接期间到达截止时间：与生成中途超时一样结束，由调用方补充免责声明
+                if self._stopped(deadline, cancel_event):
+                    return
+                if not e.retryable or attempt >= self.max_retries or not self._backoff(attempt, e, deadline):
+                    self._errors.inc()
+                    raise
+                attempt += 1
+                self._retries.inc()
+                logger.warning(f"生成后端请求失败，第 {attempt} 次重试: {e}")
+
+        self._inflight.inc()
+        completed = False
+        first = True
+        try:
+            for piece in self._read_events(conn, response, deadline, cancel_event):
+                if first:
+                    self._ttft_hist.observe(time.monotonic() - started)
+                    first = False
+                yield piece
+            completed = True
+        finally:
+            self._inflight.dec()
+            if conn.sock is not None:
+                conn.sock.settimeout(self.timeout)
+            # 提前停止时响应体没有读完，连接不能复用
+            pool.release(conn, reusable=completed and not response.will_close)
+
+    def _read_events(self, conn, response, deadline, cancel_event):
+        """解析 SSE：data: {...} 逐段取出 delta.content，data: [DONE] 结束"""
+        while True:
+            if self._stopped(deadline, cancel_event):
+                return
+            if deadline is not None and conn.sock is not None:
+                conn.sock.settimeout(min(self.timeout, max(deadline - time.time(), 0.001)))
+            try:
+                line = response.readline()
+            except socket.timeout:
+                if self._stopped(deadline, None):
+                    return
+                raise BackendError("读取生成后端响应超时")
+            if not line:
+                raise BackendError("生成后端提前关闭了连接")
+
+            line = line.decode("utf-8").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                # 读完结束标记后的剩余响应体，保证连接可以复用
+                response.read()
+                return
+            choices = json.loads(data).get("choices") or []
+            if not choices:
+                continue
+            content = (choices[0].get("delta") or {}).get("content")
+            if content:
+                yield content
+
+    def close(self):
+        with self._pools_lock:
+            for pool in self._pools.values():
+                pool.close()
+
+
+class LocalTransformersBackend(LLMBackend):
+    """
+    本进程加载的模型：包装 AdviceGenerator 自身的解码循环（前缀 KV 缓存、start_prompt / step_sequences），
+    user_prompt 为该模型分词器编码的 token ids；同一解码循环也供 GenerationScheduler 连续批处理
+    """
+
+    name = "local"
+    batching = True
+
+    def __init__(self, generator):
+        self.generator = generator
+
+    @property
+    def tokenizer(self):
+        return self.generator.tokenizer
+
+    @property
+    def available(self):
+        return self.generator.model_dir == "mock" or self.generator.model is not None
+
+    def system_tokens(self, system_prompt):
+        # 前缀 ids 含模型要求的起始特殊符号，首次调用时同时计算并缓存前缀 KV
+        return len(self.generator.get_prefix_state(system_prompt).ids)
+
+    def stream_chat(self, system_prompt, user_prompt, max_new_tokens, temperature, top_p,
+                    deadline=None, cancel_event=None):
+        seq = self.generator.start_prompt(
+            system_prompt, user_prompt, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p,
+            deadline=deadline, cancel_event=cancel_event
+        )
+        while True:
+            piece = seq.drain()
+            if piece:
+                yield piece
+            if seq.done:
+                break
+            self.generator.step_sequences([seq])
+
+
+def create_backend(name, generator=None):
+    """按名称创建后端；local 包装 generator 在本进程加载的模型"""
+    name = (name or "local").lower()
+    if name == "local":
+        if generator is None:
+            raise ValueError("local 后端需要传入 AdviceGenerator")
+        return LocalTransformersBackend(generator)
+    if name == "openai":
+        return OpenAICompatibleBackend()
+    raise ValueError(f"未知的生成后端: {name}")
@@ -0,0 +1,148 @@
+# -------------------------- OpenAI 兼容接口桩服务 --------------------------
+# 用于在没有 GPU / 推理服务的环境中测试 HTTP 生成后端：
+#   python llm_stub_server.py --port 8001 [--token-delay 0.02] [--fail-rate 0.3]
+#   LLM_BACKEND=openai LLM_API_BASE=http://127.0.0.1:8001/v1 python APP.py
+# 支持 HTTP/1.1 keep-alive 与分块传输的 SSE 流式响应，可按比例注入 503 以测试重试
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_REPLY = "感谢你愿意说出这些感受。考前紧张是很常见的反应，可以试着把复习任务拆小，每天留出固定的放松时间。本建议仅供参考，不能替代专业医疗诊断。"
+STUB_CHUNK = 4
+
+
+class StubState:
+    """桩服务的运行参数与统计，供测试脚本检查连接复用与并发"""
+
+    def __init__(self, token_delay=0.0, fail_rate=0.0):
+        self.token_delay = token_delay
+        self.fail_rate = fail_rate
+        self.requests = 0
+        self.failures = 0
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def setup(self):
+        super().setup()
+        with self.state.lock:
+            self.state.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        state = self.state
+        with state.lock:
+            state.requests += 1
+            fail = random.random() < state.fail_rate
+            if fail:
+                state.failures += 1
+        if fail:
+            self._send_json(503, {"error": {"message": "stub overloaded"}}, headers={"Retry-After": "0"})
+            return
+
+        with state.lock:
+            state.active += 1
+            state.max_active = max(state.max_active, state.active)
+        try:
+            max_chars = payload.get("max_tokens") or len(STUB_REPLY)
+            reply = STUB_REPLY[:max_chars]
+            pieces = [reply[i:i + STUB_CHUNK] for i in range(0, len(reply), STUB_CHUNK)]
+            if payload.get("stream"):
+                self._stream(payload, pieces)
+            else:
+                time.sleep(state.token_delay * len(pieces))
+                self._send_json(200, {
+                    "object": "chat.completion",
+                    "model": payload.get("model", "stub"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                })
+        finally:
+            with state.lock:
+                state.active -= 1
+
+    def _stream(self, payload, pieces):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for piece in pieces:
+                time.sleep(self.state.token_delay)
+                event = {
+                    "object": "chat.completion.chunk",
+                    "model": payload.get("model", "stub"),
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                }
+                self._write_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端取消了请求
+            self.close_connection = True
+
+
+def start_stub_server(host="127.0.0.1", port=0, token_delay=0.0, fail_rate=0.0):
+    """在后台线程启动桩服务，返回 (server, state)；port=0 时自动分配端口"""
+    state = StubState(token_delay, fail_rate)
+    handler = type("BoundStubHandler", (StubHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 兼容接口桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--token-delay", type=float, default=0.02, help="每段文本之间的延迟（秒）")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="返回 503 的请求比例")
+    args = parser.parse_args()
+
+    server, _ = start_stub_server(args.host, args.port, args.token_delay, args.fail_rate)
+    print(f"桩服务已启动: http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# -------------------------- 微批调度模块 --------------------------
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+QUEUE_WAIT_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class MicroBatcher:
+    """
+    跨请求微批调度器
+    多个请求线程提交的单条输入在一个很短的时间窗口内汇聚成一批，
+    由后台线程统一调用 batch_fn 执行一次批量推理，再通过 Future 把结果分发给各自的调用方
+    """
+
+    def __init__(self, batch_fn, window_ms=5.0, max_batch_size=32, name="micro_batcher"):
+        """
+        :param batch_fn: 批处理函数，输入列表，返回等长的结果列表
+        :param window_ms: 收集窗口（毫秒），从一批中第一条请求到达开始计时
+        :param max_batch_size: 单批最大条数，达到后立即执行，不再等待窗口结束
+        :param name: 名称，用于线程名与指标前缀
+        """
+        self.batch_fn = batch_fn
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self.name = name
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+
+        self._batch_size_hist = metrics.histogram(
+            f"{name}_batch_size", "每次批量推理的条数", buckets=BATCH_SIZE_BUCKETS
+        )
+        self._queue_wait_hist = metrics.histogram(
+            f"{name}_queue_wait_seconds", "请求从提交到开始推理的等待时间", buckets=QUEUE_WAIT_BUCKETS
+        )
+
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item):
+        """提交单条输入，返回 Future"""
+        future = Future()
+        if self._stopped.is_set():
+            future.set_exception(RuntimeError(f"{self.name} 已停止"))
+            return future
+        self._queue.put((item, future, time.monotonic()))
+        return future
+
+    def __call__(self, item, timeout=None):
+        """同步调用：提交并等待结果"""
+        return self.submit(item).result(timeout=timeout)
+
+    def stop(self):
+        self._stopped.set()
+        self._queue.put(None)
+
+    def _collect(self, first):
+        """以第一条请求为起点，在窗口期内尽量多地收集请求"""
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            first = self._queue.get()
+            if first is None:
+                break
+
+            batch = self._collect(first)
+            started = time.monotonic()
+            for _, _, enqueued in batch:
+                self._queue_wait_hist.observe(started - enqueued)
+            self._batch_size_hist.observe(len(batch))
+
+            items = [item for item, _, _ in batch]
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"批处理结果数量不匹配: 期望 {len(items)}，实际 {len(results)}")
+            except Exception as e:
+                logger.error(f"{self.name} 批量推理失败: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+        # 停止后把残留请求全部失败掉，避免调用方永久阻塞
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not None:
+                entry[1].set_exception(RuntimeError(f"{self.name} 已停止"))
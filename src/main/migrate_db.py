@@ -9,7 +9,9 @@ def migrate():
     sqls = [
         "ALTER TABLE scl90_record ADD COLUMN average_score FLOAT DEFAULT 0",
         "ALTER TABLE scl90_record ADD COLUMN positive_items_count INT DEFAULT 0",
-        "ALTER TABLE scl90_record ADD COLUMN answers JSON COMMENT '原始答案'"
+        "ALTER TABLE scl90_record ADD COLUMN answers JSON COMMENT '原始答案'",
+        "ALTER TABLE knowledge_base ADD COLUMN vector_id VARCHAR(64) COMMENT '向量库文档 ID（分块的 parent_id）'",
+        "ALTER TABLE knowledge_base ADD INDEX idx_vector_id (vector_id)"
     ]
     
     for sql in sqls:
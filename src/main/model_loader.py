@@ -1,43 +1,112 @@
 import logging
 from config import (
-    CHINESE_MENTALBERT_DIR, CHATGLM_6B_INT4_DIR, 
-    EMOTION_LABEL_MAP, RISK_LABEL_MAP, 
-    DEVICE, BERT_MAX_LEN, LLM_MAX_LEN, MAX_NEW_TOKENS,
+    CHINESE_MENTALBERT_DIR, CHATGLM_6B_INT4_DIR,
+    EMOTION_LABEL_MAP, RISK_LABEL_MAP,
+    DEVICE, BERT_MAX_LEN, LLM_MAX_LEN, MAX_NEW_TOKENS, EMOTION_BATCH_SIZE,
+    EMOTION_BATCH_WINDOW_MS, EMOTION_MAX_BATCH_SIZE,
+    EMOTION_LONG_TEXT_STRATEGY, EMOTION_WINDOW_OVERLAP,
+    EMOTION_CACHE_SIZE, EMOTION_CACHE_TTL, EMOTION_CACHE_PATH,
+    EMOTION_BACKEND, EMOTION_ONNX_DIR, EMOTION_ONNX_QUANTIZE, EMOTION_ONNX_MIN_AGREEMENT,
+    LLM_SCHEDULER, LLM_MAX_BATCH_SIZE, INFERENCE_MODE,
     ENABLE_LLM, ENABLE_EMOTION_ANALYSIS
 )
 from emotion_classifier import EmotionClassifier
 from advice_generator import AdviceGenerator
+from micro_batcher import MicroBatcher
+from generation_scheduler import GenerationScheduler
+from inference_worker import InferenceClient, RemoteEmotionClassifier, RemoteAdviceGenerator
+from utils.readiness import readiness, LOADING, WARMING, READY, FAILED, DISABLED
 
 logger = logging.getLogger(__name__)
 
+WARMUP_TEXTS = ["最近学习压力有点大，晚上睡得不太好。", "今天和朋友出去玩，心情不错。"]
+
 class ModelLoader:
     def __init__(self):
         self.emotion_classifier = None
+        self.emotion_batcher = None
         self.advice_generator = None
+        self.generation_scheduler = None
+        self.inference_client = None
+        readiness.register("emotion")
+        readiness.register("llm")
+
+    def _connect_inference_worker(self):
+        """remote 模式：不在本进程加载模型，改为连接独立推理进程"""
+        try:
+            self.inference_client = InferenceClient()
+        except ValueError as e:
+            logger.error(f"❌ 推理通道配置无效: {e}")
+            readiness.set("emotion", FAILED, detail=str(e))
+            readiness.set("llm", FAILED, detail=str(e))
+            return
+        emotion_ready, llm_ready = True, True
+        try:
+            status = self.inference_client.call("ping", timeout=10)
+            emotion_ready, llm_ready = status["emotion"], status["llm"]
+            print(f"✅ 已连接推理进程 {self.inference_client.address} (pid={status['pid']})")
+        except Exception as e:
+            # 推理进程可能稍后才启动，首次调用时会自动重连
+            logger.warning(f"⚠️ 暂时无法连接推理进程 {self.inference_client.address}: {e}")
+
+        self.emotion_classifier = RemoteEmotionClassifier(self.inference_client) if emotion_ready else None
+        self.advice_generator = RemoteAdviceGenerator(self.inference_client) if llm_ready else None
+        readiness.set("emotion", READY if emotion_ready else FAILED, detail="推理进程")
+        readiness.set("llm", READY if llm_ready else FAILED, detail="推理进程")
+
+    def load_models(self, mode=None):
+        """
+        :param mode: local 在本进程加载模型；remote 使用独立推理进程。默认读取 INFERENCE_MODE
+        """
+        if (mode or INFERENCE_MODE).lower() == "remote":
+            self._connect_inference_worker()
+            return
 
-    def load_models(self):
         print(f"当前运行设备：{DEVICE}")
         print("开始加载模型与分词器...")
-        
+
         # 初始化情感分类器
         if ENABLE_EMOTION_ANALYSIS:
+            readiness.set("emotion", LOADING, detail="正在加载情感分类模型")
             try:
                 self.emotion_classifier = EmotionClassifier(
                     model_dir=CHINESE_MENTALBERT_DIR,
                     emotion_label_map=EMOTION_LABEL_MAP,
                     risk_label_map=RISK_LABEL_MAP,
                     device=DEVICE,
-                    max_seq_length=BERT_MAX_LEN
+                    max_seq_length=BERT_MAX_LEN,
+                    batch_size=EMOTION_BATCH_SIZE,
+                    long_text_strategy=EMOTION_LONG_TEXT_STRATEGY,
+                    window_overlap=EMOTION_WINDOW_OVERLAP,
+                    cache_size=EMOTION_CACHE_SIZE,
+                    cache_ttl=EMOTION_CACHE_TTL,
+                    cache_path=EMOTION_CACHE_PATH,
+                    backend=EMOTION_BACKEND,
+                    onnx_dir=EMOTION_ONNX_DIR,
+                    onnx_quantize=EMOTION_ONNX_QUANTIZE,
+                    onnx_min_agreement=EMOTION_ONNX_MIN_AGREEMENT
                 )
+                # 并发请求在微批窗口内合并为一次前向
+                if EMOTION_BATCH_WINDOW_MS > 0:
+                    self.emotion_batcher = MicroBatcher(
+                        self.emotion_classifier.discriminate_batch,
+                        window_ms=EMOTION_BATCH_WINDOW_MS,
+                        max_batch_size=EMOTION_MAX_BATCH_SIZE,
+                        name="emotion_batcher"
+                    )
+                readiness.set("emotion", READY)
             except Exception as e:
                 logger.error(f"⚠️ 情感分类器加载失败: {e}")
                 self.emotion_classifier = None
+                readiness.set("emotion", FAILED, error=str(e))
         else:
             print("⚠️ 情感分析已禁用 (ENABLE_EMOTION_ANALYSIS=False)")
             self.emotion_classifier = None
-        
+            readiness.set("emotion", DISABLED)
+
         # 初始化建议生成器
         if ENABLE_LLM:
+            readiness.set("llm", LOADING, detail="正在加载对话大模型")
             try:
                 self.advice_generator = AdviceGenerator(
                     model_dir=CHATGLM_6B_INT4_DIR,
@@ -56,7 +125,65 @@ class ModelLoader:
              # 使用 mock 模式初始化
              self.advice_generator = AdviceGenerator(model_dir='mock')
 
+        # 所有请求线程经由调度器共享同一个解码循环（远程生成后端由推理服务自行批处理）
+        if self.advice_generator is not None and self.advice_generator.backend.batching and LLM_SCHEDULER:
+            self.generation_scheduler = GenerationScheduler(
+                self.advice_generator,
+                max_batch_size=LLM_MAX_BATCH_SIZE
+            )
+
+        generator = self.advice_generator
+        if generator is None or not generator.backend.available:
+            # 生成器加载失败时降级为维护提示
+            readiness.set("llm", FAILED, error="建议生成模型加载失败")
+        else:
+            readiness.set("llm", READY if ENABLE_LLM else DISABLED)
+
         print("✅ 模型加载完成")
 
+    def warm_up(self):
+        """
+        预热：各跑一次情感分类与生成（含前缀 KV 计算），填充内存分配器与算子缓存，
+        避免第一个真实请求承担这部分延迟；预热失败不影响就绪
+        """
+        if self.inference_client is not None:
+            return
+
+        if readiness.state("emotion") == READY:
+            readiness.set("emotion", WARMING, detail="情感分类预热")
+            try:
+                self.emotion_classifier.discriminate_batch(WARMUP_TEXTS)
+            except Exception as e:
+                logger.warning(f"情感分类预热失败: {e}")
+            readiness.set("emotion", READY)
+
+        if readiness.state("llm") == READY:
+            readiness.set("llm", WARMING, detail="对话大模型预热")
+            try:
+                self.advice_generator.warm_up()
+            except Exception as e:
+                logger.warning(f"对话大模型预热失败: {e}")
+            readiness.set("llm", READY)
+
+    def discriminate(self, user_text):
+        """情感判别入口：启用微批时经由调度器合并推理，否则直接调用分类器"""
+        if self.emotion_classifier is None:
+            raise RuntimeError("情感分类器未加载")
+        if self.emotion_batcher is not None:
+            return self.emotion_batcher(user_text)
+        return self.emotion_classifier.discriminate(user_text)
+
+    def generate_advice(self, **generation_args):
+        """建议生成入口：启用调度器时进入连续批处理队列，否则直接调用生成器"""
+        if self.generation_scheduler is not None:
+            return self.generation_scheduler.generate(**generation_args)
+        return self.advice_generator.generate(**generation_args)
+
+    def stream_advice(self, **generation_args):
+        """流式建议生成入口"""
+        if self.generation_scheduler is not None:
+            return self.generation_scheduler.stream(**generation_args)
+        return self.advice_generator.generate_stream(**generation_args)
+
 # Global instance
 model_loader = ModelLoader()
@@ -0,0 +1,213 @@
+# -------------------------- 提示词组装模块 --------------------------
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 模板中的固定片段，token 数只计算一次
+HISTORY_HEADER = "\n【历史对话记录】\n"
+HISTORY_FOOTER = "\n（请基于以上历史对话，保持对话的连贯性和上下文理解）\n"
+PROFILE_HEADER = "\n【来访者档案】\n主诉问题："
+EMOTION_LABEL = "\n情感状态："
+RISK_LABEL = "\n风险等级："
+SCL90_LABEL = "\n心理测评参考："
+RAG_HEADER = "\n【专业知识参考】\n"
+NEWLINE = "\n"
+# 分词时加在每段前面的哨兵：sentencepiece 只在整段文本开头加 "▁" 哑前缀，
+# 带哨兵分词后去掉哨兵的 ids，得到的就是该片段出现在 Prompt 中间时的 ids
+SENTINEL = "\n"
+ELLIPSIS = "..."
+CLOSING = "\n\n请按照【咨询回应指南】回应这位来访者："
+
+
+class AssembledPrompt:
+    """
+    组装结果：后缀 token ids 及各片段的 token 使用情况
+    trimmed 记录因总预算不足被截断的片段，capped 记录按自身上限（如 rag_max_tokens）截取的片段
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.usage = {}
+        self.trimmed = []
+        self.capped = []
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class PromptAssembler:
+    """
+    按 token 预算组装提示词的动态部分
+    每个动态片段只分词一次（一次批量调用），固定模板片段的 token 缓存复用；
+    按优先级 档案 > 用户主诉 > 近期历史 > 按相关度排序的知识 依次填充预算，
+    低优先级片段在 token 边界处截断，输出直接是 token ids，不再重新分词
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self._static_ids = {}
+        self._lock = threading.Lock()
+        self._sentinel_ids = self._raw_encode([SENTINEL])[0]
+
+    def _raw_encode(self, texts):
+        return self.tokenizer(list(texts), add_special_tokens=False)["input_ids"]
+
+    def _encode_many(self, texts):
+        """
+        批量分词，每段都按出现在 Prompt 中间处理（后缀总是接在静态前缀之后）
+        逐段分词时 sentencepiece 会给每段加一个 "▁" 哑前缀，拼接后与整段分词的结果不同，
+        所以每段前面加哨兵一起分词，再去掉哨兵的 ids；哨兵与正文发生合并时退回直接分词
+        """
+        if not texts:
+            return []
+        sentinel = self._sentinel_ids
+        if not sentinel:
+            return self._raw_encode(texts)
+        encoded = self._raw_encode([SENTINEL + text for text in texts])
+        result = []
+        for text, ids in zip(texts, encoded):
+            if ids[:len(sentinel)] == sentinel:
+                result.append(ids[len(sentinel):])
+            else:
+                result.append(self._raw_encode([text])[0])
+        return result
+
+    def encode(self, text):
+        """单段文本的 token ids（按出现在 Prompt 中间处理）"""
+        return self._encode_many([text])[0]
+
+    def lengths(self, texts):
+        """多段文本各自的 token 数（按出现在 Prompt 中间处理），一次批量分词"""
+        return [len(ids) for ids in self._encode_many(list(texts))]
+
+    def static(self, text):
+        """固定模板片段的 token ids（缓存）"""
+        ids = self._static_ids.get(text)
+        if ids is None:
+            with self._lock:
+                ids = self._static_ids.get(text)
+                if ids is None:
+                    ids = self._encode_many([text])[0]
+                    self._static_ids[text] = ids
+        return ids
+
+    def assemble(self, budget, user_text, emotion, risk, scl90_summary=None, history=None, rag_docs=None,
+                 rag_max_tokens=None):
+        """
+        :param budget: 动态部分可用的 token 数
+        :param history: 历史对话轮次（旧 -> 新），每项为一轮的完整文本
+        :param rag_docs: 检索到的知识（相关度高 -> 低）
+        :param rag_max_tokens: 知识部分（含标题）的 token 上限，为空时只受总预算限制
+        :return: AssembledPrompt
+        """
+        history = [h for h in (history or []) if h]
+        rag_docs = [d for d in (rag_docs or []) if d]
+
+        # 一次批量分词：用户主诉、情绪、风险、测评摘要、历史各轮、各条知识
+        dynamic = [user_text, emotion or "", risk or "", scl90_summary or ""] + history + rag_docs
+        encoded = self._encode_many(dynamic)
+        user_ids, emotion_ids, risk_ids, scl90_ids = encoded[:4]
+        history_ids = encoded[4:4 + len(history)]
+        rag_ids = encoded[4 + len(history):]
+
+        result = AssembledPrompt()
+        remaining = budget
+
+        def take(ids, limit, keep="head"):
+            """在 token 边界处截取不超过 limit 个 token"""
+            if len(ids) <= limit:
+                return ids
+            if limit <= 0:
+                return []
+            return ids[:limit] if keep == "head" else ids[len(ids) - limit:]
+
+        # 1. 与前缀之间的换行、固定模板与档案（情绪、风险）必须保留
+        separator = self.static(NEWLINE)
+        remaining -= len(separator)
+        profile = (
+            self.static(PROFILE_HEADER), self.static(EMOTION_LABEL) + emotion_ids,
+            self.static(RISK_LABEL) + risk_ids, self.static(CLOSING)
+        )
+        remaining -= sum(len(part) for part in profile)
+
+        # 测评摘要属于档案，但可以截断
+        scl90_part = []
+        if scl90_ids:
+            label = self.static(SCL90_LABEL)
+            kept = take(scl90_ids, remaining - len(label))
+            if kept:
+                scl90_part = label + kept
+                remaining -= len(scl90_part)
+            if len(kept) < len(scl90_ids):
+                result.trimmed.append("scl90_summary")
+
+        # 2. 用户主诉：超出时保留开头并加省略号
+        ellipsis = self.static(ELLIPSIS)
+        user_part = user_ids
+        if len(user_ids) > remaining:
+            user_part = take(user_ids, remaining - len(ellipsis)) + ellipsis
+            result.trimmed.append("user_text")
+        remaining -= len(user_part)
+
+        # 3. 历史对话：从最近一轮往前取，最早被取到的一轮只保留结尾
+        history_parts = []
+        if history_ids:
+            header, footer, newline = self.static(HISTORY_HEADER), self.static(HISTORY_FOOTER), self.static(NEWLINE)
+            room = remaining - len(header) - len(footer)
+            for ids in reversed(history_ids):
+                cost = len(ids) + (len(newline) if history_parts else 0)
+                if cost <= room:
+                    history_parts.insert(0, ids)
+                    room -= cost
+                    continue
+                kept = take(ids, room - len(newline) - len(ellipsis), keep="tail")
+                if kept:
+                    history_parts.insert(0, ellipsis + kept)
+                result.trimmed.append("history")
+                break
+            if history_parts:
+                joined = []
+                for idx, ids in enumerate(history_parts):
+                    joined += (newline if idx else []) + ids
+                history_parts = header + joined + footer
+                remaining -= len(history_parts)
+
+        # 4. 知识：按相关度依次加入，最后一条放不下时在 token 边界截断
+        rag_part = []
+        if rag_ids:
+            header, newline = self.static(RAG_HEADER), self.static(NEWLINE)
+            capped = rag_max_tokens is not None and rag_max_tokens < remaining
+            room = (rag_max_tokens if capped else remaining) - len(header)
+            kept_docs = []
+            for ids in rag_ids:
+                cost = len(ids) + (len(newline) if kept_docs else 0)
+                if cost <= room:
+                    kept_docs.append(ids)
+                    room -= cost
+                    continue
+                kept = take(ids, room - (len(newline) if kept_docs else 0))
+                if kept:
+                    kept_docs.append(kept)
+                (result.capped if capped else result.trimmed).append("rag_context")
+                break
+            if kept_docs:
+                joined = []
+                for idx, ids in enumerate(kept_docs):
+                    joined += (newline if idx else []) + ids
+                rag_part = header + joined
+                remaining -= len(rag_part)
+
+        header, emotion_part, risk_part, closing = profile
+        result.ids = separator + history_parts + header + user_part + emotion_part + risk_part + scl90_part + rag_part + closing
+        result.usage = {
+            "history": len(history_parts),
+            "user_text": len(user_part),
+            "profile": len(header) + len(emotion_part) + len(risk_part) + len(scl90_part),
+            "rag_context": len(rag_part),
+            "rag_candidates": sum(len(ids) for ids in rag_ids),
+            "template": len(separator) + len(closing),
+            "total": len(result.ids),
+            "budget": budget,
+        }
+        return result
@@ -1,8 +1,26 @@
 import os
 import json
+import time
+import hashlib
 import logging
+import threading
+import uuid as uuid_lib
+from collections import defaultdict
 from datetime import datetime
-from config import CHROMA_DB_DIR, EMBEDDING_MODEL_NAME, ENABLE_RAG
+from config import (
+    CHROMA_DB_DIR, EMBEDDING_MODEL_NAME, ENABLE_RAG,
+    RAG_EMBEDDING_CACHE_SIZE, RAG_RESULT_CACHE_SIZE, RAG_RESULT_CACHE_TTL,
+    RAG_EMBED_BATCH_SIZE, RAG_WRITE_CHUNK_SIZE, RAG_CHUNK_TOKENS, RAG_CHUNK_OVERLAP,
+    RAG_HYBRID, RAG_LEXICAL_ONLY_MAX_CHARS, RAG_LEXICAL_MIN_SCORE_RATIO, RAG_RRF_K, RAG_SCORE_THRESHOLD, RAG_MMR_LAMBDA,
+    RAG_CONTEXT_MAX_TOKENS, RAG_COMPRESSION, LLM_BACKEND, CHATGLM_6B_INT4_DIR
+)
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from utils.cache import LRUCache, normalize_text
+from prompt_assembler import PromptAssembler
+from utils.chunking import TextChunker, ApproxTokenizer, split_sentences, join_sentences
+from utils.metrics import metrics
+from utils.readiness import readiness, LOADING, READY, FAILED, DISABLED
+from utils.rerank import cosine_scores, mmr, select_within_budget
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -19,107 +37,750 @@ except ImportError as e:
     Chroma = None
     HuggingFaceEmbeddings = None
 
+try:
+    from transformers import AutoTokenizer
+except ImportError:
+    AutoTokenizer = None
+
+# 查询向量化（BERT 前向）与向量检索（ANN）的耗时分布
+RAG_TIMING_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def content_hash(content):
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def knowledge_doc_id(namespace, title, content):
+    """由命名空间、标题与内容确定的向量库 ID，重复导入时覆盖而不是新增"""
+    return content_hash(f"{namespace}\0{title}\0{content}")
+
+
+SCL90_REPORT_TITLE = "SCL-90测评报告"
+SENTENCE_COLLECTION = "yibinu_knowledge_sentences"
+
+
+def scl90_doc_id(uuid):
+    """每个用户只有一份 SCL-90 摘要，ID 只由 uuid 决定，新结果覆盖旧结果"""
+    return f"scl90-{content_hash(uuid)}"
+
+
 class RAGService:
     def __init__(self, persist_directory=CHROMA_DB_DIR):
         self.persist_directory = persist_directory
         self.embedding_model = None
         self.vector_store = None
-        
-        if ENABLE_RAG and Chroma and HuggingFaceEmbeddings:
+        # 句子级集合：写入时为多句的块预先计算句向量，检索时按句压缩只需点积
+        self.sentence_store = None
+        self._embed_hist = metrics.histogram(
+            "rag_embed_seconds", "检索时查询向量化耗时", buckets=RAG_TIMING_BUCKETS
+        )
+        self._query_hist = metrics.histogram(
+            "rag_query_seconds", "检索时向量库查询耗时（公共+个人）", buckets=RAG_TIMING_BUCKETS
+        )
+        self._compress_hist = metrics.histogram(
+            "rag_compress_seconds", "检索结果按句压缩耗时", buckets=RAG_TIMING_BUCKETS
+        )
+
+        # 两级缓存：查询文本 → 向量（与知识库内容无关，只按容量淘汰）；
+        # (uuid, 查询, k) → 检索结果，短期有效，写入时按命名空间失效
+        self.embedding_cache = LRUCache(maxsize=RAG_EMBEDDING_CACHE_SIZE, name="rag_embedding_cache")
+        # 知识句子 → 向量：写入时已在句子集合中存好句向量，只有此前写入的旧块在检索时补算并缓存
+        self.sentence_cache = LRUCache(maxsize=RAG_EMBEDDING_CACHE_SIZE, name="rag_sentence_cache")
+        self.result_cache = LRUCache(maxsize=RAG_RESULT_CACHE_SIZE, ttl=RAG_RESULT_CACHE_TTL, name="rag_result_cache")
+        # 每个命名空间（"public" 或用户 uuid）的写入代数，计入结果缓存键；
+        # 写入后代数加一，旧键不再被命中，只影响该用户（公共写入影响所有用户）
+        self._generations = defaultdict(int)
+        self._generation_lock = threading.Lock()
+        self.chunker = TextChunker(RAG_CHUNK_TOKENS, RAG_CHUNK_OVERLAP)
+        # 词法倒排索引：首次检索（或启动时）从 knowledge_base 构建，之后随写入增量更新
+        self.lexical_index = LexicalIndex()
+        self._lexical_build_lock = threading.Lock()
+        self._lexical_fast_path = metrics.counter(
+            "rag_lexical_fast_path_total", "短查询仅走词法检索、跳过向量化的次数"
+        )
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        # 上下文预算按 LLM 的 token 计（与 PromptAssembler 的 rag_max_tokens 同一单位），首次压缩时加载分词器
+        self._context_assembler = None
+        self._context_lock = threading.Lock()
+        readiness.register("rag")
+
+    def initialize(self):
+        """
+        加载向量模型并打开 ChromaDB（可能需要下载模型，耗时较长）
+        不在导入时执行：快速启动时由后台初始化线程调用，命令行脚本在使用前调用；重复调用直接返回
+        """
+        with self._init_lock:
+            if self._initialized:
+                return self.vector_store is not None
+            self._initialized = True
+            if not ENABLE_RAG:
+                logger.info("⚠️ RAG服务已禁用 (ENABLE_RAG=False)")
+                readiness.set("rag", DISABLED)
+                return False
+            if not (Chroma and HuggingFaceEmbeddings):
+                logger.warning("⚠️ 依赖缺失 (LangChain/ChromaDB)，RAG服务不可用")
+                readiness.set("rag", FAILED, error="依赖缺失 (LangChain/ChromaDB)")
+                return False
+
+            readiness.set("rag", LOADING, detail="正在加载向量模型")
             try:
                 # 初始化 Embedding 模型
                 logger.info(f"Loading embedding model: {EMBEDDING_MODEL_NAME}...")
                 self.embedding_model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
-                
+
                 # 初始化 ChromaDB
                 self.vector_store = Chroma(
                     persist_directory=self.persist_directory,
                     embedding_function=self.embedding_model,
                     collection_name="yibinu_knowledge"
                 )
+                self.sentence_store = self.vector_store._client.get_or_create_collection(SENTENCE_COLLECTION)
+                self.chunker = self._build_chunker()
                 logger.info("✅ RAG服务初始化成功")
+                readiness.set("rag", READY)
             except Exception as e:
                 logger.error(f"❌ RAG服务初始化失败: {e}")
+                self.embedding_model = None
                 self.vector_store = None
-        else:
-            if not ENABLE_RAG:
-                logger.info("⚠️ RAG服务已禁用 (ENABLE_RAG=False)")
-            else:
-                logger.warning("⚠️ 依赖缺失 (LangChain/ChromaDB)，RAG服务不可用")
-            self.vector_store = None
-    
+                self.sentence_store = None
+                readiness.set("rag", FAILED, error=str(e))
+            return self.vector_store is not None
+
+    def _build_chunker(self):
+        """用向量模型自己的分词器计长度，块长不超过模型最大序列长度（去掉 [CLS]/[SEP]）"""
+        client = getattr(self.embedding_model, "client", None)
+        tokenizer = getattr(client, "tokenizer", None)
+        max_seq_length = getattr(client, "max_seq_length", None)
+        max_tokens = min(RAG_CHUNK_TOKENS, max_seq_length - 2) if max_seq_length else RAG_CHUNK_TOKENS
+        length_fn = (lambda text: len(tokenizer.tokenize(text))) if tokenizer is not None else None
+        return TextChunker(max_tokens, RAG_CHUNK_OVERLAP, length_fn=length_fn)
+
+    def _chunk_records(self, namespace, k_type, title, content, timestamp, parent_id=None):
+        """
+        把一条知识切成若干块，返回 (ids, texts, metadatas)
+        块 ID 为 "<parent_id>-<序号>"，parent_id 默认由命名空间、标题与内容确定
+        """
+        parent_id = parent_id or knowledge_doc_id(namespace, title, content)
+        chunks = self.chunker.split(content) or [content]
+        ids = [f"{parent_id}-{i}" for i in range(len(chunks))]
+        metadatas = [
+            {
+                "uuid": namespace,
+                "type": k_type,
+                "title": title,
+                "timestamp": timestamp,
+                "parent_id": parent_id,
+                "chunk_index": i,
+                "chunk_count": len(chunks)
+            }
+            for i in range(len(chunks))
+        ]
+        return ids, chunks, metadatas
+
+    def _write_sentences(self, ids, chunks, metadatas, embed_batch_size=RAG_EMBED_BATCH_SIZE):
+        """
+        为多句的块预先计算句向量并写入句子集合（只有一句的块检索时直接复用块向量）
+        句向量只用于压缩，写入失败不影响知识本身，检索时回退为现场向量化
+        """
+        if self.sentence_store is None:
+            return 0
+        sentence_ids, sentences, sentence_metadatas = [], [], []
+        for chunk_id, chunk, metadata in zip(ids, chunks, metadatas):
+            parts = split_sentences(chunk)
+            if len(parts) < 2:
+                continue
+            for i, part in enumerate(parts):
+                sentence_ids.append(f"{chunk_id}-s{i}")
+                sentences.append(part)
+                sentence_metadatas.append({
+                    "chunk_id": chunk_id,
+                    "parent_id": metadata["parent_id"],
+                    "uuid": metadata["uuid"],
+                    "sentence_index": i
+                })
+        if not sentence_ids:
+            return 0
+        try:
+            embeddings = []
+            for i in range(0, len(sentences), embed_batch_size):
+                embeddings.extend(self.embedding_model.embed_documents(sentences[i:i + embed_batch_size]))
+            for i in range(0, len(sentence_ids), RAG_WRITE_CHUNK_SIZE):
+                self.sentence_store.upsert(
+                    ids=sentence_ids[i:i + RAG_WRITE_CHUNK_SIZE],
+                    embeddings=embeddings[i:i + RAG_WRITE_CHUNK_SIZE],
+                    documents=sentences[i:i + RAG_WRITE_CHUNK_SIZE],
+                    metadatas=sentence_metadatas[i:i + RAG_WRITE_CHUNK_SIZE]
+                )
+        except Exception as e:
+            logger.warning(f"写入句向量失败，检索压缩时将现场计算: {e}")
+            return 0
+        return len(sentence_ids)
+
+    def _delete_sentences(self, where):
+        """删除句子集合中的句向量，where 按 parent_id 或 chunk_id 过滤"""
+        if self.sentence_store is None:
+            return
+        try:
+            self.sentence_store.delete(where=where)
+        except Exception as e:
+            logger.warning(f"删除句向量失败: {e}")
+
+    def _stored_sentences(self, chunk_ids):
+        """取写入时存好的句子与句向量，返回 {块 ID: [(句子, 向量)]}，按句序排列"""
+        if self.sentence_store is None or not chunk_ids:
+            return {}
+        try:
+            result = self.sentence_store.get(
+                where={"chunk_id": {"$in": list(chunk_ids)}}, include=["documents", "metadatas", "embeddings"]
+            )
+        except Exception as e:
+            logger.warning(f"读取句向量失败，改为现场计算: {e}")
+            return {}
+        grouped = defaultdict(list)
+        for sentence, metadata, vector in zip(result["documents"], result["metadatas"], result["embeddings"]):
+            grouped[metadata["chunk_id"]].append((metadata["sentence_index"], sentence, vector))
+        return {
+            chunk_id: [(sentence, vector) for _, sentence, vector in sorted(items, key=lambda item: item[0])]
+            for chunk_id, items in grouped.items()
+        }
+
     def add_knowledge(self, uuid, title, content, k_type="private"):
-        """添加知识库内容"""
+        """
+        添加知识库内容：长文本按句切块，每块单独向量化，检索时只返回命中的块
+        parent_id 每次随机生成：同一用户重复保存相同内容时各条记录有各自的向量，删除一条不影响另一条
+        （内容哈希只用于批量导入，重复导入同一批数据时覆盖而不是新增）
+        :return: 向量库文档 ID（各块的 parent_id），写入 knowledge_base.vector_id；失败时返回 None
+        """
         if self.vector_store is None:
-            return False
+            return None
             
-        metadata = {
-            "uuid": uuid if k_type == "private" else "public",
-            "type": k_type,
-            "title": title,
-            "timestamp": datetime.now().isoformat()
-        }
+        namespace = uuid if k_type == "private" else "public"
         
         try:
-            doc = Document(page_content=content, metadata=metadata)
-            self.vector_store.add_documents([doc])
+            ids, chunks, metadatas = self._chunk_records(
+                namespace, k_type, title, content, datetime.now().isoformat(), parent_id=uuid_lib.uuid4().hex
+            )
+            self.vector_store.add_texts(chunks, metadatas=metadatas, ids=ids)
             # self.vector_store.persist() # 新版 ChromaDB 通常会自动持久化
-            return True
+            self._write_sentences(ids, chunks, metadatas)
+            self.lexical_index.add(ids, chunks, metadatas)
+            self.invalidate(namespace)
+            return metadatas[0]["parent_id"]
         except Exception as e:
             logger.error(f"添加知识失败: {e}")
+            return None
+
+    def delete_knowledge(self, namespace, parent_id, title=None, shared=False, legacy=False):
+        """
+        删除一条知识在向量库与词法索引中的文档
+        分块之前写入的旧文档是随机 ID、没有 parent_id 元数据，按 parent_id 删不到；
+        内容推算的 ID 又与批量导入的 parent_id 相同，所以两类文档分开处理：
+        - 记录本身是旧数据（legacy）、没有该 parent_id 的块、或块仍被其他记录引用（shared）时，
+          先按命名空间与标题找一条内容推算 ID 等于 parent_id 的旧文档删除（每条旧记录对应一个文档）
+        - 没有删到旧文档、且块不被其他记录引用时，删除该 parent_id 的所有块
+        :param title: 记录的标题，为空时不查找旧文档
+        :param shared: 还有其他记录的 vector_id 等于 parent_id，此时保留分块向量
+        :param legacy: 记录没有 vector_id（分块之前写入）
+        """
+        if self.vector_store is None:
+            return False
+        collection = self.vector_store._collection
+        try:
+            has_chunks = bool(collection.get(where={"parent_id": parent_id}, include=[])["ids"])
+            removed_legacy = None
+            if title is not None and (legacy or shared or not has_chunks):
+                removed_legacy = self._legacy_doc_id(namespace, title, parent_id)
+                if removed_legacy is not None:
+                    collection.delete(ids=[removed_legacy])
+                    self.lexical_index.remove([removed_legacy])
+            if removed_legacy is None and has_chunks and not shared:
+                collection.delete(where={"parent_id": parent_id})
+                self._delete_sentences({"parent_id": parent_id})
+                self.lexical_index.remove_parent(parent_id)
+            elif removed_legacy is None and not has_chunks:
+                logger.warning(f"未找到知识 {parent_id} 对应的向量")
+        except Exception as e:
+            logger.error(f"删除向量失败 {parent_id}: {e}")
             return False
+        self.invalidate(namespace)
+        return True
+
+    def _legacy_doc_id(self, namespace, title, parent_id):
+        """在没有 parent_id 的旧文档中，找一条按命名空间、标题与内容推算的 ID 等于 parent_id 的文档"""
+        page = self.vector_store._collection.get(
+            where={"$and": [{"uuid": namespace}, {"title": title}]}, include=["metadatas", "documents"]
+        )
+        for doc_id, metadata, content in zip(page["ids"], page["metadatas"], page["documents"]):
+            if (metadata or {}).get("parent_id"):
+                continue
+            if knowledge_doc_id(namespace, title, content or "") == parent_id:
+                return doc_id
+        return None
+
+    def delete_parents(self, namespace, parent_ids):
+        """删除多条知识的所有块（批量导入写 MySQL 失败时回滚本块已写入的向量）"""
+        if self.vector_store is None or not parent_ids:
+            return
+        self.vector_store._collection.delete(where={"parent_id": {"$in": list(parent_ids)}})
+        self._delete_sentences({"parent_id": {"$in": list(parent_ids)}})
+        for parent_id in parent_ids:
+            self.lexical_index.remove_parent(parent_id)
+        self.invalidate(namespace)
+
+    def _iter_documents(self, page_size=500):
+        """
+        分页遍历向量库，产出 (块 ID, 所属知识 ID, 元数据, 文本)
+        分块之前写入的旧文档没有 parent_id，按命名空间、标题与内容推算，与 knowledge_base 的推算方式一致
+        """
+        collection = self.vector_store._collection
+        offset = 0
+        while True:
+            page = collection.get(include=["metadatas", "documents"], limit=page_size, offset=offset)
+            for doc_id, metadata, content in zip(page["ids"], page["metadatas"], page["documents"]):
+                metadata = metadata or {}
+                parent_id = metadata.get("parent_id") or knowledge_doc_id(
+                    metadata.get("uuid"), metadata.get("title", ""), content or ""
+                )
+                yield doc_id, parent_id, metadata, content or ""
+            if len(page["ids"]) < page_size:
+                break
+            offset += page_size
+
+    def iter_vector_keys(self, page_size=500):
+        """分页遍历向量库，产出 (块 ID, 所属知识 ID, 元数据)"""
+        for doc_id, parent_id, metadata, _ in self._iter_documents(page_size):
+            yield doc_id, parent_id, metadata
+
+    def delete_vectors(self, ids, namespaces=()):
+        """按块 ID 删除向量（对账清理孤儿向量用）"""
+        if not ids:
+            return 0
+        self.vector_store._collection.delete(ids=list(ids))
+        self._delete_sentences({"chunk_id": {"$in": list(ids)}})
+        for namespace in set(namespaces):
+            self.invalidate(namespace)
+        return len(ids)
+
+    def add_knowledge_bulk(self, uuid, items, k_type="private", embed_batch_size=RAG_EMBED_BATCH_SIZE):
+        """
+        批量添加知识库内容：切块后按 embed_batch_size 批量向量化，再按大块写入 Chroma
+        :param items: [{"title": .., "content": ..}]
+        :return: 写入的块数，向量库不可用时返回 0
+        """
+        if self.vector_store is None or not items:
+            return 0
+
+        namespace = uuid if k_type == "private" else "public"
+        timestamp = datetime.now().isoformat()
+        ids, contents, metadatas = [], [], []
+        for item in items:
+            item_ids, chunks, item_metadatas = self._chunk_records(
+                namespace, k_type, item["title"], item["content"], timestamp
+            )
+            ids.extend(item_ids)
+            contents.extend(chunks)
+            metadatas.extend(item_metadatas)
+
+        embeddings = []
+        for i in range(0, len(contents), embed_batch_size):
+            embeddings.extend(self.embedding_model.embed_documents(contents[i:i + embed_batch_size]))
+
+        # Chroma 单次写入有上限（SQLite 变量个数限制），超过时按上限再切分
+        collection = self.vector_store._collection
+        max_batch = getattr(self.vector_store._client, "max_batch_size", None) or RAG_WRITE_CHUNK_SIZE
+        chunk = min(RAG_WRITE_CHUNK_SIZE, max_batch)
+        for i in range(0, len(ids), chunk):
+            collection.upsert(
+                ids=ids[i:i + chunk],
+                embeddings=embeddings[i:i + chunk],
+                documents=contents[i:i + chunk],
+                metadatas=metadatas[i:i + chunk]
+            )
+        self._write_sentences(ids, contents, metadatas, embed_batch_size)
+        self.lexical_index.add(ids, contents, metadatas)
+        self.invalidate(namespace)
+        return len(ids)
+
+    def _replace_parent(self, parent_id, ids, chunks, metadatas, embeddings=None):
+        """按固定 parent_id 覆盖写入：先 upsert 新块，再删除旧版本多出来的块，任何时刻都有一份可检索"""
+        collection = self.vector_store._collection
+        if embeddings is None:
+            embeddings = self.embedding_model.embed_documents(chunks)
+        collection.upsert(ids=ids, embeddings=embeddings, documents=chunks, metadatas=metadatas)
+        existing = collection.get(where={"parent_id": parent_id}, include=[])["ids"]
+        current = set(ids)
+        stale = [doc_id for doc_id in existing if doc_id not in current]
+        if stale:
+            collection.delete(ids=stale)
+        self._delete_sentences({"parent_id": parent_id})
+        self._write_sentences(ids, chunks, metadatas)
+        self.lexical_index.remove_parent(parent_id)
+        self.lexical_index.add(ids, chunks, metadatas)
 
     def sync_scl90_result(self, uuid, summary):
-        """同步 SCL-90 结果到向量库"""
-        title = "SCL-90测评报告"
+        """同步 SCL-90 结果到向量库：每个用户固定一个文档 ID，新结果覆盖上一份摘要"""
+        if self.vector_store is None:
+            return False
+
         content = f"用户最新的SCL-90测评结果摘要：{summary}"
-        # 移除旧的 SCL-90 记录以避免重复干扰？目前 Chroma 暂不支持按 metadata 删除方便的 API (需 lookup ID)
-        # 暂时直接添加，作为新的记录
-        return self.add_knowledge(uuid, title, content, k_type="private")
+        parent_id = scl90_doc_id(uuid)
+        try:
+            ids, chunks, metadatas = self._chunk_records(
+                uuid, "private", SCL90_REPORT_TITLE, content, datetime.now().isoformat(), parent_id=parent_id
+            )
+            self._replace_parent(parent_id, ids, chunks, metadatas)
+            self.invalidate(uuid)
+            return True
+        except Exception as e:
+            logger.error(f"同步 SCL-90 结果失败: {e}")
+            return False
+
+    def compact_scl90_reports(self, dry_run=False, page_size=1000):
+        """
+        一次性清理：每个用户只保留最新一份 SCL-90 摘要（按 timestamp），
+        改写到固定 ID 下，其余历史摘要全部删除
+        :return: 统计 {"users", "documents", "deleted"}
+        """
+        if self.vector_store is None:
+            return {"users": 0, "documents": 0, "deleted": 0}
+
+        collection = self.vector_store._collection
+        # 分页只取 ID 与元数据，按用户分组
+        by_user = defaultdict(list)
+        offset = 0
+        while True:
+            page = collection.get(
+                where={"title": SCL90_REPORT_TITLE}, include=["metadatas"], limit=page_size, offset=offset
+            )
+            for doc_id, metadata in zip(page["ids"], page["metadatas"]):
+                by_user[(metadata or {}).get("uuid")].append((doc_id, metadata or {}))
+            if len(page["ids"]) < page_size:
+                break
+            offset += page_size
+
+        stats = {"users": len(by_user), "documents": sum(len(docs) for docs in by_user.values()), "deleted": 0}
+        for uuid, docs in by_user.items():
+            if uuid is None:
+                continue
+            parent_id = scl90_doc_id(uuid)
+            # 最新一份摘要：已是固定 ID 的块，或时间戳最大的旧文档
+            current = [doc_id for doc_id, metadata in docs if metadata.get("parent_id") == parent_id]
+            if current:
+                keep = set(current)
+            else:
+                latest_id, _ = max(docs, key=lambda item: item[1].get("timestamp", ""))
+                keep = {latest_id}
+            remove = [doc_id for doc_id, _ in docs if doc_id not in keep]
+            stats["deleted"] += len(remove)
+            if dry_run:
+                continue
+
+            if not current:
+                # 旧文档改写到固定 ID 下，沿用已有向量，不重新向量化
+                latest = collection.get(ids=list(keep), include=["documents", "metadatas", "embeddings"])
+                content = latest["documents"][0]
+                metadata = latest["metadatas"][0] or {}
+                new_id = f"{parent_id}-0"
+                collection.upsert(
+                    ids=[new_id],
+                    embeddings=[latest["embeddings"][0]],
+                    documents=[content],
+                    metadatas=[dict(metadata, parent_id=parent_id, chunk_index=0, chunk_count=1)]
+                )
+                remove.extend(doc_id for doc_id in keep if doc_id != new_id)
+            if remove:
+                for i in range(0, len(remove), page_size):
+                    collection.delete(ids=remove[i:i + page_size])
+                    self._delete_sentences({"chunk_id": {"$in": remove[i:i + page_size]}})
+            self.invalidate(uuid)
+        return stats
+
+    def build_lexical_index(self):
+        """
+        从向量库全量构建词法索引，直接沿用向量库里的块 ID、文本与元数据，两路结果按同一 ID 融合；
+        旧文档（随机 ID、无 parent_id）在索引中补上推算的 parent_id，删除时能一并移除
+        """
+        if not RAG_HYBRID or self.vector_store is None or self.lexical_index.built:
+            return
+        with self._lexical_build_lock:
+            if self.lexical_index.built:
+                return
+            started = time.perf_counter()
+            try:
+                ids, texts, metadatas = [], [], []
+                for doc_id, parent_id, metadata, content in self._iter_documents():
+                    ids.append(doc_id)
+                    texts.append(content)
+                    metadatas.append(dict(metadata, parent_id=parent_id))
+            except Exception as e:
+                logger.warning(f"构建词法索引失败，下次检索时重试: {e}")
+                return
+            self.lexical_index.add(ids, texts, metadatas)
+            self.lexical_index.built = True
+            logger.info(f"词法索引构建完成：{len(self.lexical_index)} 个块，"
+                        f"耗时 {time.perf_counter() - started:.2f}s")
+
+    def _lexical_search(self, uuid, query, k):
+        """词法检索，返回 [(id, Document, score)]"""
+        self.build_lexical_index()
+        return [
+            (doc_id, Document(page_content=text, metadata=metadata), score)
+            for doc_id, text, metadata, score in self.lexical_index.search(query, ("public", uuid), k)
+        ]
+
+    def invalidate(self, namespace):
+        """使某个命名空间（"public" 或用户 uuid）的检索结果缓存失效"""
+        with self._generation_lock:
+            self._generations[namespace] += 1
+
+    def _result_key(self, uuid, query, k, score_threshold):
+        with self._generation_lock:
+            return (uuid, query, k, score_threshold, self._generations["public"], self._generations[uuid])
+
+    def _embed_query(self, query):
+        embedding = self.embedding_cache.get(query)
+        if embedding is None:
+            embedding = self.embedding_model.embed_query(query)
+            self.embedding_cache.set(query, embedding)
+        return embedding
+
+    def _query_by_vector(self, embedding, k, where, vectors):
+        """
+        用已计算好的查询向量直接查询集合，返回 [(id, Document, distance)]
+        命中文档的向量写入 vectors，供相关度计算与 MMR 使用
+        """
+        result = self.vector_store._collection.query(
+            query_embeddings=[embedding],
+            n_results=k,
+            where=where,
+            include=["documents", "metadatas", "distances", "embeddings"]
+        )
+        for doc_id, vector in zip(result["ids"][0], result["embeddings"][0]):
+            vectors[doc_id] = vector
+        return [
+            (doc_id, Document(page_content=content, metadata=metadata or {}), distance)
+            for doc_id, content, metadata, distance in zip(
+                result["ids"][0], result["documents"][0], result["metadatas"][0], result["distances"][0]
+            )
+        ]
+
+    def _dedup(self, results):
+        """去重：同一条记录按 id，重复写入的相同内容按内容哈希"""
+        seen = set()
+        unique = []
+        for doc_id, doc, score in results:
+            digest = content_hash(doc.page_content)
+            if doc_id in seen or digest in seen:
+                continue
+            seen.update((doc_id, digest))
+            unique.append((doc_id, doc, score))
+        return unique
+
+    def _rerank(self, query_vector, candidates, vectors, top_n, score_threshold):
+        """
+        相关度过滤 + MMR 多样性重排
+        相关度统一用查询与文档向量的余弦相似度，与集合配置的距离度量（默认 l2，向量未归一化）无关
+        """
+        missing = [doc_id for doc_id, _, _ in candidates if doc_id not in vectors]
+        if missing:
+            # 只由词法检索命中的块，补取其向量
+            fetched = self.vector_store._collection.get(ids=missing, include=["embeddings"])
+            for doc_id, vector in zip(fetched["ids"], fetched["embeddings"]):
+                vectors[doc_id] = vector
+            # 向量库里取不到的（索引与向量库暂时不一致），现场向量化，不丢弃词法命中
+            unresolved = [(doc_id, doc) for doc_id, doc, _ in candidates if doc_id not in vectors]
+            if unresolved:
+                embedded = self.embedding_model.embed_documents([doc.page_content for _, doc in unresolved])
+                for (doc_id, _), vector in zip(unresolved, embedded):
+                    vectors[doc_id] = vector
+        scored = [(doc_id, doc) for doc_id, doc, _ in candidates]
+        if not scored:
+            return []
+
+        relevance = cosine_scores(query_vector, [vectors[doc_id] for doc_id, _ in scored])
+        passed = [idx for idx, score in enumerate(relevance) if score >= score_threshold]
+        order = mmr(
+            query_vector, [vectors[scored[idx][0]] for idx in passed], top_n,
+            lambda_mult=RAG_MMR_LAMBDA, relevance=relevance[passed]
+        )
+        selected = [scored[passed[idx]] for idx in order]
+        if len(selected) < len(candidates):
+            saved_chars = sum(len(doc.page_content) for _, doc, _ in candidates) - sum(len(doc.page_content) for _, doc in selected)
+            logger.info(
+                f"检索重排: 候选 {len(candidates)} 条，低于阈值 {score_threshold} 过滤 {len(scored) - len(passed)} 条，"
+                f"保留 {len(selected)} 条，少传入约 {saved_chars} 字"
+            )
+        return selected
+
+    def _context_lengths(self, texts):
+        """
+        文本按 LLM 分词后的 token 数：本地后端只加载 ChatGLM 的分词器（不加载模型），
+        远程后端或分词器加载失败时用 ApproxTokenizer 近似，与生成端组装 Prompt 的计数方式一致
+        """
+        if self._context_assembler is None:
+            with self._context_lock:
+                if self._context_assembler is None:
+                    tokenizer = None
+                    if LLM_BACKEND == "local" and AutoTokenizer is not None:
+                        try:
+                            tokenizer = AutoTokenizer.from_pretrained(
+                                CHATGLM_6B_INT4_DIR, trust_remote_code=True, local_files_only=True
+                            )
+                        except Exception as e:
+                            logger.warning(f"加载 LLM 分词器失败，上下文预算改用近似计数: {e}")
+                    self._context_assembler = PromptAssembler(tokenizer or ApproxTokenizer())
+        return self._context_assembler.lengths(texts)
 
-    def search(self, uuid, query, k=5, score_threshold=0.5):
+    def _lexical_only(self, lexical_results, k, budget=RAG_CONTEXT_MAX_TOKENS):
+        """
+        短查询只走词法检索时的筛选（没有查询向量，不做余弦阈值与 MMR）：
+        BM25 得分低于最高分 RAG_LEXICAL_MIN_SCORE_RATIO 倍的（通常只共享一个二元组）丢弃，
+        去重后最多取 k 条，并按相关度依次放入上下文 token 预算，放不下的跳过
+        """
+        floor = lexical_results[0][2] * RAG_LEXICAL_MIN_SCORE_RATIO
+        passed = self._dedup([result for result in lexical_results if result[2] >= floor])[:k]
+        docs, used = [], 0
+        lengths = self._context_lengths([doc.page_content for _, doc, _ in passed])
+        for (_, doc, _), length in zip(passed, lengths):
+            if docs and used + length > budget:
+                continue
+            docs.append(doc)
+            used += length
+        if len(docs) < len(lexical_results):
+            logger.info(f"词法快速路径: 命中 {len(lexical_results)} 条，保留 {len(docs)} 条（约 {used} tokens）")
+        return docs
+
+    def _embed_sentences(self, sentences):
+        """句向量：先查缓存，未命中的一次批量向量化"""
+        vectors = [self.sentence_cache.get(sentence) for sentence in sentences]
+        missing = [idx for idx, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = self.embedding_model.embed_documents([sentences[idx] for idx in missing])
+            for idx, vector in zip(missing, computed):
+                vectors[idx] = vector
+                self.sentence_cache.set(sentences[idx], vector)
+        return vectors
+
+    def _compress(self, query_vector, selected, vectors, budget=RAG_CONTEXT_MAX_TOKENS):
+        """
+        抽取式压缩：把检索到的知识切成句子，按与查询的相似度选句直到 token 预算（LLM token），
+        每条知识内保持原句顺序并补回原文的换行/空格，没有句子入选的知识整条丢弃
+        句向量在写入时已存入句子集合，这里只做点积；只有一句的知识直接复用块向量，
+        句子集合中没有记录的旧块才现场向量化
+        """
+        docs = [doc for _, doc in selected]
+        before = sum(self._context_lengths([doc.page_content for doc in docs]))
+        if before <= budget:
+            return docs
+
+        start = time.perf_counter()
+        split = [split_sentences(doc.page_content) for doc in docs]
+        stored = self._stored_sentences([doc_id for (doc_id, _), parts in zip(selected, split) if len(parts) > 1])
+        owners, sentences, sentence_vectors, to_embed = [], [], [], []
+        for doc_idx, ((doc_id, doc), parts) in enumerate(zip(selected, split)):
+            if len(parts) == 1:
+                owners.append(doc_idx)
+                sentences.append(parts[0])
+                sentence_vectors.append(vectors[doc_id])
+                continue
+            if doc_id in stored:
+                for sentence, vector in stored[doc_id]:
+                    owners.append(doc_idx)
+                    sentences.append(sentence)
+                    sentence_vectors.append(vector)
+                continue
+            for part in parts:
+                owners.append(doc_idx)
+                sentences.append(part)
+                sentence_vectors.append(None)
+                to_embed.append(len(sentences) - 1)
+        if to_embed:
+            for idx, vector in zip(to_embed, self._embed_sentences([sentences[i] for i in to_embed])):
+                sentence_vectors[idx] = vector
+
+        lengths = self._context_lengths(sentences)
+        kept = select_within_budget(query_vector, sentence_vectors, lengths, budget)
+        grouped = defaultdict(list)
+        for idx in kept:
+            grouped[owners[idx]].append(sentences[idx])
+        compressed = [
+            Document(
+                page_content=join_sentences(docs[doc_idx].page_content, grouped[doc_idx]),
+                metadata=dict(docs[doc_idx].metadata, compressed=True)
+            )
+            for doc_idx in range(len(docs)) if grouped[doc_idx]
+        ]
+
+        elapsed = time.perf_counter() - start
+        self._compress_hist.observe(elapsed)
+        after = sum(lengths[idx] for idx in kept)
+        logger.info(
+            f"检索上下文压缩: {len(sentences)} 句保留 {len(kept)} 句（现场向量化 {len(to_embed)} 句），"
+            f"约 {before} → {after} tokens，耗时 {elapsed * 1000:.1f}ms"
+        )
+        return compressed
+
+    def search(self, uuid, query, k=5, score_threshold=None):
         """
         检索知识
         策略：检索 公共知识库 + 该用户的个人知识库
+        查询只向量化一次，两次向量库查询复用同一向量；
+        开启混合检索时再与 BM25 词法结果做倒数排名融合，短查询词法命中时跳过向量化；
+        最后按余弦相似度阈值过滤，用 MMR 去掉内容重复的知识，再按句压缩到上下文 token 预算内
+        :param score_threshold: 余弦相似度下限，为空时使用 RAG_SCORE_THRESHOLD
         """
         if not self.vector_store:
             return []
 
+        score_threshold = RAG_SCORE_THRESHOLD if score_threshold is None else score_threshold
+        query = normalize_text(query)
+        # 写入前取键：检索期间发生写入时，结果存在旧代数下，不会被后续查询命中
+        cache_key = self._result_key(uuid, query, k, score_threshold)
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+
         try:
-            # 1. 检索公共知识
-            public_docs = self.vector_store.similarity_search_with_score(
-                query, 
-                k=k, 
-                filter={"type": "public"}
-            )
-            
-            # 2. 检索个人知识
-            private_docs = self.vector_store.similarity_search_with_score(
-                query, 
-                k=k, 
-                filter={"uuid": uuid}
-            )
-            
-            # 合并结果 (doc, score)
-            all_results = public_docs + private_docs
-            
-            # 过滤低相关性结果 (score 越小越相似，Chroma 默认是 L2 距离，或者是 cosine distance)
-            # 假设是 cosine distance，范围 0-1 (0 是完全相同，1 是完全不同)
-            # 如果是 L2，值可能大于 1
-            # 这里我们假设 score 是距离，越小越好。我们可以设置一个阈值。
-            # 为了保险，先不过滤，只排序。
-            
-            all_results.sort(key=lambda x: x[1]) # 按分数升序排序（距离越小越好）
+            lexical_results = self._lexical_search(uuid, query, k * 2) if RAG_HYBRID else []
+            if lexical_results and len(query) <= RAG_LEXICAL_ONLY_MAX_CHARS:
+                # 很短的查询（如症状词）精确匹配已足够，省掉一次 BERT 前向
+                self._lexical_fast_path.inc()
+                final_docs = self._lexical_only(lexical_results, k)
+                self.result_cache.set(cache_key, final_docs)
+                return list(final_docs)
+
+            start = time.perf_counter()
+            embedding = self._embed_query(query)
+            embedded = time.perf_counter()
+
+            # 公共、个人分别取 k 条，保证个人知识不会被大量公共知识挤出
+            vectors = {}
+            all_results = self._query_by_vector(embedding, k, {"type": "public"}, vectors)
+            all_results += self._query_by_vector(embedding, k, {"uuid": uuid}, vectors)
+            queried = time.perf_counter()
+
+            self._embed_hist.observe(embedded - start)
+            self._query_hist.observe(queried - embedded)
+            logger.debug(f"RAG 检索耗时: 向量化 {(embedded - start) * 1000:.1f}ms, 查询 {(queried - embedded) * 1000:.1f}ms")
             
-            # 去重
-            seen = set()
-            final_docs = []
-            for doc, score in all_results:
-                if doc.page_content not in seen:
-                    seen.add(doc.page_content)
-                    final_docs.append(doc)
+            all_results.sort(key=lambda x: x[2]) # 按距离升序排序（距离越小越好）
+
+            if lexical_results:
+                # 两路结果按块 ID 做倒数排名融合，不需要统一两种分数的量纲
+                by_id = {doc_id: (doc_id, doc, score) for doc_id, doc, score in lexical_results + all_results}
+                fused = reciprocal_rank_fusion(
+                    [[r[0] for r in all_results], [r[0] for r in lexical_results]], k=RAG_RRF_K
+                )
+                all_results = [by_id[doc_id] for doc_id in fused]
             
-            return final_docs[:k*2] 
+            selected = self._rerank(embedding, self._dedup(all_results), vectors, k * 2, score_threshold)
+            if RAG_COMPRESSION:
+                final_docs = self._compress(embedding, selected, vectors)
+            else:
+                final_docs = [doc for _, doc in selected]
+            self.result_cache.set(cache_key, final_docs)
+            return list(final_docs)
         except Exception as e:
             logger.error(f"检索失败: {e}")
             return []
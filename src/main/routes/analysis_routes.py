@@ -1,12 +1,14 @@
+import json
 import traceback
 import logging
 from datetime import datetime
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 
 from services.analysis_service import analysis_service
+from services.job_service import job_service, QueueFullError
 from database import db_manager
 from utils.request_utils import get_uuid
-from utils.validation import validate_json, validate_uuid, MentalAnalysisRequest
+from utils.validation import validate_json, validate_uuid, require_ready, MentalAnalysisRequest
 
 analysis_bp = Blueprint('analysis', __name__)
 logger = logging.getLogger(__name__)
@@ -18,6 +20,7 @@ class SessionRequest:
 
 @analysis_bp.route("/mental_analysis", methods=["POST"])
 @validate_uuid
+@require_ready("emotion", "llm")
 @validate_json(MentalAnalysisRequest)
 def mental_analysis_api():
     try:
@@ -26,8 +29,12 @@ def mental_analysis_api():
         user_text = validated.text
         deep_thinking = validated.deep_thinking
         session_id = request.json.get('session_id', None)
+        # 截止时间从收到请求开始计算，情绪分析与知识检索的耗时也计入
+        deadline = analysis_service.resolve_deadline(validated.timeout)
         
-        result = analysis_service.analyze(uuid, user_text, deep_thinking=deep_thinking, session_id=session_id)
+        result = analysis_service.analyze(
+            uuid, user_text, deep_thinking=deep_thinking, session_id=session_id, deadline=deadline
+        )
         return jsonify(result)
     
     except Exception as e:
@@ -35,6 +42,107 @@ def mental_analysis_api():
         return jsonify({"code": 500, "msg": f"服务器内部错误：{str(e)}"})
 
 
+def _format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@analysis_bp.route("/mental_analysis/stream", methods=["POST"])
+@validate_uuid
+@require_ready("emotion", "llm")
+@validate_json(MentalAnalysisRequest)
+def mental_analysis_stream_api():
+    uuid = request.uuid
+    validated = request.validated_data
+    session_id = request.json.get('session_id', None)
+    deadline = analysis_service.resolve_deadline(validated.timeout)
+
+    def event_stream():
+        events = analysis_service.analyze_stream(
+            uuid, validated.text, deep_thinking=validated.deep_thinking,
+            session_id=session_id, deadline=deadline
+        )
+        try:
+            for event, data in events:
+                yield _format_sse(event, data)
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            yield _format_sse("error", {"code": 500, "msg": f"服务器内部错误：{str(e)}"})
+        finally:
+            # 客户端断开时 WSGI 服务器会关闭本生成器，这里显式关闭 analyze_stream 以取消生成
+            events.close()
+
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@analysis_bp.route("/mental_analysis/jobs", methods=["POST"])
+@validate_uuid
+@require_ready("emotion", "llm")
+@validate_json(MentalAnalysisRequest)
+def submit_analysis_job():
+    uuid = request.uuid
+    validated = request.validated_data
+    session_id = request.json.get('session_id', None)
+
+    try:
+        job, reused = job_service.submit(
+            uuid, validated.text, deep_thinking=validated.deep_thinking, session_id=session_id
+        )
+    except QueueFullError as e:
+        response = jsonify({"code": 429, "msg": str(e), "data": {"retry_after": e.retry_after}})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+
+    position = job_service.queue_position(job)
+    return jsonify({
+        "code": 202,
+        "msg": "已有相同任务" if reused else "任务已提交",
+        "data": {
+            "job_id": job.job_id,
+            "status": job.status,
+            "position": position,
+            "estimated_wait": job_service.estimated_wait(position)
+        }
+    }), 202
+
+
+@analysis_bp.route("/mental_analysis/jobs/<job_id>", methods=["GET"])
+@validate_uuid
+def get_analysis_job(job_id):
+    job = job_service.get(request.uuid, job_id)
+    if job is None:
+        return jsonify({"code": 404, "msg": "任务不存在或已过期"}), 404
+
+    data = job.to_dict()
+    data["position"] = job_service.queue_position(job)
+    return jsonify({"code": 200, "data": data})
+
+
+@analysis_bp.route("/mental_analysis/jobs/<job_id>/events", methods=["GET"])
+@validate_uuid
+def subscribe_analysis_job(job_id):
+    job = job_service.get(request.uuid, job_id)
+    if job is None:
+        return jsonify({"code": 404, "msg": "任务不存在或已过期"}), 404
+
+    def event_stream():
+        for event, data in job_service.events(job):
+            if event is None:
+                # 心跳，防止代理断开空闲连接
+                yield ": keep-alive\n\n"
+                continue
+            yield _format_sse(event, data)
+
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @analysis_bp.route("/sessions", methods=["GET"])
 @validate_uuid
 def get_sessions():
@@ -0,0 +1,31 @@
+import traceback
+import logging
+from flask import Blueprint, request, jsonify
+
+from services.emotion_service import emotion_service
+from utils.validation import validate_json, validate_uuid, require_ready, EmotionBatchRequest
+
+emotion_bp = Blueprint('emotion', __name__)
+logger = logging.getLogger(__name__)
+
+
+@emotion_bp.route("/batch", methods=["POST"])
+@validate_uuid
+@require_ready("emotion")
+@validate_json(EmotionBatchRequest)
+def emotion_batch_api():
+    try:
+        uuid = request.uuid
+        validated = request.validated_data
+
+        result = emotion_service.analyze_batch(
+            uuid,
+            validated.texts,
+            top_k=validated.top_k,
+            persist=validated.persist
+        )
+        return jsonify(result)
+
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        return jsonify({"code": 500, "msg": f"服务器内部错误：{str(e)}"})
@@ -1,15 +1,22 @@
+import hashlib
 import logging
+import os
+import tempfile
 from flask import Blueprint, request, jsonify
 
+from config import KNOWLEDGE_BULK_MAX_BYTES, KNOWLEDGE_BULK_MAX_RECORDS
 from services.knowledge_service import knowledge_service
+from services.ingest_service import ingest_service, iter_records, detect_format, SUPPORTED_FORMATS
+from services.job_service import ingest_job_service, QueueFullError, DONE
 from utils.request_utils import get_uuid
-from utils.validation import validate_json, validate_uuid, KnowledgeAddRequest
+from utils.validation import validate_json, validate_uuid, require_ready, KnowledgeAddRequest
 
 knowledge_bp = Blueprint('knowledge', __name__)
 logger = logging.getLogger(__name__)
 
 
 @knowledge_bp.route("/add", methods=["POST"])
+@require_ready("rag")
 @validate_uuid
 @validate_json(KnowledgeAddRequest)
 def add_knowledge():
@@ -37,6 +44,7 @@ def list_knowledge():
 
 
 @knowledge_bp.route("/delete/<int:id>", methods=["DELETE"])
+@require_ready("rag")
 @validate_uuid
 def delete_knowledge(id):
     uuid = request.uuid
@@ -55,6 +63,7 @@ def get_knowledge_detail(id):
 
 
 @knowledge_bp.route("/search", methods=["GET"])
+@require_ready("rag")
 @validate_uuid
 def search_knowledge():
     uuid = request.uuid
@@ -65,3 +74,122 @@ def search_knowledge():
     
     result = knowledge_service.search_knowledge(uuid, query)
     return jsonify(result)
+
+
+UPLOAD_READ_SIZE = 1024 * 1024
+
+
+def _save_upload(upload, max_bytes):
+    """
+    把上传文件写入临时文件，超过 max_bytes 时删除并返回 None
+    :return: (临时文件路径, 内容 sha1)
+    """
+    digest = hashlib.sha1()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="knowledge-bulk-")
+    with os.fdopen(fd, "wb") as f:
+        while True:
+            block = upload.stream.read(UPLOAD_READ_SIZE)
+            if not block:
+                break
+            size += len(block)
+            if size > max_bytes:
+                f.close()
+                os.remove(path)
+                return None, None
+            digest.update(block)
+            f.write(block)
+    return path, digest.hexdigest()
+
+
+def _count_records(path, fmt):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        return sum(1 for _ in iter_records(f, fmt))
+
+
+def _ingest_runner(uuid, path, fmt):
+    """任务队列中执行的导入：逐块写入并发布进度，结束后删除临时文件"""
+    def run(job):
+        try:
+            with open(path, "r", encoding="utf-8-sig", newline="") as f:
+                stats = ingest_service.ingest(
+                    iter_records(f, fmt), uuid=uuid, k_type="private", schema=KnowledgeAddRequest,
+                    progress=lambda s: job.publish("progress", dict(s))
+                )
+        finally:
+            os.remove(path)
+        job.result = stats
+        job.status = DONE
+        job.publish("done", stats)
+    return run
+
+
+@knowledge_bp.route("/bulk", methods=["POST"])
+@require_ready("rag")
+@validate_uuid
+def bulk_import_knowledge():
+    """
+    上传 JSONL / CSV 文件批量导入个人知识库
+    文件大小与条数受限，每条按 KnowledgeAddRequest 校验；导入在独立的单线程任务队列中执行（不占用分析任务的工作线程），立即返回 job_id
+    """
+    uuid = request.uuid
+    if request.content_length and request.content_length > KNOWLEDGE_BULK_MAX_BYTES:
+        return jsonify({"code": 413, "msg": f"文件超过 {KNOWLEDGE_BULK_MAX_BYTES} 字节上限"}), 413
+    upload = request.files.get("file")
+    if upload is None:
+        return jsonify({"code": 400, "msg": "缺少上传文件 (file)"}), 400
+
+    fmt = request.form.get("format") or detect_format(upload.filename or "")
+    if fmt not in SUPPORTED_FORMATS:
+        return jsonify({"code": 400, "msg": f"不支持的文件格式: {fmt}"}), 400
+
+    path, digest = _save_upload(upload, KNOWLEDGE_BULK_MAX_BYTES)
+    if path is None:
+        return jsonify({"code": 413, "msg": f"文件超过 {KNOWLEDGE_BULK_MAX_BYTES} 字节上限"}), 413
+    try:
+        count = _count_records(path, fmt)
+    except Exception as e:
+        os.remove(path)
+        return jsonify({"code": 400, "msg": f"无法解析上传文件: {str(e)}"}), 400
+    if count > KNOWLEDGE_BULK_MAX_RECORDS:
+        os.remove(path)
+        return jsonify({"code": 413, "msg": f"记录数 {count} 超过 {KNOWLEDGE_BULK_MAX_RECORDS} 条上限"}), 413
+
+    try:
+        job, reused = ingest_job_service.submit_task(
+            uuid, f"knowledge-bulk\0{digest}", _ingest_runner(uuid, path, fmt)
+        )
+    except QueueFullError as e:
+        os.remove(path)
+        response = jsonify({"code": 429, "msg": str(e), "data": {"retry_after": e.retry_after}})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+    if reused:
+        # 相同文件的导入任务已存在，本次上传不再需要
+        os.remove(path)
+
+    position = ingest_job_service.queue_position(job)
+    return jsonify({
+        "code": 202,
+        "msg": "已有相同导入任务" if reused else "导入任务已提交",
+        "data": {
+            "job_id": job.job_id,
+            "status": job.status,
+            "records": count,
+            "position": position,
+            "estimated_wait": ingest_job_service.estimated_wait(position)
+        }
+    }), 202
+
+
+@knowledge_bp.route("/bulk/<job_id>", methods=["GET"])
+@validate_uuid
+def get_bulk_import_job(job_id):
+    """查询批量导入任务状态，完成后 result 为导入统计"""
+    job = ingest_job_service.get(request.uuid, job_id)
+    if job is None or job.runner is None:
+        return jsonify({"code": 404, "msg": "任务不存在或已过期"}), 404
+
+    data = job.to_dict()
+    data["position"] = ingest_job_service.queue_position(job)
+    return jsonify({"code": 200, "data": data})
@@ -1,16 +1,18 @@
 import logging
 import json
+import threading
+import time
 import traceback
 import uuid as uuid_module
 from datetime import datetime
 from database import db_manager
 from rag_service import rag_service
 from model_loader import model_loader
+from config import GENERATION_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
 MAX_HISTORY_TURNS = 5
-MAX_CONTEXT_LENGTH = 2048
 
 class AnalysisService:
     def __init__(self):
@@ -28,7 +30,7 @@ class AnalysisService:
         return str(uuid)
 
     def _get_session_history(self, uuid, session_id):
-        """获取会话历史，用于构建上下文"""
+        """获取会话最近的若干轮历史（按时间正序），用于构建上下文"""
         if not session_id:
             return []
         
@@ -36,26 +38,15 @@ class AnalysisService:
             SELECT user_query, system_reply, emotion, risk_level 
             FROM dialogue 
             WHERE uuid = %s AND session_id = %s 
-            ORDER BY created_at ASC
+            ORDER BY created_at DESC
             LIMIT %s
         """
         results = db_manager.execute_query(sql, (uuid, session_id, MAX_HISTORY_TURNS))
-        return results or []
+        return list(reversed(results or []))
 
-    def _build_conversation_context(self, history):
-        """构建对话上下文字符串"""
-        if not history:
-            return ""
-        
-        context_parts = []
-        for h in history[-MAX_HISTORY_TURNS:]:
-            context_parts.append(f"用户：{h['user_query']}")
-            context_parts.append(f"咨询师：{h['system_reply']}")
-        
-        context = "\n".join(context_parts)
-        if len(context) > MAX_CONTEXT_LENGTH:
-            context = context[-MAX_CONTEXT_LENGTH:]
-        return context
+    def _build_conversation_turns(self, history):
+        """构建对话上下文：每轮一段，长度由生成器按 Token 预算裁剪（优先保留最近的轮次）"""
+        return [f"用户：{h['user_query']}\n咨询师：{h['system_reply']}" for h in history[-MAX_HISTORY_TURNS:]]
 
     def _get_or_create_session(self, uuid, session_id=None):
         """获取或创建会话"""
@@ -82,58 +73,87 @@ class AnalysisService:
         """
         db_manager.execute_update(sql, (title, session_id))
 
-    def analyze(self, uuid, user_text, deep_thinking=False, session_id=None):
-        """执行心理分析全流程，支持上下文记忆"""
+    def resolve_deadline(self, timeout=None):
+        """把请求指定的超时（秒）换算为截止时间戳，不超过 GENERATION_TIMEOUT"""
+        if not timeout or timeout > GENERATION_TIMEOUT:
+            timeout = GENERATION_TIMEOUT
+        return time.time() + timeout
+
+    def _prepare_analysis(self, uuid, user_text, deep_thinking=False, session_id=None, deadline=None, cancel_event=None):
+        """准备分析上下文：会话、历史、SCL-90 摘要、知识检索与情绪识别"""
+        current_session_id = self._get_or_create_session(uuid, session_id)
+        history = self._get_session_history(uuid, current_session_id)
+        conversation_turns = self._build_conversation_turns(history)
+        
+        scl90_summary = ""
+        sql = "SELECT total_score, abnormal_items FROM scl90_record WHERE uuid = %s ORDER BY created_at DESC LIMIT 1"
+        scl_record = db_manager.execute_query(sql, (uuid,))
+        if scl_record:
+            rec = scl_record[0]
+            abnormal = json.loads(rec['abnormal_items']) if isinstance(rec['abnormal_items'], str) else rec['abnormal_items']
+            abnormal_str = "、".join([i['question'] for i in abnormal]) if abnormal else "无"
+            scl90_summary = f"SCL-90总分: {rec['total_score']}, 异常症状: {abnormal_str}"
+
+        knowledge_docs = rag_service.search(uuid, user_text)
+        # 按相关度排序的知识分段传入，超出预算时从相关度低的开始裁剪
+        knowledge_context = [doc.page_content for doc in knowledge_docs]
+        
+        if deep_thinking:
+            self.deep_think(uuid, user_text, scl90_summary, knowledge_docs)
+        
+        emotion, risk = "未知", "未知"
+        if model_loader.emotion_classifier:
+            try:
+                emotion, risk = model_loader.discriminate(user_text)
+            except Exception as e:
+                logger.error(f"情绪分析失败: {e}")
+
+        return {
+            "session_id": current_session_id,
+            "emotion": emotion,
+            "risk": risk,
+            "generation_args": {
+                "user_text": user_text,
+                "emotion": emotion,
+                "risk": risk,
+                "scl90_summary": scl90_summary,
+                "rag_context": knowledge_context,
+                "deep_thinking": deep_thinking,
+                "conversation_history": conversation_turns,
+                "deadline": deadline if deadline is not None else self.resolve_deadline(),
+                "cancel_event": cancel_event
+            },
+            "context_used": len(knowledge_docs) > 0
+        }
+
+    def _save_dialogue(self, uuid, session_id, user_text, advice, emotion, risk):
+        """写入对话记录并更新会话信息"""
+        sql = """
+            INSERT INTO dialogue (uuid, session_id, user_query, system_reply, emotion, risk_level, created_at) 
+            VALUES (%s, %s, %s, %s, %s, %s, NOW())
+        """
+        db_manager.execute_update(sql, (uuid, session_id, user_text, advice, emotion, risk))
+        
+        self._update_session(session_id, user_text)
+
+    def analyze(self, uuid, user_text, deep_thinking=False, session_id=None, deadline=None, cancel_event=None):
+        """
+        执行心理分析全流程，支持上下文记忆
+        :param deadline: 截止时间戳，到期后生成提前结束，返回已生成的部分建议
+        """
         try:
-            current_session_id = self._get_or_create_session(uuid, session_id)
-            history = self._get_session_history(uuid, current_session_id)
-            conversation_context = self._build_conversation_context(history)
-            
-            scl90_summary = ""
-            sql = "SELECT total_score, abnormal_items FROM scl90_record WHERE uuid = %s ORDER BY created_at DESC LIMIT 1"
-            scl_record = db_manager.execute_query(sql, (uuid,))
-            if scl_record:
-                rec = scl_record[0]
-                abnormal = json.loads(rec['abnormal_items']) if isinstance(rec['abnormal_items'], str) else rec['abnormal_items']
-                abnormal_str = "、".join([i['question'] for i in abnormal]) if abnormal else "无"
-                scl90_summary = f"SCL-90总分: {rec['total_score']}, 异常症状: {abnormal_str}"
-
-            knowledge_docs = rag_service.search(uuid, user_text)
-            knowledge_context = "\n".join([doc.page_content for doc in knowledge_docs])
-            
-            if deep_thinking:
-                self.deep_think(uuid, user_text, scl90_summary, knowledge_docs)
-            
-            emotion, risk = "未知", "未知"
-            if model_loader.emotion_classifier:
-                try:
-                    emotion, risk = model_loader.emotion_classifier.discriminate(user_text)
-                except Exception as e:
-                    logger.error(f"情绪分析失败: {e}")
+            ctx = self._prepare_analysis(uuid, user_text, deep_thinking, session_id, deadline, cancel_event)
+            emotion, risk = ctx["emotion"], ctx["risk"]
             
             advice = "系统维护中，无法生成建议。"
             if model_loader.advice_generator:
                 try:
-                    advice = model_loader.advice_generator.generate(
-                        user_text=user_text, 
-                        emotion=emotion, 
-                        risk=risk, 
-                        scl90_summary=scl90_summary,
-                        rag_context=knowledge_context,
-                        deep_thinking=deep_thinking,
-                        conversation_history=conversation_context
-                    )
+                    advice = model_loader.generate_advice(**ctx["generation_args"])
                 except Exception as e:
                     logger.error(f"建议生成失败: {e}")
                     advice = "抱歉，AI咨询师暂时无法回应，请稍后再试。"
             
-            sql = """
-                INSERT INTO dialogue (uuid, session_id, user_query, system_reply, emotion, risk_level, created_at) 
-                VALUES (%s, %s, %s, %s, %s, %s, NOW())
-            """
-            db_manager.execute_update(sql, (uuid, current_session_id, user_text, advice, emotion, risk))
-            
-            self._update_session(current_session_id, user_text)
+            self._save_dialogue(uuid, ctx["session_id"], user_text, advice, emotion, risk)
             
             return {
                 "code": 200,
@@ -143,9 +163,9 @@ class AnalysisService:
                     "emotion": emotion,
                     "risk": risk,
                     "advice": advice,
-                    "context_used": len(knowledge_docs) > 0,
+                    "context_used": ctx["context_used"],
                     "deep_thinking": deep_thinking,
-                    "session_id": current_session_id
+                    "session_id": ctx["session_id"]
                 }
             }
         
@@ -158,6 +178,63 @@ class AnalysisService:
                 "data": None
             }
 
+    def analyze_stream(self, uuid, user_text, deep_thinking=False, session_id=None, deadline=None, cancel_event=None):
+        """
+        流式执行心理分析，依次产出 (event, data)：
+        - meta: 情绪与风险等级（生成开始前即可返回）
+        - token: 新生成的文本片段
+        - done: 生成结束，附带 session_id
+        - error: 发生错误
+        对话记录只在流完整结束后写入；调用方提前关闭生成器（客户端断开）时取消生成
+        """
+        cancel_event = cancel_event or threading.Event()
+        try:
+            ctx = self._prepare_analysis(uuid, user_text, deep_thinking, session_id, deadline, cancel_event)
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            yield "error", {"code": 500, "msg": f"服务器内部错误：{str(e)}"}
+            return
+
+        emotion, risk = ctx["emotion"], ctx["risk"]
+        yield "meta", {
+            "emotion": emotion,
+            "risk": risk,
+            "context_used": ctx["context_used"],
+            "deep_thinking": deep_thinking,
+            "session_id": ctx["session_id"]
+        }
+
+        pieces = []
+        if model_loader.advice_generator:
+            try:
+                for piece in model_loader.stream_advice(**ctx["generation_args"]):
+                    pieces.append(piece)
+                    yield "token", {"text": piece}
+            except GeneratorExit:
+                cancel_event.set()
+                logger.info(f"[{uuid}] 客户端已断开，取消生成")
+                raise
+            except Exception as e:
+                logger.error(f"建议生成失败: {e}")
+                if not pieces:
+                    fallback = "抱歉，AI咨询师暂时无法回应，请稍后再试。"
+                    pieces.append(fallback)
+                    yield "token", {"text": fallback}
+        else:
+            fallback = "系统维护中，无法生成建议。"
+            pieces.append(fallback)
+            yield "token", {"text": fallback}
+
+        advice = "".join(pieces).strip()
+        try:
+            self._save_dialogue(uuid, ctx["session_id"], user_text, advice, emotion, risk)
+        except Exception as e:
+            logger.error(f"保存对话记录失败: {e}")
+            yield "error", {"code": 500, "msg": f"保存对话记录失败：{str(e)}"}
+            return
+
+        yield "done", {"session_id": ctx["session_id"], "advice": advice}
+
     def get_sessions(self, uuid):
         """获取用户的所有会话列表"""
         sql = """
@@ -0,0 +1,55 @@
+import json
+import logging
+import traceback
+from database import db_manager
+from model_loader import model_loader
+
+logger = logging.getLogger(__name__)
+
+class EmotionService:
+    def _latest_scl90_id(self, uuid):
+        """获取用户最近一次 SCL-90 记录 ID，作为分析结果的关联引用"""
+        sql = "SELECT id FROM scl90_record WHERE uuid = %s ORDER BY created_at DESC LIMIT 1"
+        result = db_manager.execute_query(sql, (uuid,))
+        return result[0]['id'] if result else None
+
+    def _persist(self, uuid, texts, results):
+        """一次批量插入写入 text_analysis 表"""
+        scl90_ref_id = self._latest_scl90_id(uuid)
+        sql = "INSERT INTO text_analysis (uuid, content, emotion_result, scl90_ref_id) VALUES (%s, %s, %s, %s)"
+        params_list = [
+            (uuid, text, json.dumps(result, ensure_ascii=False), scl90_ref_id)
+            for text, result in zip(texts, results)
+        ]
+        return db_manager.execute_batch(sql, params_list)
+
+    def analyze_batch(self, uuid, texts, top_k=3, persist=True):
+        """批量情感与风险评估，不调用大模型"""
+        if model_loader.emotion_classifier is None:
+            return {"code": 503, "msg": "情感分析模型未加载", "data": None}
+
+        try:
+            results = model_loader.emotion_classifier.predict_batch(texts, top_k=top_k)
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            return {"code": 500, "msg": f"情感分析失败: {str(e)}", "data": None}
+
+        persisted = 0
+        if persist:
+            try:
+                persisted = self._persist(uuid, texts, results)
+            except Exception as e:
+                # 持久化失败不影响返回分析结果
+                logger.error(f"批量写入 text_analysis 失败: {e}")
+
+        return {
+            "code": 200,
+            "msg": "分析成功",
+            "data": {
+                "results": [dict(result, text=text) for text, result in zip(texts, results)],
+                "count": len(results),
+                "persisted": persisted
+            }
+        }
+
+emotion_service = EmotionService()
@@ -0,0 +1,200 @@
+import csv
+import json
+import os
+import time
+import logging
+
+from config import RAG_EMBED_BATCH_SIZE, RAG_WRITE_CHUNK_SIZE
+from database import db_manager
+from rag_service import rag_service, knowledge_doc_id
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_FORMATS = ("jsonl", "csv")
+
+
+def detect_format(filename):
+    """按扩展名判断文件格式：.csv 为 CSV，其余按 JSONL 处理"""
+    return "csv" if filename.lower().endswith(".csv") else "jsonl"
+
+
+def iter_records(stream, fmt="jsonl"):
+    """
+    逐行读取文本流，不把整个文件载入内存
+    JSONL 每行一个 {"title": .., "content": ..}；CSV 需包含 title、content 两列
+    解析失败的行产出 None，由调用方计入无效条数
+    """
+    if fmt == "csv":
+        for row in csv.DictReader(stream):
+            yield row
+        return
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            yield None
+
+
+class IngestCheckpoint:
+    """
+    断点文件：记录已处理到第几条记录及累计统计
+    每块写入 Chroma 与 MySQL 成功后才更新，中断后从最后一块之后继续
+    """
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.offset = 0
+        self.stats = None
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    payload = json.load(f)
+            except Exception as e:
+                logger.warning(f"读取断点文件失败，从头导入: {e}")
+                return
+            if payload.get("source") == source:
+                self.offset = payload.get("offset", 0)
+                self.stats = payload.get("stats")
+            else:
+                logger.info("导入文件已变化，忽略旧断点")
+
+    def save(self, offset, stats):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"source": self.source, "offset": offset, "stats": stats}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.offset = offset
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class IngestService:
+    def __init__(self):
+        self._ingested = metrics.counter("knowledge_ingested_total", "批量导入写入的知识条数")
+
+    def _existing_titles(self, k_type, namespace):
+        """一次查询取出命名空间下已有标题，代替逐条存在性检查"""
+        sql = "SELECT title FROM knowledge_base WHERE type = %s AND uuid = %s"
+        rows = db_manager.execute_query(sql, (k_type, namespace))
+        if rows is None:
+            raise ConnectionError("数据库不可用，无法导入知识库")
+        return {row["title"] for row in rows}
+
+    def _normalize(self, record, schema=None):
+        """
+        取出并校验 title / content，不合格的记录返回 None（计入无效条数）
+        标题超过 255 字符视为无效，不做截断；提供 schema（如 KnowledgeAddRequest）时按其规则校验
+        """
+        if not isinstance(record, dict):
+            return None
+        title = str(record.get("title") or "").strip()
+        content = str(record.get("content") or "").strip()
+        if not title or not content or len(title) > 255:
+            return None
+        if schema is not None:
+            try:
+                schema(title=title, content=content)
+            except Exception:
+                return None
+        return {"title": title, "content": content}
+
+    def _flush(self, uuid, k_type, namespace, items, embed_batch_size):
+        """
+        一块记录：批量向量化写入 Chroma，再一次多行 INSERT 写入 MySQL
+        MySQL 没有写入全部行时回滚本块向量并抛出异常，断点停在本块之前
+        """
+        vectors = rag_service.add_knowledge_bulk(uuid, items, k_type=k_type, embed_batch_size=embed_batch_size)
+        parent_ids = [knowledge_doc_id(namespace, item["title"], item["content"]) for item in items]
+        sql = "INSERT INTO knowledge_base (type, uuid, title, content, vector_id) VALUES (%s, %s, %s, %s, %s)"
+        try:
+            written = db_manager.execute_batch(sql, [
+                (k_type, namespace, item["title"], item["content"], parent_id if vectors else None)
+                for item, parent_id in zip(items, parent_ids)
+            ])
+            if written != len(items):
+                raise ConnectionError(f"写入 MySQL 失败：期望 {len(items)} 行，实际 {written} 行")
+        except Exception:
+            if vectors:
+                rag_service.delete_parents(namespace, parent_ids)
+            raise
+        self._ingested.inc(len(items))
+        return vectors
+
+    def ingest(self, records, uuid="public", k_type="public", chunk_size=RAG_WRITE_CHUNK_SIZE,
+               embed_batch_size=RAG_EMBED_BATCH_SIZE, checkpoint=None, progress=None, schema=None):
+        """
+        批量导入知识库
+        :param records: 可迭代的记录（dict），通常来自 iter_records
+        :param checkpoint: IngestCheckpoint，提供时跳过已完成的记录并在每块写入后更新
+        :param progress: 回调 progress(stats)，每块写入后调用
+        :param schema: 逐条校验记录的 pydantic 模型，为空时只检查非空与标题长度
+        :return: 统计信息 read / inserted / skipped / invalid / vectors / seconds / docs_per_second
+        :raises ConnectionError: 数据库不可用或写入失败，已写入的块保留在断点中
+        """
+        if not db_manager._available:
+            # 向量写入成功而 MySQL 没有对应行时，这些向量会在对账时被当作孤儿删除
+            raise ConnectionError("数据库不可用，无法导入知识库")
+        namespace = uuid if k_type == "private" else "public"
+        existing = self._existing_titles(k_type, namespace)
+        offset = checkpoint.offset if checkpoint else 0
+        stats = dict(checkpoint.stats) if checkpoint and checkpoint.stats else {
+            "read": 0, "inserted": 0, "skipped": 0, "invalid": 0, "vectors": 0
+        }
+        if offset:
+            logger.info(f"从断点继续导入：跳过前 {offset} 条记录")
+
+        started = time.perf_counter()
+        inserted_this_run = 0
+        pending = []
+        index = -1
+
+        def flush(next_offset):
+            nonlocal inserted_this_run
+            if pending:
+                stats["vectors"] += self._flush(uuid, k_type, namespace, pending, embed_batch_size)
+                stats["inserted"] += len(pending)
+                inserted_this_run += len(pending)
+                pending.clear()
+            elapsed = time.perf_counter() - started
+            stats["seconds"] = round(elapsed, 2)
+            stats["docs_per_second"] = round(inserted_this_run / elapsed, 1) if elapsed > 0 else 0.0
+            if checkpoint:
+                checkpoint.save(next_offset, stats)
+            if progress:
+                progress(stats)
+
+        for index, record in enumerate(records):
+            if index < offset:
+                continue
+            stats["read"] += 1
+            item = self._normalize(record, schema)
+            if item is None:
+                stats["invalid"] += 1
+                continue
+            # 已存在的标题（包括本文件中重复的）跳过
+            if item["title"] in existing:
+                stats["skipped"] += 1
+                continue
+            existing.add(item["title"])
+            pending.append(item)
+            if len(pending) >= chunk_size:
+                flush(index + 1)
+
+        flush(max(index + 1, offset))
+        if checkpoint:
+            checkpoint.clear()
+        logger.info(
+            f"知识库导入完成：读取 {stats['read']} 条，写入 {stats['inserted']} 条，"
+            f"跳过 {stats['skipped']} 条，无效 {stats['invalid']} 条，{stats['docs_per_second']} 条/秒"
+        )
+        return stats
+
+
+ingest_service = IngestService()
@@ -0,0 +1,274 @@
+import logging
+import math
+import queue
+import threading
+import time
+import traceback
+import uuid as uuid_module
+
+from config import JOB_QUEUE_SIZE, JOB_WORKERS, JOB_RESULT_TTL, KNOWLEDGE_BULK_QUEUE_SIZE
+from services.analysis_service import analysis_service
+from utils.cache import content_key
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+JOB_DURATION_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+
+# 服务耗时的指数滑动平均系数，以及尚无测量数据时的初始估计（秒）
+EWMA_ALPHA = 0.2
+INITIAL_SERVICE_TIME = 30.0
+
+
+class QueueFullError(Exception):
+    """任务队列已满"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"任务队列已满，请 {retry_after} 秒后重试")
+        self.retry_after = retry_after
+
+
+class AnalysisJob:
+    """
+    一次异步任务，事件按顺序追加，订阅方可以从任意位置开始读取
+    runner 为空时执行对话分析；否则执行 runner(job)（如知识库批量导入），由它设置结果并发布事件
+    """
+
+    def __init__(self, uuid, text, deep_thinking, session_id, key, runner=None):
+        self.job_id = str(uuid_module.uuid4())
+        self.runner = runner
+        self.uuid = uuid
+        self.text = text
+        self.deep_thinking = deep_thinking
+        self.session_id = session_id
+        self.key = key
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.events = []
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def publish(self, event, data):
+        with self._cond:
+            self.events.append((event, data))
+            self._cond.notify_all()
+
+    def wait_events(self, start, timeout=None):
+        """返回 start 之后的新事件；没有新事件时阻塞等待，超时返回空列表"""
+        with self._cond:
+            if len(self.events) <= start:
+                self._cond.wait(timeout)
+            return self.events[start:]
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobService:
+    """
+    异步分析任务队列
+    - 有界队列：满时拒绝新任务，并根据实测服务速率估算 retry-after
+    - 固定数量的工作线程执行分析（进入生成调度器后仍会被连续批处理合并）
+    - 完成的任务保留 TTL，期间相同请求（用户、会话、文本、模式相同）直接返回已有任务，不重复生成
+    任务保存在进程内存中，多 worker 部署时需保证同一用户的请求落在同一进程（如按 UUID 粘滞）
+    :param name: 指标与线程名前缀；不同类型的任务各用一个实例，互不占用工作线程，耗时估计也分开统计
+    """
+
+    def __init__(self, max_queue=JOB_QUEUE_SIZE, workers=JOB_WORKERS, ttl=JOB_RESULT_TTL,
+                 name="analysis", label="分析"):
+        self.name = name
+        self.workers = max(1, workers)
+        self.ttl = ttl
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._jobs = {}
+        self._by_key = {}
+        self._lock = threading.Lock()
+        self._service_time = INITIAL_SERVICE_TIME
+        self._started = False
+
+        self._queue_depth = metrics.gauge(f"{name}_jobs_queue_depth", f"排队中的{label}任务数")
+        self._rejected = metrics.counter(f"{name}_jobs_rejected_total", f"队列已满被拒绝的{label}任务数")
+        self._deduplicated = metrics.counter(f"{name}_jobs_deduplicated_total", f"命中已有{label}任务的重复提交数")
+        self._duration_hist = metrics.histogram(
+            f"{name}_jobs_duration_seconds", f"{label}任务从开始执行到完成的耗时", buckets=JOB_DURATION_BUCKETS
+        )
+
+    def _ensure_workers(self):
+        # 首次提交时才启动工作线程，导入本模块不产生副作用
+        with self._lock:
+            if self._started:
+                return
+            for i in range(self.workers):
+                threading.Thread(target=self._run, name=f"{self.name}-job-{i}", daemon=True).start()
+            self._started = True
+
+    @property
+    def service_rate(self):
+        """每秒可完成的任务数"""
+        return self.workers / max(self._service_time, 1e-3)
+
+    def retry_after(self):
+        """队列已满时，预计多久会空出一个位置（秒）"""
+        return max(1, math.ceil(1.0 / self.service_rate))
+
+    def estimated_wait(self, position):
+        """排在第 position 位的任务预计等待时间（秒）"""
+        return math.ceil(position / self.service_rate)
+
+    def _purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished_at is not None and now - job.finished_at > self.ttl
+            ]
+            for job_id in expired:
+                job = self._jobs.pop(job_id)
+                if self._by_key.get(job.key) is job:
+                    del self._by_key[job.key]
+
+    def submit(self, uuid, text, deep_thinking=False, session_id=None):
+        """
+        提交分析任务
+        :return: (job, 是否复用了已有任务)
+        :raises QueueFullError: 队列已满
+        """
+        key = content_key(uuid, session_id or "", text, str(bool(deep_thinking)))
+        return self._enqueue(key, lambda: AnalysisJob(uuid, text, deep_thinking, session_id, key))
+
+    def submit_task(self, uuid, key, runner):
+        """
+        提交其他耗时任务（在本实例的队列与工作线程中执行，如知识库批量导入），key 相同的未失败任务直接复用
+        :return: (job, 是否复用了已有任务)
+        :raises QueueFullError: 队列已满
+        """
+        key = content_key(uuid, key)
+        return self._enqueue(key, lambda: AnalysisJob(uuid, None, False, None, key, runner=runner))
+
+    def _enqueue(self, key, make_job):
+        self._ensure_workers()
+        self._purge_expired()
+
+        with self._lock:
+            existing = self._by_key.get(key)
+            if existing is not None and existing.status != FAILED:
+                self._deduplicated.inc()
+                return existing, True
+
+            job = make_job()
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self._rejected.inc()
+                raise QueueFullError(self.retry_after())
+            self._jobs[job.job_id] = job
+            self._by_key[key] = job
+        self._queue_depth.set(self._queue.qsize())
+        return job, False
+
+    def get(self, uuid, job_id):
+        """按 ID 获取任务，只能查询自己的任务"""
+        self._purge_expired()
+        job = self._jobs.get(job_id)
+        if job is None or job.uuid != uuid:
+            return None
+        return job
+
+    def queue_position(self, job):
+        """任务在队列中的大致位置（从 1 开始）"""
+        if job.status != QUEUED:
+            return 0
+        with self._queue.mutex:
+            for idx, queued in enumerate(self._queue.queue):
+                if queued is job:
+                    return idx + 1
+        return 0
+
+    def events(self, job, start=0, heartbeat=15):
+        """
+        按顺序产出任务事件 (event, data)，先重放已有事件再实时推送，产出 end 事件后停止
+        长时间没有新事件时产出 (None, None) 作为心跳
+        """
+        position = start
+        while True:
+            new_events = job.wait_events(position, timeout=heartbeat)
+            for event, data in new_events:
+                yield event, data
+                if event == "end":
+                    return
+            position += len(new_events)
+            if not new_events:
+                yield None, None
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            self._queue_depth.set(self._queue.qsize())
+            job.status = RUNNING
+            job.started_at = time.time()
+            try:
+                if job.runner is not None:
+                    job.runner(job)
+                else:
+                    self._execute(job)
+            except Exception as e:
+                logger.error(traceback.format_exc())
+                job.error = f"服务器内部错误：{str(e)}"
+                job.status = FAILED
+                job.publish("error", {"code": 500, "msg": job.error})
+
+            job.finished_at = time.time()
+            duration = job.finished_at - job.started_at
+            self._duration_hist.observe(duration)
+            self._service_time += EWMA_ALPHA * (duration - self._service_time)
+            # 唤醒仍在等待的订阅方
+            job.publish("end", {"status": job.status})
+
+    def _execute(self, job):
+        meta = {}
+        for event, data in analysis_service.analyze_stream(
+            job.uuid, job.text, deep_thinking=job.deep_thinking, session_id=job.session_id
+        ):
+            if event == "meta":
+                meta = data
+            elif event == "done":
+                job.result = {
+                    "original_text": job.text,
+                    "emotion": meta.get("emotion"),
+                    "risk": meta.get("risk"),
+                    "advice": data["advice"],
+                    "context_used": meta.get("context_used", False),
+                    "deep_thinking": job.deep_thinking,
+                    "session_id": data["session_id"],
+                }
+                job.status = DONE
+            elif event == "error":
+                job.error = data.get("msg")
+                job.status = FAILED
+            job.publish(event, data)
+        if not job.finished:
+            job.status = FAILED
+            job.error = job.error or "分析未正常结束"
+
+
+job_service = JobService()
+# 知识库批量导入：单独的单线程队列，长时间导入不占用分析工作线程，也不影响分析任务的等待时间估计
+ingest_job_service = JobService(
+    max_queue=KNOWLEDGE_BULK_QUEUE_SIZE, workers=1, name="knowledge_ingest", label="知识库导入"
+)
@@ -1,18 +1,18 @@
 import logging
 from datetime import datetime
 from database import db_manager
-from rag_service import rag_service
+from rag_service import rag_service, knowledge_doc_id
 
 logger = logging.getLogger(__name__)
 
 class KnowledgeService:
     def add_knowledge(self, uuid, title, content):
         """添加个人知识库"""
-        success = rag_service.add_knowledge(uuid, title, content, k_type="private")
-        if success:
-            # 同时存入MySQL方便列表展示
-            sql = "INSERT INTO knowledge_base (type, uuid, title, content) VALUES ('private', %s, %s, %s)"
-            db_manager.execute_update(sql, (uuid, title, content))
+        vector_id = rag_service.add_knowledge(uuid, title, content, k_type="private")
+        if vector_id:
+            # 同时存入MySQL方便列表展示，记录向量库文档 ID 以便删除时同步删除
+            sql = "INSERT INTO knowledge_base (type, uuid, title, content, vector_id) VALUES ('private', %s, %s, %s, %s)"
+            db_manager.execute_update(sql, (uuid, title, content, vector_id))
             return {"code": 200, "msg": "添加成功", "data": None}
         else:
             return {"code": 500, "msg": "添加失败"}
@@ -33,9 +33,21 @@ class KnowledgeService:
     def delete_knowledge(self, uuid, knowledge_id):
         """删除知识库条目"""
         # 只能删除自己的私有知识
+        sql = "SELECT title, content, vector_id FROM knowledge_base WHERE id=%s AND uuid=%s AND type='private'"
+        rows = db_manager.execute_query(sql, (knowledge_id, uuid))
         sql = "DELETE FROM knowledge_base WHERE id=%s AND uuid=%s AND type='private'"
-        affected = db_manager.execute_update(sql, (knowledge_id, uuid))
+        affected = db_manager.execute_update(sql, (knowledge_id, uuid)) if rows else 0
         if affected and affected > 0:
+            # 向量库删除失败时留下的孤儿向量由对账任务清理
+            row = rows[0]
+            vector_id = row["vector_id"] or knowledge_doc_id(uuid, row["title"], row["content"])
+            # 内容哈希 ID（批量导入、旧版本的单条添加、对账补写）可能被多条记录共用，仍有记录引用时保留其分块
+            shared = bool(db_manager.execute_query(
+                "SELECT id FROM knowledge_base WHERE vector_id=%s LIMIT 1", (vector_id,)
+            ))
+            rag_service.delete_knowledge(
+                uuid, vector_id, title=row["title"], shared=shared, legacy=not row["vector_id"]
+            )
             return {"code": 200, "msg": "删除成功"}
         else:
             return {"code": 404, "msg": "删除失败：未找到记录或无权操作"}
@@ -57,7 +69,7 @@ class KnowledgeService:
 
     def search_knowledge(self, uuid, query):
         """搜索知识库"""
-        docs = rag_service.search(query, uuid)
+        docs = rag_service.search(uuid, query)
         results = []
         for doc in docs:
             results.append({
@@ -0,0 +1,145 @@
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from config import KNOWLEDGE_RECONCILE_INTERVAL, KNOWLEDGE_RECONCILE_GRACE
+from database import db_manager
+from rag_service import rag_service, knowledge_doc_id, SCL90_REPORT_TITLE
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+# 每批之间让出 CPU 与数据库连接，避免影响在线请求
+BATCH_PAUSE = 0.05
+
+
+class ReconcileService:
+    """
+    knowledge_base 与向量库的对账：
+    向量库中找不到对应 knowledge_base 行的块（孤儿向量）被删除；
+    有行但没有向量的知识只统计，不重新向量化
+    """
+
+    def __init__(self):
+        self.last_report = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._orphan_gauge = metrics.gauge("knowledge_drift_orphan_vectors", "上次对账发现的孤儿向量块数")
+        self._missing_gauge = metrics.gauge("knowledge_drift_missing_vectors", "上次对账发现的缺少向量的知识条数")
+        self._deleted_counter = metrics.counter("knowledge_orphan_vectors_deleted_total", "对账删除的孤儿向量块数")
+
+    def _mysql_keys(self):
+        """按主键分批读取 knowledge_base，返回 {知识 ID}，并为旧数据补写 vector_id"""
+        keys = set()
+        backfill = []
+        last_id = 0
+        sql = (
+            "SELECT id, type, uuid, title, content, vector_id FROM knowledge_base "
+            "WHERE id > %s ORDER BY id LIMIT %s"
+        )
+        while True:
+            rows = db_manager.execute_query(sql, (last_id, BATCH_SIZE))
+            if rows is None:
+                raise ConnectionError("数据库不可用")
+            for row in rows:
+                vector_id = row["vector_id"]
+                if not vector_id:
+                    namespace = row["uuid"] if row["type"] == "private" else "public"
+                    vector_id = knowledge_doc_id(namespace, row["title"] or "", row["content"] or "")
+                    backfill.append((vector_id, row["id"]))
+                keys.add(vector_id)
+            if len(rows) < BATCH_SIZE:
+                break
+            last_id = rows[-1]["id"]
+            time.sleep(BATCH_PAUSE)
+        return keys, backfill
+
+    def run(self, dry_run=False):
+        """
+        执行一次对账，返回漂移报告
+        先扫描向量库再扫描 MySQL，且跳过宽限期内写入的向量：
+        添加知识时先写向量库后写 MySQL，刚写入的向量可能还没有对应行
+        """
+        if rag_service.vector_store is None:
+            return None
+        if not self._lock.acquire(blocking=False):
+            logger.info("对账任务正在执行，跳过本次")
+            return None
+        try:
+            started = time.perf_counter()
+            cutoff = (datetime.now() - timedelta(seconds=KNOWLEDGE_RECONCILE_GRACE)).isoformat()
+
+            vectors = {}
+            recent = 0
+            for index, (doc_id, parent_id, metadata) in enumerate(rag_service.iter_vector_keys(BATCH_SIZE)):
+                if index and index % BATCH_SIZE == 0:
+                    time.sleep(BATCH_PAUSE)
+                # SCL-90 摘要只存在于向量库，不参与对账（旧版本写入的没有 parent_id，按标题识别）
+                if metadata.get("title") == SCL90_REPORT_TITLE:
+                    continue
+                if (metadata.get("timestamp") or "") > cutoff:
+                    recent += 1
+                    continue
+                vectors.setdefault(parent_id, []).append((doc_id, metadata.get("uuid")))
+
+            keys, backfill = self._mysql_keys()
+            orphans = [doc for parent_id, docs in vectors.items() if parent_id not in keys for doc in docs]
+            missing = len(keys - set(vectors))
+
+            deleted = 0
+            backfilled = 0
+            if not dry_run:
+                for i in range(0, len(orphans), BATCH_SIZE):
+                    batch = orphans[i:i + BATCH_SIZE]
+                    deleted += rag_service.delete_vectors(
+                        [doc_id for doc_id, _ in batch], [namespace for _, namespace in batch]
+                    )
+                    time.sleep(BATCH_PAUSE)
+                if backfill:
+                    backfilled = db_manager.execute_batch(
+                        "UPDATE knowledge_base SET vector_id = %s WHERE id = %s", backfill
+                    )
+                self._deleted_counter.inc(deleted)
+
+            report = {
+                "vector_documents": len(vectors),
+                "mysql_rows": len(keys),
+                "orphan_vectors": len(orphans),
+                "missing_vectors": missing,
+                "skipped_recent": recent,
+                "deleted": deleted,
+                "backfilled": backfilled,
+                "dry_run": dry_run,
+                "seconds": round(time.perf_counter() - started, 2),
+                "finished_at": datetime.now().isoformat(timespec="seconds"),
+            }
+            self._orphan_gauge.set(len(orphans))
+            self._missing_gauge.set(missing)
+            self.last_report = report
+            logger.info(
+                f"知识库对账完成：孤儿向量 {len(orphans)} 块（已删除 {deleted}），"
+                f"缺少向量的知识 {missing} 条，耗时 {report['seconds']}s"
+            )
+            return report
+        finally:
+            self._lock.release()
+
+    def _loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.run()
+            except Exception as e:
+                logger.error(f"知识库对账失败: {e}")
+
+    def start(self, interval=KNOWLEDGE_RECONCILE_INTERVAL):
+        """启动后台定时对账，interval 为 0 时不启动"""
+        if interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name="knowledge-reconcile", daemon=True)
+        self._thread.start()
+
+
+reconcile_service = ReconcileService()
@@ -0,0 +1,51 @@
+import requests
+import uuid
+
+BASE_URL = "http://localhost:5000/api"
+TEST_UUID = str(uuid.uuid4())
+HEADERS = {"X-User-UUID": TEST_UUID}
+
+TEXTS = [
+    "今天和朋友去操场跑步，心情不错。",
+    "下周就要考试了，我紧张得睡不着。",
+    "我觉得自己什么都做不好，活着没意思。",
+]
+
+def test_emotion_batch():
+    print(f"Testing POST {BASE_URL}/emotion/batch...")
+    payload = {"texts": TEXTS, "top_k": 2}
+    try:
+        response = requests.post(f"{BASE_URL}/emotion/batch", json=payload, headers=HEADERS)
+        data = response.json()
+        if data['code'] == 200:
+            results = data['data']['results']
+            print(f"✅ Batch analysis successful. Count: {len(results)}, persisted: {data['data']['persisted']}")
+            for r in results:
+                print(f"   - {r['text'][:12]}... => {r['emotion']} / {r['risk']} top_k={r['top_k']}")
+            if len(results) != len(TEXTS):
+                print("❌ Result count does not match input count")
+            elif any(abs(sum(r['probabilities'].values()) - 1.0) > 1e-3 for r in results):
+                print("❌ Probabilities do not sum to 1")
+            else:
+                print("✅ Probability distributions verified.")
+        elif data['code'] == 503:
+            print("⚠️ Emotion model not loaded (ENABLE_EMOTION_ANALYSIS=False?)")
+        else:
+            print(f"❌ Batch analysis failed: {data}")
+    except Exception as e:
+        print(f"❌ Batch analysis error: {e}")
+
+def test_emotion_batch_validation():
+    print(f"Testing POST {BASE_URL}/emotion/batch with empty texts...")
+    try:
+        response = requests.post(f"{BASE_URL}/emotion/batch", json={"texts": []}, headers=HEADERS)
+        if response.status_code == 400:
+            print("✅ Empty batch rejected (400)")
+        else:
+            print(f"❌ Unexpected status: {response.status_code} - {response.text}")
+    except Exception as e:
+        print(f"❌ Validation test error: {e}")
+
+if __name__ == "__main__":
+    test_emotion_batch()
+    test_emotion_batch_validation()
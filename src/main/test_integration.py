@@ -1,4 +1,5 @@
 import requests
+import time
 import json
 import uuid
 
@@ -87,7 +88,73 @@ def test_analysis_mock():
     except Exception as e:
         print(f"❌ Request failed: {e}")
 
+def test_analysis_stream():
+    print(f"\nTesting Analysis Stream (UUID: {TEST_UUID})...")
+    url = f"{BASE_URL}/api/mental_analysis/stream"
+    headers = {"Content-Type": "application/json", "X-User-UUID": TEST_UUID}
+    payload = {"text": "最近总是失眠，白天上课也没精神。"}
+    
+    try:
+        response = requests.post(url, headers=headers, json=payload, stream=True)
+        if response.status_code != 200:
+            print(f"❌ HTTP Error: {response.status_code}")
+            return
+        events = []
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                events.append((event, json.loads(line[len("data: "):])))
+        names = [e for e, _ in events]
+        print(f"Received {len(events)} events: meta={names.count('meta')}, token={names.count('token')}, done={names.count('done')}")
+        if names and names[0] == "meta" and names[-1] == "done" and "token" in names:
+            print("✅ Stream event order verified (meta -> token* -> done).")
+            print(f"Session ID: {events[-1][1]['session_id']}")
+        else:
+            print(f"❌ Unexpected event sequence: {names}")
+    except Exception as e:
+        print(f"❌ Request failed: {e}")
+
+def test_analysis_job():
+    print(f"\nTesting Analysis Job (UUID: {TEST_UUID})...")
+    url = f"{BASE_URL}/api/mental_analysis/jobs"
+    headers = {"Content-Type": "application/json", "X-User-UUID": TEST_UUID}
+    payload = {"text": "室友关系紧张，我不知道该怎么沟通。"}
+    
+    try:
+        response = requests.post(url, headers=headers, json=payload)
+        if response.status_code == 429:
+            print(f"⚠️ Queue full, Retry-After: {response.headers.get('Retry-After')}")
+            return
+        if response.status_code != 202:
+            print(f"❌ HTTP Error: {response.status_code}")
+            return
+        job_id = response.json()['data']['job_id']
+        print(f"Job submitted: {job_id}")
+
+        # 重复提交应返回同一个任务
+        again = requests.post(url, headers=headers, json=payload).json()
+        if again['data']['job_id'] == job_id:
+            print("✅ Duplicate submission reused the existing job.")
+        else:
+            print("❌ Duplicate submission created a new job")
+
+        for _ in range(120):
+            job = requests.get(f"{url}/{job_id}", headers=headers).json()['data']
+            if job['status'] in ("done", "failed"):
+                break
+            time.sleep(1)
+        if job['status'] == "done":
+            print(f"✅ Job completed. Advice: {job['result']['advice'][:50]}...")
+        else:
+            print(f"❌ Job not completed: {job['status']} {job.get('error')}")
+    except Exception as e:
+        print(f"❌ Request failed: {e}")
+
 if __name__ == "__main__":
     test_knowledge_list()
     test_scl90_questions()
     test_analysis_mock()
+    test_analysis_stream()
+    test_analysis_job()
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def normalize_text(text: str) -> str:
+    """缓存键归一化：NFKC 全半角统一、去首尾空白、合并连续空白"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return " ".join(text.split())
+
+
+def content_key(*parts: str) -> str:
+    """多个字符串片段拼接后的 sha256，作为内容寻址的缓存键"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def directory_fingerprint(directory: str) -> str:
+    """根据目录下文件的名称、大小与修改时间生成指纹，文件有任何变化指纹都会不同"""
+    entries = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append(f"{os.path.relpath(path, directory)}:{stat.st_size}:{int(stat.st_mtime)}")
+    return "|".join(sorted(entries))
+
+
+class LRUCache:
+    """
+    线程安全的 LRU + TTL 缓存
+    命中、未命中、淘汰次数同时记录到 metrics，便于在 /metrics 观察命中率
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None, name: str = "cache"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._hit_counter = metrics.counter(f"{name}_hits_total", "缓存命中次数")
+        self._miss_counter = metrics.counter(f"{name}_misses_total", "缓存未命中次数")
+        self._eviction_counter = metrics.counter(f"{name}_evictions_total", "缓存淘汰次数（容量或过期）")
+        self._size_gauge = metrics.gauge(f"{name}_size", "缓存当前条目数")
+        self._hit_rate_gauge = metrics.gauge(f"{name}_hit_rate", "缓存命中率")
+
+    def _expired(self, expires_at: Optional[float], now: float) -> bool:
+        return expires_at is not None and expires_at <= now
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and self._expired(entry[1], now):
+                del self._data[key]
+                self.evictions += 1
+                self._eviction_counter.inc()
+                entry = _MISSING
+            if entry is _MISSING:
+                self.misses += 1
+                self._miss_counter.inc()
+                self._size_gauge.set(len(self._data))
+                self._hit_rate_gauge.set(self.hits / (self.hits + self.misses))
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            self._hit_counter.inc()
+            self._hit_rate_gauge.set(self.hits / (self.hits + self.misses))
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+                self._eviction_counter.inc()
+            self._size_gauge.set(len(self._data))
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            self._size_gauge.set(len(self._data))
+        return default if entry is _MISSING else entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._size_gauge.set(0)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def dump(self, path: str, version: str = "") -> int:
+        """将未过期条目按 LRU 顺序写入 JSON 文件（键与值需可 JSON 序列化），返回写入条数"""
+        now = time.time()
+        with self._lock:
+            entries = [
+                [key, value, expires_at]
+                for key, (value, expires_at) in self._data.items()
+                if not self._expired(expires_at, now)
+            ]
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "entries": entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return len(entries)
+
+    def load(self, path: str, version: str = "") -> int:
+        """从 JSON 文件恢复条目；版本不一致时丢弃整个文件，返回恢复条数"""
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except Exception as e:
+            logger.warning(f"读取缓存文件失败 {path}: {e}")
+            return 0
+        if payload.get("version") != version:
+            logger.info(f"缓存文件版本已变化，丢弃: {path}")
+            return 0
+
+        now = time.time()
+        loaded = 0
+        with self._lock:
+            for key, value, expires_at in payload.get("entries", [])[-self.maxsize:]:
+                if self._expired(expires_at, now):
+                    continue
+                self._data[key] = (value, expires_at)
+                loaded += 1
+            self._size_gauge.set(len(self._data))
+        return loaded
@@ -0,0 +1,134 @@
+import re
+from typing import Callable, List, Optional
+
+# 句末标点（含紧随其后的引号、括号）与换行作为一级切分点
+SENTENCE_END = re.compile(r"([。！？!?；;…]+[”’」』）)]*|\n+)")
+# 句子仍然过长时，在逗号、顿号、冒号处二次切分
+CLAUSE_END = re.compile(r"([，,、：:]+)")
+CJK_CHAR = re.compile(r"[㐀-鿿豈-﫿]")
+ASCII_WORD = re.compile(r"[A-Za-z0-9]+")
+# 近似 token 的原文片段：至多 4 个字符的字母数字串、空白串、其余单个字符（汉字、符号）
+APPROX_PIECE = re.compile(r"[A-Za-z0-9]{1,4}|\s+|.", re.S)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    无分词器时估算 BERT 中文分词后的 token 数：
+    汉字各算 1 个，连续字母数字按约 4 字符 1 个，其余可见符号各算 1 个
+    """
+    cjk = len(CJK_CHAR.findall(text))
+    ascii_tokens = sum((len(w) + 3) // 4 for w in ASCII_WORD.findall(text))
+    others = len(re.sub(r"\s", "", CJK_CHAR.sub("", ASCII_WORD.sub("", text))))
+    return cjk + ascii_tokens + others
+
+
+class ApproxTokenizer:
+    """
+    没有本地分词器时（远程生成后端）使用的近似分词器，计数规则与 estimate_tokens 基本一致
+    产出的 "token" 是原文片段，拼接即得原文，可以直接交给 PromptAssembler 按 token 预算截断
+    """
+
+    def __call__(self, texts, add_special_tokens=False):
+        return {"input_ids": [APPROX_PIECE.findall(text) for text in texts]}
+
+
+def _split_keep(pattern: re.Pattern, text: str) -> List[str]:
+    """按分隔符切分，分隔符保留在前一段末尾"""
+    parts = pattern.split(text)
+    pieces = []
+    for i in range(0, len(parts), 2):
+        piece = parts[i] + (parts[i + 1] if i + 1 < len(parts) else "")
+        if piece.strip():
+            pieces.append(piece)
+    return pieces
+
+
+def split_sentences(text: str) -> List[str]:
+    """按句末标点与换行切句，标点保留在句尾"""
+    return [s.strip() for s in _split_keep(SENTENCE_END, text or "") if s.strip()]
+
+
+def join_sentences(source: str, sentences: List[str]) -> str:
+    """
+    把从 source 中切出（按原文顺序选取）的句子重新拼接：
+    每句后面补回原文中紧随其后、切句时被去掉的空白（换行、空格），不会把两行粘成一行
+    """
+    pieces = []
+    pos = 0
+    for sentence in sentences:
+        found = source.find(sentence, pos)
+        if found < 0:
+            pieces.append(sentence)
+            continue
+        end = found + len(sentence)
+        gap = re.match(r"\s*", source[end:]).group()
+        pieces.append(sentence + gap)
+        pos = end
+    return "".join(pieces).strip()
+
+
+class TextChunker:
+    """
+    中文分块：按句子与标点边界切分，贪心合并到目标 token 数，相邻块保留少量重叠句子
+    :param max_tokens: 每块的目标上限（应不超过向量模型的最大序列长度）
+    :param overlap_tokens: 相邻块之间重叠的 token 数上限
+    :param length_fn: 计算 token 数的函数，默认使用 estimate_tokens
+    """
+
+    def __init__(self, max_tokens: int = 120, overlap_tokens: int = 20,
+                 length_fn: Optional[Callable[[str], int]] = None):
+        self.max_tokens = max(1, max_tokens)
+        self.overlap_tokens = max(0, min(overlap_tokens, self.max_tokens // 2))
+        self.length_fn = length_fn or estimate_tokens
+
+    def _hard_split(self, text: str) -> List[str]:
+        """没有可用标点时按长度硬切，按估算的字符/ token 比例逐步缩短"""
+        pieces = []
+        while text:
+            end = len(text)
+            while end > 1 and self.length_fn(text[:end]) > self.max_tokens:
+                end = max(1, end * self.max_tokens // self.length_fn(text[:end]))
+            pieces.append(text[:end])
+            text = text[end:]
+        return pieces
+
+    def _units(self, text: str) -> List[str]:
+        """切成不超过 max_tokens 的最小单元：句子 → 分句 → 硬切"""
+        units = []
+        for sentence in _split_keep(SENTENCE_END, text):
+            if self.length_fn(sentence) <= self.max_tokens:
+                units.append(sentence)
+                continue
+            for clause in _split_keep(CLAUSE_END, sentence):
+                if self.length_fn(clause) <= self.max_tokens:
+                    units.append(clause)
+                else:
+                    units.extend(self._hard_split(clause))
+        return units
+
+    def split(self, text: str) -> List[str]:
+        text = (text or "").strip()
+        if not text:
+            return []
+        if self.length_fn(text) <= self.max_tokens:
+            return [text]
+
+        units = self._units(text)
+        lengths = [self.length_fn(u) for u in units]
+        chunks = []
+        start = 0
+        while start < len(units):
+            end, total = start, 0
+            while end < len(units) and (end == start or total + lengths[end] <= self.max_tokens):
+                total += lengths[end]
+                end += 1
+            chunks.append("".join(units[start:end]).strip())
+            if end >= len(units):
+                break
+            # 下一块从末尾若干句开始，重叠不超过 overlap_tokens，且必须向前推进
+            next_start, overlap = end, 0
+            while next_start - 1 > start and overlap + lengths[next_start - 1] <= self.overlap_tokens:
+                next_start -= 1
+                overlap += lengths[next_start]
+            start = next_start
+        return [c for c in chunks if c]
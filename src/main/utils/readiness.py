@@ -0,0 +1,69 @@
+import threading
+import time
+
+PENDING = "pending"
+LOADING = "loading"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+DISABLED = "disabled"
+
+# 处于这些状态的组件尚不能处理请求，依赖它的接口返回 503
+BUSY_STATES = (PENDING, LOADING, WARMING)
+
+
+class ComponentState:
+    def __init__(self, name: str, state: str = PENDING):
+        self.name = name
+        self.state = state
+        self.detail = None
+        self.error = None
+        self.since = time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "detail": self.detail,
+            "error": self.error,
+            "elapsed": round(time.time() - self.since, 1),
+        }
+
+
+class Readiness:
+    """各后端组件（数据库、情感模型、大模型）的加载状态"""
+
+    def __init__(self):
+        self._components = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, state: str = PENDING) -> None:
+        with self._lock:
+            self._components.setdefault(name, ComponentState(name, state))
+
+    def set(self, name: str, state: str, detail: str = None, error: str = None) -> None:
+        with self._lock:
+            component = self._components.setdefault(name, ComponentState(name))
+            if component.state != state:
+                component.since = time.time()
+            component.state = state
+            component.detail = detail
+            component.error = error
+
+    def state(self, name: str) -> str:
+        component = self._components.get(name)
+        return component.state if component else None
+
+    def is_busy(self, name: str) -> bool:
+        return self.state(name) in BUSY_STATES
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {name: c.to_dict() for name, c in self._components.items()}
+
+    def all_settled(self) -> bool:
+        """所有组件都已结束加载（就绪、失败降级或被禁用）"""
+        with self._lock:
+            return all(c.state not in BUSY_STATES for c in self._components.values())
+
+
+readiness = Readiness()
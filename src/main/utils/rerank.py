@@ -0,0 +1,61 @@
+import numpy as np
+
+
+def normalize_rows(vectors):
+    """按行 L2 归一化，零向量保持为零"""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def cosine_scores(query_vector, doc_vectors):
+    """查询向量与每个文档向量的余弦相似度，与向量库使用的距离度量无关"""
+    if len(doc_vectors) == 0:
+        return np.zeros(0, dtype=np.float32)
+    return normalize_rows(doc_vectors) @ normalize_rows(query_vector)[0]
+
+
+def select_within_budget(query_vector, sentence_vectors, lengths, budget):
+    """
+    抽取式压缩：按与查询的余弦相似度从高到低选句，直到总长度达到 budget
+    放不下的句子跳过，继续尝试更短的句子
+    :return: 被选中的下标（升序，即保持原文顺序）
+    """
+    if len(sentence_vectors) == 0:
+        return []
+    scores = cosine_scores(query_vector, sentence_vectors)
+    selected, used = [], 0
+    for idx in np.argsort(-scores, kind="stable"):
+        if used + lengths[idx] <= budget:
+            selected.append(int(idx))
+            used += lengths[idx]
+    return sorted(selected)
+
+
+def mmr(query_vector, doc_vectors, top_n, lambda_mult=0.7, relevance=None):
+    """
+    最大边际相关 (MMR) 重排：每次选出 λ·相关度 − (1−λ)·与已选文档最大相似度 最高的文档，
+    避免多条内容几乎相同的知识一起进入 Prompt
+    :param relevance: 预先计算好的相关度（余弦相似度），为空时现算
+    :return: 被选中的下标列表，按选择顺序
+    """
+    if len(doc_vectors) == 0 or top_n <= 0:
+        return []
+    docs = normalize_rows(doc_vectors)
+    relevance = cosine_scores(query_vector, docs) if relevance is None else np.asarray(relevance, dtype=np.float32)
+    similarity = docs @ docs.T
+
+    selected = [int(np.argmax(relevance))]
+    max_sim = similarity[selected[0]].copy()
+    candidates = np.ones(len(docs), dtype=bool)
+    candidates[selected[0]] = False
+    while len(selected) < min(top_n, len(docs)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_sim
+        scores[~candidates] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        candidates[best] = False
+        max_sim = np.maximum(max_sim, similarity[best])
+    return selected
@@ -0,0 +1,54 @@
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def rss_bytes():
+    """当前进程的常驻内存 (RSS)，无法获取时返回 None"""
+    if psutil is not None:
+        return psutil.Process(os.getpid()).memory_info().rss
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        # 只能拿到峰值 RSS：Linux 单位为 KB，macOS 为字节
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+
+def file_rss_bytes():
+    """
+    常驻内存中由文件映射的部分（Linux 的 RssFile），mmap 读入且未被复制的模型权重计在这里
+    无法获取时返回 None
+    """
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("RssFile:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def format_bytes(num):
+    if num is None:
+        return "未知"
+    for unit in ("B", "KB", "MB", "GB"):
+        if num < 1024 or unit == "GB":
+            return f"{num:.1f}{unit}" if unit != "B" else f"{num}B"
+        num /= 1024
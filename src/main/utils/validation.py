@@ -6,6 +6,8 @@ from typing import Optional, Callable, Any
 from flask import request, jsonify
 from pydantic import BaseModel, Field, field_validator
 
+from config import EMOTION_BATCH_MAX_TEXTS
+
 logger = logging.getLogger(__name__)
 
 
@@ -31,6 +33,7 @@ class SCL90SubmitRequest(BaseModel):
 class MentalAnalysisRequest(BaseModel):
     text: str = Field(..., min_length=1, max_length=5000)
     deep_thinking: bool = False
+    timeout: Optional[float] = Field(default=None, gt=0)
     
     @field_validator('text')
     @classmethod
@@ -41,6 +44,25 @@ class MentalAnalysisRequest(BaseModel):
         return v
 
 
+class EmotionBatchRequest(BaseModel):
+    texts: list[str] = Field(..., min_length=1, max_length=EMOTION_BATCH_MAX_TEXTS)
+    top_k: int = Field(default=3, ge=1, le=5)
+    persist: bool = True
+
+    @field_validator('texts')
+    @classmethod
+    def sanitize_texts(cls, v):
+        cleaned = []
+        for idx, text in enumerate(v):
+            text = text.strip()
+            if not text:
+                raise ValueError(f"第 {idx + 1} 条文本不能为空")
+            if len(text) > 5000:
+                raise ValueError(f"第 {idx + 1} 条文本超过 5000 字符")
+            cleaned.append(text)
+        return cleaned
+
+
 class KnowledgeAddRequest(BaseModel):
     title: str = Field(..., min_length=1, max_length=255)
     content: str = Field(..., min_length=1, max_length=10000)
@@ -96,6 +118,27 @@ def validate_uuid(f: Callable) -> Callable:
     return decorated_function
 
 
+def require_ready(*components: str):
+    """依赖的模型仍在加载或预热时直接返回 503，避免请求在加载锁上长时间挂起"""
+    def decorator(f: Callable) -> Callable:
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            from utils.readiness import readiness
+            busy = [name for name in components if readiness.is_busy(name)]
+            if busy:
+                snapshot = readiness.snapshot()
+                response = jsonify({
+                    "code": 503,
+                    "msg": "模型正在加载，请稍后重试",
+                    "data": {"components": {name: snapshot.get(name) for name in busy}}
+                })
+                response.headers["Retry-After"] = "10"
+                return response, 503
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
 def sanitize_input(text: str, max_length: int = 5000) -> str:
     if not text:
         return ""
@@ -0,0 +1,57 @@
+import threading
+import time
+
+from advice_generator import AdviceGenerator, DISCLAIMER
+from generation_scheduler import GenerationScheduler
+from utils.metrics import metrics
+
+REQUEST = {
+    "user_text": "最近压力很大，晚上睡不着。",
+    "emotion": "焦虑",
+    "risk": "低风险",
+}
+
+generator = AdviceGenerator(model_dir='mock')
+scheduler = GenerationScheduler(generator, max_batch_size=3)
+expected = generator.generate(**REQUEST).strip()
+
+# 1. 并发提交，结果应与直接生成一致
+results = [None] * 8
+
+def worker(i):
+    results[i] = scheduler.generate(timeout=30, **REQUEST)
+
+threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(results))]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+
+print(f"Concurrent requests: {len(results)}, all match: {all(r == expected for r in results)}")
+
+# 2. 流式输出拼接后应与完整结果一致
+pieces = list(scheduler.stream(**REQUEST))
+print(f"Stream pieces: {len(pieces)}, joined matches: {''.join(pieces).strip() == expected}")
+
+# 3. 深度思考模式
+deep = scheduler.generate(timeout=30, deep_thinking=True, **REQUEST)
+print(f"Deep thinking marker present: {'深度思考' in deep}")
+
+# 4. 截止时间已过 / 请求已取消：不再预填充，只返回免责声明，并计入指标
+expired = scheduler.generate(timeout=30, deadline=time.time() - 1, **REQUEST)
+print(f"Expired deadline returns disclaimer only: {expired == DISCLAIMER}")
+cancel_event = threading.Event()
+cancel_event.set()
+cancelled = scheduler.generate(timeout=30, cancel_event=cancel_event, **REQUEST)
+print(f"Cancelled request returns disclaimer only: {cancelled == DISCLAIMER}")
+
+snapshot = metrics.snapshot()
+print(f"Deadline exceeded: {snapshot['generation_deadline_exceeded_total']['value']}, cancelled: {snapshot['generation_cancelled_total']['value']}")
+batch = snapshot["generation_scheduler_active_batch_size"]
+latency = snapshot["generation_scheduler_request_latency_seconds"]
+print(f"Decode steps: {batch['count']}, mean active batch size: {batch['mean']}")
+print(f"Completed requests: {latency['count']}, mean latency: {latency['mean']}s")
+print(f"Max batch size respected: {batch['buckets']['3'] == batch['count']}")
+print(f"Queue depth now: {scheduler.queue_depth}, active now: {scheduler.active_batch_size}")
+
+scheduler.stop()
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from llm_backend import OpenAICompatibleBackend
+from llm_stub_server import start_stub_server, STUB_REPLY
+from utils.metrics import metrics
+
+SYSTEM_PROMPT = "你是一位资深心理咨询师。"
+USER_PROMPT = "最近快期末考试了，我每天晚上都睡不着。"
+ARGS = (SYSTEM_PROMPT, USER_PROMPT, 256, 0.7, 0.9)
+
+server, state = start_stub_server(token_delay=0.01)
+base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+backend = OpenAICompatibleBackend(base_url=base_url, max_connections=2, max_retries=5)
+
+# 1. 流式输出拼接后与完整回复一致
+pieces = list(backend.stream_chat(*ARGS))
+print(f"Stream pieces: {len(pieces)}, joined matches: {''.join(pieces) == STUB_REPLY}")
+
+# 2. 并发请求：每个主机最多 2 个并发连接，连接被复用
+results = [None] * 8
+
+def worker(i):
+    results[i] = backend.generate_chat(*ARGS)
+
+threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(results))]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+print(f"Concurrent requests: {len(results)}, all match: {all(r == STUB_REPLY for r in results)}")
+print(f"Max concurrent on stub: {state.max_active} (limit 2), connections opened: {backend.pool().created}")
+
+# 3. 注入 503，重试后仍全部成功
+state.fail_rate = 0.5
+ok = sum(backend.generate_chat(*ARGS) == STUB_REPLY for _ in range(10))
+state.fail_rate = 0.0
+print(f"With 50% injected failures: {ok}/10 succeeded, stub failures: {state.failures}, "
+      f"retries: {metrics.snapshot()['llm_http_retries_total']['value']}")
+
+# 4. 取消：读到第一段后设置取消信号，流立即结束
+cancel_event = threading.Event()
+received = []
+for piece in backend.stream_chat(*ARGS, cancel_event=cancel_event):
+    received.append(piece)
+    cancel_event.set()
+print(f"Cancelled stream stopped after {len(received)} piece(s)")
+
+# 5. 截止时间：慢速输出时在截止时间返回已生成的部分
+state.token_delay = 0.05
+started = time.time()
+partial = backend.generate_chat(*ARGS, deadline=started + 0.3)
+print(f"Deadline stream returned {len(partial)} chars in {time.time() - started:.2f}s (partial: {len(partial) < len(STUB_REPLY)})")
+
+# 6. 等待连接期间到达截止时间：与生成中途超时一样结束，不抛出 BackendError
+pool = backend.pool()
+held = [pool.acquire() for _ in range(backend.max_connections)]
+started = time.time()
+waited = backend.generate_chat(*ARGS, deadline=started + 0.2)
+for conn, _ in held:
+    pool.release(conn)
+print(f"Deadline while waiting for a connection returned {len(waited)} chars in {time.time() - started:.2f}s")
+
+backend.close()
+server.shutdown()
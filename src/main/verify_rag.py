@@ -0,0 +1,165 @@
+import numpy as np
+
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from rag_service import rag_service, knowledge_doc_id
+from services import reconcile_service as reconcile_module
+from utils.chunking import TextChunker, estimate_tokens, split_sentences
+from utils.rerank import mmr, select_within_budget
+
+# 向量库替身：只实现本脚本用到的 Chroma 集合接口（按 ID / 元数据过滤的 get、delete、upsert）
+def matches(metadata, where):
+    for key, value in (where or {}).items():
+        if key == "$and":
+            if not all(matches(metadata, clause) for clause in value):
+                return False
+        elif isinstance(value, dict):
+            if metadata.get(key) not in value["$in"]:
+                return False
+        elif metadata.get(key) != value:
+            return False
+    return True
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = {}
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        for doc_id, embedding, document, metadata in zip(ids, embeddings, documents, metadatas):
+            self.docs[doc_id] = (embedding, document, metadata)
+
+    def get(self, ids=None, where=None, include=(), limit=None, offset=0):
+        keys = [doc_id for doc_id in (self.docs if ids is None else ids)
+                if doc_id in self.docs and matches(self.docs[doc_id][2], where)]
+        keys = keys[offset:offset + limit if limit else None]
+        return {
+            "ids": keys,
+            "embeddings": [self.docs[doc_id][0] for doc_id in keys],
+            "documents": [self.docs[doc_id][1] for doc_id in keys],
+            "metadatas": [self.docs[doc_id][2] for doc_id in keys],
+        }
+
+    def delete(self, ids=None, where=None):
+        for doc_id in self.get(ids=ids, where=where)["ids"]:
+            del self.docs[doc_id]
+
+
+class FakeStore:
+    def __init__(self):
+        self._collection = FakeCollection()
+
+    def add_texts(self, texts, metadatas, ids):
+        self._collection.upsert(ids, [[1.0, 0.0]] * len(ids), texts, metadatas)
+
+
+class FakeDB:
+    _available = True
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.updates = []
+
+    def execute_query(self, sql, params=None):
+        last_id, limit = params
+        return [row for row in self.rows if row["id"] > last_id][:limit]
+
+    def execute_batch(self, sql, data):
+        self.updates.extend(data)
+        return len(data)
+
+
+# 1. 分块：每块不超过上限，相邻块有重叠，且总能向前推进（无标点长文本也能切完）
+chunker = TextChunker(max_tokens=40, overlap_tokens=16)
+text = "".join(f"第{i}句话讲的是如何调节情绪。" for i in range(12))
+chunks = chunker.split(text)
+print(f"Chunks: {len(chunks)}, all within limit: {all(estimate_tokens(c) <= 40 for c in chunks)}")
+overlapping = all(split_sentences(a)[-1] in b for a, b in zip(chunks, chunks[1:]))
+covered = all(any(s in c for c in chunks) for s in split_sentences(text))
+print(f"Adjacent chunks overlap: {overlapping}, every sentence covered: {covered}")
+long_run = "放松" * 200
+hard = chunker.split(long_run)
+print(f"Unpunctuated text split into {len(hard)} chunks, progress made: {''.join(hard) == long_run}")
+
+# 2. 词法索引：删除打墓碑后不再命中，idf 只计未删除文档；同一 ID 删除后可按新内容重新加入
+index = LexicalIndex()
+index.add(["a-0", "b-0", "c-0"], ["焦虑失眠", "焦虑", "运动"],
+          [{"uuid": "public", "parent_id": p} for p in "abc"])
+index.remove_parent("a")
+hits = [doc_id for doc_id, _, _, _ in index.search("焦虑", ["public"])]
+print(f"Tombstoned doc skipped: {hits == ['b-0']}, live df: {index._df['焦虑'] == 1}, size: {len(index)}")
+index.add(["a-0"], ["失眠多梦"], [{"uuid": "public", "parent_id": "a"}])
+hits = [doc_id for doc_id, _, _, _ in index.search("失眠", ["public"])]
+stale = [doc_id for doc_id, _, _, _ in index.search("焦虑", ["public"])]
+print(f"Re-added doc searchable with new text: {hits == ['a-0']}, old text no longer matches: {stale == ['b-0']}")
+for i in range(1000):
+    index.remove_parent("a")
+    index.add(["a-0"], [f"第{i}次失眠"], [{"uuid": "public", "parent_id": "a"}])
+print(f"Repeated rewrites compacted: size {len(index)}, stored docs {len(index._texts)}, "
+      f"bounded: {len(index._texts) <= len(index) + 65}")
+
+# 3. 命名空间隔离：只返回公共知识与本人的私有知识
+index = LexicalIndex()
+index.add(["p-0", "u1-0", "u2-0"], ["睡眠卫生建议", "我的睡眠日记", "他人的睡眠日记"],
+          [{"uuid": ns, "parent_id": ns} for ns in ("public", "u1", "u2")])
+hits = {doc_id for doc_id, _, _, _ in index.search("睡眠", ("public", "u1"))}
+print(f"Namespace isolation: {hits == {'p-0', 'u1-0'}}")
+
+# 4. 融合与重排：RRF 偏向两路都靠前的文档；MMR 不同时选两条相同内容；压缩不超过预算且保持原文顺序
+fused = reciprocal_rank_fusion([["x", "y", "z"], ["y", "w"]])
+print(f"RRF puts doc found by both first: {fused[0] == 'y'}")
+query = np.array([1.0, 0.0])
+picked = mmr(query, np.array([[1.0, 0.1], [1.0, 0.1], [0.9, 0.44]]), top_n=2, lambda_mult=0.3)
+print(f"MMR skips duplicate: {sorted(picked) == [0, 2]}")
+kept = select_within_budget(query, np.array([[0.2, 1.0], [1.0, 0.0], [0.9, 0.1]]), [5, 5, 5], budget=10)
+print(f"Budget selection: {kept == [1, 2]}")
+
+# 5. 重复保存相同内容：每条记录有各自的 parent_id，删除一条不影响另一条
+rag_service.vector_store = FakeStore()
+collection = rag_service.vector_store._collection
+first = rag_service.add_knowledge("u1", "日记", "今天有点焦虑。")
+second = rag_service.add_knowledge("u1", "日记", "今天有点焦虑。")
+rag_service.delete_knowledge("u1", first, title="日记")
+remaining = {metadata["parent_id"] for _, _, metadata in collection.docs.values()}
+print(f"Duplicate saves get distinct ids: {first != second}, other row kept after delete: {remaining == {second}}")
+
+# 6. 分块之前写入的旧文档（随机 ID、无 parent_id）：按推算 ID 删除，只删一条
+legacy = {"uuid": "u1", "type": "private", "title": "旧日记", "timestamp": "2000-01-01T00:00:00"}
+collection.upsert(["lc-1", "lc-2"], [[1.0, 0.0]] * 2, ["以前的记录。"] * 2, [dict(legacy), dict(legacy)])
+rag_service.delete_knowledge("u1", knowledge_doc_id("u1", "旧日记", "以前的记录。"), title="旧日记")
+print(f"Legacy delete removes exactly one doc: {len([d for d in collection.docs if d.startswith('lc-')]) == 1}")
+
+# 同一内容既有旧文档又被批量导入（parent_id 同为内容推算 ID）：删除旧记录只删旧文档，保留导入的块
+bulk_id = knowledge_doc_id("u1", "旧日记", "以前的记录。")
+collection.upsert([f"{bulk_id}-0"], [[1.0, 0.0]], ["以前的记录。"], [dict(legacy, parent_id=bulk_id)])
+rag_service.delete_knowledge("u1", bulk_id, title="旧日记", legacy=True)
+print(f"Legacy row delete keeps bulk chunks: {f'{bulk_id}-0' in collection.docs}, "
+      f"legacy doc gone: {not any(d.startswith('lc-') for d in collection.docs)}")
+collection.upsert(["lc-3"], [[1.0, 0.0]], ["以前的记录。"], [dict(legacy)])
+rag_service.delete_knowledge("u1", bulk_id, title="旧日记", shared=True)
+print(f"Backfilled legacy row delete removes its doc: {'lc-3' not in collection.docs}, "
+      f"bulk chunks kept: {f'{bulk_id}-0' in collection.docs}")
+
+# 7. 对账：有对应记录的向量（含没有 vector_id 的旧记录）一律保留，只删除孤儿
+collection.docs.clear()
+old = "2000-01-01T00:00:00"
+collection.upsert(
+    ["row1-0", "row1-1", "lc-9", "orphan-0"],
+    [[1.0, 0.0]] * 4,
+    ["块一", "块二", "旧知识内容", "已删除的知识"],
+    [
+        {"uuid": "public", "type": "public", "title": "t1", "timestamp": old, "parent_id": "row1"},
+        {"uuid": "public", "type": "public", "title": "t1", "timestamp": old, "parent_id": "row1"},
+        {"uuid": "u1", "type": "private", "title": "旧", "timestamp": old},
+        {"uuid": "u1", "type": "private", "title": "删", "timestamp": old, "parent_id": "gone"},
+    ],
+)
+fake_db = FakeDB([
+    {"id": 1, "type": "public", "uuid": None, "title": "t1", "content": "块一块二", "vector_id": "row1"},
+    {"id": 2, "type": "private", "uuid": "u1", "title": "旧", "content": "旧知识内容", "vector_id": None},
+])
+reconcile_module.db_manager = fake_db
+report = reconcile_module.ReconcileService().run()
+print(f"Reconcile deleted only the orphan: {sorted(collection.docs) == ['lc-9', 'row1-0', 'row1-1']}, "
+      f"report: orphans={report['orphan_vectors']}, missing={report['missing_vectors']}, backfilled={report['backfilled']}")
+
+rag_service.vector_store = None